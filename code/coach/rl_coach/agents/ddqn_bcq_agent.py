@@ -156,7 +156,7 @@ class DDQNBCQAgent(DQNAgent):
             imitation_model_loss = 0
             total_transitions_processed = 0
             for i, batch in enumerate(self.call_memory('get_shuffled_training_data_generator', batch_size)):
-                batch = Batch(batch)
+                batch = batch if isinstance(batch, Batch) else Batch(batch)
 
                 # reward model
                 if epoch < epochs:
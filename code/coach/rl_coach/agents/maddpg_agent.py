@@ -317,7 +317,7 @@ class MADDPGAgent(ActorCriticAgent):
                 # training step
                 if len(batch) > 0:
                     # train
-                    batch = Batch(batch)
+                    batch = batch if isinstance(batch, Batch) else Batch(batch)
                     total_loss, losses, unclipped_grads = self.learn_from_batch(batch)
                     loss += total_loss
 
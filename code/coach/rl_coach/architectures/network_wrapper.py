@@ -97,6 +97,15 @@ class NetworkWrapper(object):
                                                   spaces=spaces,
                                                   network_is_trainable=False)
 
+        if self.network_parameters.framework == Frameworks.tensorflow:
+            # build the in-graph weight copies of sync and of the soft target updates while the graph can still be
+            # modified (the graph is finalized when the session is created in distributed training)
+            if self.global_network:
+                self.online_network.create_weights_update_op(self.global_network.get_weights())
+            if self.target_network:
+                for rate in {1.0, self.ap.algorithm.rate_for_copying_weights_to_target}:
+                    self.target_network.create_weights_update_op(self.online_network.get_weights(), rate)
+
     def sync(self):
         """
         Initializes the weights of the networks to match each other
@@ -115,6 +124,20 @@ class NetworkWrapper(object):
         if self.target_network:
             self.target_network.set_weights(self.online_network.get_weights(), rate)
 
+    def get_target_network_update_op(self, rate=1.0):
+        """
+        Get the in-graph op of update_target_network (TensorFlow only). It can be added to the fetches of a training
+        step to update the target network without a session run of its own. Within a single session run, the update
+        is not ordered with respect to the gradient step, so the target network blends in the online weights of either
+        before or after the step.
+
+        :param rate: the rate of copying the weights - 1 for copying exactly
+        :return: the update op, or None if there is no target network
+        """
+        if self.target_network:
+            return self.target_network.create_weights_update_op(self.online_network.get_weights(), rate)
+        return None
+
     def update_online_network(self, rate=1.0):
         """
         Copy weights: global network >>> online network
@@ -22,6 +22,7 @@ import tensorflow as tf
 
 from rl_coach.architectures.architecture import Architecture
 from rl_coach.architectures.tensorflow_components.savers import GlobalVariableSaver
+from rl_coach.architectures.tensorflow_components.utils import soft_update_op
 from rl_coach.base_parameters import AgentParameters, DistributedTaskParameters
 from rl_coach.core_types import GradientClippingMethod
 from rl_coach.saver import SaverCollection
@@ -82,6 +83,7 @@ class TensorFlowArchitecture(Architecture):
         self.total_loss = None
         self.trainable_weights = []
         self.weights_placeholders = []
+        self.weights_update_ops = {}
         self.shared_accumulated_gradients = []
         self.curr_rnn_c_in = None
         self.curr_rnn_h_in = None
@@ -595,10 +597,39 @@ class TensorFlowArchitecture(Architecture):
         """
         return self.weights
 
+    def create_weights_update_op(self, weights: List[tf.Variable], rate: float=1.0) -> tf.Operation:
+        """
+        Creates (once for every source and rate) the in-graph op that set_weights runs for the variables of another
+        network, so that the weights are blended with a single session run instead of being fetched and fed back.
+        Ops that are needed once the graph is finalized (e.g. in distributed training) must be created beforehand.
+
+        :param weights: the variables of the source network, in the order of get_weights
+        :param rate: the rate of copying the weights - 1 for copying exactly
+        :return: the update op, which can also be run together with other fetches
+        """
+        key = (tuple(weight.name for weight in weights), float(rate))
+        if key not in self.weights_update_ops:
+            self.weights_update_ops[key] = soft_update_op(self.weights, weights, rate)
+        return self.weights_update_ops[key]
+
+    def _get_weights_update_op(self, weights, rate):
+        # the in-graph update op for the given weights, if they are variables and the op exists or can still be created
+        if not all(isinstance(weight, tf.Variable) for weight in weights):
+            return None
+        key = (tuple(weight.name for weight in weights), float(rate))
+        if key not in self.weights_update_ops and self.sess.graph.finalized:
+            return None
+        return self.create_weights_update_op(weights, rate)
+
     def set_weights(self, weights, new_rate=1.0):
         """
         Sets the network weights from the given list of weights tensors
         """
+        update_op = self._get_weights_update_op(weights, new_rate)
+        if update_op is not None:
+            self.sess.run(update_op)
+            return
+
         feed_dict = {}
         old_weights, new_weights = self.sess.run([self.get_weights(), weights])
         for placeholder_idx, new_weight in enumerate(new_weights):
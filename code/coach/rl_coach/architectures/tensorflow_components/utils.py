@@ -44,4 +44,23 @@ def squeeze_tensor(tensor):
     if tensor.shape[0] == 1:
         return tensor[0]
     else:
-        return tensor
\ No newline at end of file
+        return tensor
+
+def soft_update_op(target_weights, source_weights, rate: float=1.0) -> tf.Operation:
+    """
+    Create an op that blends the source variables into the target variables in the graph, i.e.
+    target = rate * source + (1 - rate) * target, without copying the weights through the host
+    :param target_weights: the variables to update
+    :param source_weights: the variables to copy from, in the same order and with the same shapes
+    :param rate: the rate of copying the weights - 1 for copying exactly
+    :return: a single op grouping the assignments of all the variables
+    """
+    assert len(target_weights) == len(source_weights), \
+        "Expected {} source weights, got {}".format(len(target_weights), len(source_weights))
+    with tf.name_scope('soft_update'):
+        if rate == 1.0:
+            updates = [target.assign(source) for target, source in zip(target_weights, source_weights)]
+        else:
+            updates = [target.assign(rate * source + (1 - rate) * target)
+                       for target, source in zip(target_weights, source_weights)]
+        return tf.group(*updates)
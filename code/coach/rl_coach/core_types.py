@@ -23,6 +23,7 @@ from typing import List, Union, Dict, Any, Type
 
 import numpy as np
 
+from rl_coach.returns import n_step_returns
 from rl_coach.utils import force_list
 
 ActionType = Union[int, float, np.ndarray, List]
@@ -642,6 +643,283 @@ class Batch(object):
         """
         self.transitions[key] = item
 
+    def __len__(self):
+        """
+        :return: the size of the batch
+        """
+        return self.size
+
+
+def stack_column(values: list) -> np.ndarray:
+    """
+    Stack the values of a single parameter of a list of transitions into one contiguous array, where the first
+    dimension is the index of the transition. Values that cannot be stacked (e.g. of different shapes) are kept in an
+    object array.
+
+    :param values: the values to stack
+    :return: a numpy array of len(values) rows
+    """
+    try:
+        return np.array(values)
+    except ValueError:
+        column = np.empty(len(values), dtype=object)
+        for i, value in enumerate(values):
+            column[i] = value
+        return column
+
+
+class ColumnarBatch(Batch):
+    """
+    A batch that holds each of the parameters of its transitions as a single contiguous array (a column), where the
+    first dimension is the index of the transition. Memories that keep their transitions in arrays can produce it
+    directly, instead of creating Transition objects that the batch then stacks again one value at a time.
+    Shuffling and slicing the batch only permute or cut an index array over the columns, and each accessor gathers the
+    rows of a column once. The accessors are the same as those of Batch. The transitions themselves are only created
+    (from the columns) when the transitions list or an item of the batch is accessed, and changes made to them are not
+    written back to the columns.
+    """
+    def __init__(self, states: Dict[str, np.ndarray], actions: np.ndarray, rewards: np.ndarray=None,
+                 next_states: Dict[str, np.ndarray]=None, game_overs: np.ndarray=None,
+                 n_step_discounted_rewards: np.ndarray=None, goals: np.ndarray=None,
+                 info: Dict[str, np.ndarray]=None):
+        """
+        :param states: a dictionary with a (batch_size, ...) array for each of the state keys
+        :param actions: a (batch_size, ...) array of actions
+        :param rewards: a (batch_size,) array of rewards
+        :param next_states: a dictionary with a (batch_size, ...) array for each of the next state keys. if not given,
+                            the next states are the states, as in Transition
+        :param game_overs: a (batch_size,) array of game over flags
+        :param n_step_discounted_rewards: a (batch_size,) array of n step discounted rewards
+        :param goals: a (batch_size, ...) array of goals
+        :param info: a dictionary with a (batch_size, ...) array for each of the info keys
+        """
+        super().__init__(None)
+        self.state_columns = states
+        self.next_state_columns = states if not next_states else next_states
+        self.action_column = actions
+        self.reward_column = rewards
+        self.game_over_column = game_overs
+        self.n_step_discounted_reward_column = n_step_discounted_rewards
+        self.goal_column = goals
+        self.info_columns = {} if info is None else info
+        self._num_rows = len(actions)
+        # the rows of the columns that form the batch, in order (None for all the rows)
+        self._index = None
+
+    @classmethod
+    def from_transitions(cls, transitions: List[Transition]) -> 'ColumnarBatch':
+        """
+        Create a columnar batch from a list of transitions, stacking each of their parameters once
+
+        :param transitions: a list of transitions with the same state, next state and info keys
+        :return: a ColumnarBatch holding the parameters of the transitions
+        """
+        first = transitions[0]
+        columns = {
+            'states': {key: stack_column([t.state[key] for t in transitions]) for key in first.state.keys()},
+            'actions': stack_column([t.action for t in transitions]),
+            'rewards': stack_column([t.reward for t in transitions]),
+            'next_states': {key: stack_column([t.next_state[key] for t in transitions])
+                            for key in first.next_state.keys()},
+            'game_overs': stack_column([t.game_over for t in transitions]),
+            'info': {key: stack_column([t.info[key] for t in transitions]) for key in first.info.keys()}
+        }
+        if first._n_step_discounted_rewards is not None:
+            columns['n_step_discounted_rewards'] = stack_column([t.n_step_discounted_rewards for t in transitions])
+        return cls(**columns)
+
+    @property
+    def transitions(self) -> List[Transition]:
+        """
+        :return: the transitions of the batch, created from the columns on the first access
+        """
+        if self._transitions is None:
+            self._transitions = [self._transition(row) for row in self._rows()]
+        return self._transitions
+
+    @transitions.setter
+    def transitions(self, transitions: List[Transition]):
+        self._transitions = transitions
+
+    def _rows(self) -> np.ndarray:
+        return np.arange(self._num_rows) if self._index is None else self._index
+
+    def _gather(self, column: np.ndarray) -> np.ndarray:
+        return column if self._index is None else column[self._index]
+
+    def _transition(self, row: int) -> Transition:
+        transition = Transition(state={key: column[row] for key, column in self.state_columns.items()},
+                                action=self.action_column[row],
+                                reward=None if self.reward_column is None else self.reward_column[row],
+                                next_state={key: column[row] for key, column in self.next_state_columns.items()},
+                                game_over=None if self.game_over_column is None else self.game_over_column[row],
+                                info={key: column[row] for key, column in self.info_columns.items()})
+        if self.n_step_discounted_reward_column is not None:
+            transition.n_step_discounted_rewards = self.n_step_discounted_reward_column[row]
+        return transition
+
+    def _reset_cache(self) -> None:
+        self._states = {}
+        self._actions = None
+        self._rewards = None
+        self._n_step_discounted_rewards = None
+        self._game_overs = None
+        self._next_states = {}
+        self._goals = None
+        self._info = {}
+
+    def slice(self, start, end) -> None:
+        """
+        Keep a slice from the batch and discard the rest of the batch
+
+        :param start: the start index in the slice
+        :param end: the end index in the slice
+        :return: None
+        """
+        self._index = self._rows()[start:end]
+        if self._transitions is not None:
+            self._transitions = self._transitions[start:end]
+        self._reset_cache()
+
+    def shuffle(self) -> None:
+        """
+        Shuffle all the transitions in the batch
+
+        :return: None
+        """
+        batch_order = np.random.permutation(self.size)
+        self._index = self._rows()[batch_order]
+        if self._transitions is not None:
+            self._transitions = [self._transitions[i] for i in batch_order]
+        self._reset_cache()
+
+    def states(self, fetches: List[str], expand_dims=False) -> Dict[str, np.ndarray]:
+        """
+        gather the columns of the keys in fetches from the states in the batch if these keys were not already gathered
+        before. return only the values corresponding to those keys
+
+        :param fetches: the keys of the state dictionary to extract
+        :param expand_dims: add an extra dimension to each of the value batches
+        :return: a dictionary containing a batch of values correponding to each of the given fetches keys
+        """
+        current_states = {}
+        for key in set(fetches).intersection(self.state_columns.keys()):
+            if key not in self._states.keys():
+                self._states[key] = self._gather(self.state_columns[key])
+            current_states[key] = np.expand_dims(self._states[key], -1) if expand_dims else self._states[key]
+        return current_states
+
+    def next_states(self, fetches: List[str], expand_dims=False) -> Dict[str, np.ndarray]:
+        """
+        gather the columns of the keys in fetches from the next states in the batch if these keys were not already
+        gathered before. return only the values corresponding to those keys
+
+        :param fetches: the keys of the state dictionary to extract
+        :param expand_dims: add an extra dimension to each of the value batches
+        :return: a dictionary containing a batch of values correponding to each of the given fetches keys
+        """
+        next_states = {}
+        for key in set(fetches).intersection(self.next_state_columns.keys()):
+            if key not in self._next_states.keys():
+                self._next_states[key] = self._gather(self.next_state_columns[key])
+            next_states[key] = np.expand_dims(self._next_states[key], -1) if expand_dims else self._next_states[key]
+        return next_states
+
+    def actions(self, expand_dims=False) -> np.ndarray:
+        """
+        if the actions were not gathered before, gather them from their column and then return the batch
+
+        :param expand_dims: add an extra dimension to the actions batch
+        :return: a numpy array containing all the actions of the batch
+        """
+        if self._actions is None:
+            self._actions = self._gather(self.action_column)
+        return np.expand_dims(self._actions, -1) if expand_dims else self._actions
+
+    def rewards(self, expand_dims=False) -> np.ndarray:
+        """
+        if the rewards were not gathered before, gather them from their column and then return the batch
+
+        :param expand_dims: add an extra dimension to the rewards batch
+        :return: a numpy array containing all the rewards of the batch
+        """
+        if self._rewards is None:
+            if self.reward_column is None:
+                raise Exception("The reward was not filled by any of the modules between the environment and the agent")
+            self._rewards = self._gather(self.reward_column)
+        return np.expand_dims(self._rewards, -1) if expand_dims else self._rewards
+
+    def n_step_discounted_rewards(self, expand_dims=False) -> np.ndarray:
+        """
+        if the n_step_discounted_rewards were not gathered before, gather them from their column and then return the
+        batch. if the n step discounted rewards were not filled, this will raise an exception
+
+        :param expand_dims: add an extra dimension to the total_returns batch
+        :return: a numpy array containing all the total return values of the batch
+        """
+        if self._n_step_discounted_rewards is None:
+            if self.n_step_discounted_reward_column is None:
+                raise Exception("The n_step_discounted_rewards were not filled by any of the modules between the "
+                                "environment and the agent.  Make sure that you are using an episodic experience "
+                                "replay.")
+            self._n_step_discounted_rewards = self._gather(self.n_step_discounted_reward_column)
+        return np.expand_dims(self._n_step_discounted_rewards, -1) if expand_dims else self._n_step_discounted_rewards
+
+    def game_overs(self, expand_dims=False) -> np.ndarray:
+        """
+        if the game_overs were not gathered before, gather them from their column and then return the batch
+
+        :param expand_dims: add an extra dimension to the game_overs batch
+        :return: a numpy array containing all the game over flags of the batch
+        """
+        if self._game_overs is None:
+            if self.game_over_column is None:
+                raise Exception("The done flag was not filled by any of the modules between the environment and the "
+                                "agent")
+            self._game_overs = self._gather(self.game_over_column)
+        return np.expand_dims(self._game_overs, -1) if expand_dims else self._game_overs
+
+    def goals(self, expand_dims=False) -> np.ndarray:
+        """
+        if the goals were not gathered before, gather them from their column and then return the batch
+        if the goal was not filled, this will raise an exception
+
+        :param expand_dims: add an extra dimension to the goals batch
+        :return: a numpy array containing all the goals of the batch
+        """
+        if self._goals is None:
+            if self.goal_column is None:
+                raise Exception("The goals were not filled by any of the modules between the environment and the agent")
+            self._goals = self._gather(self.goal_column)
+        return np.expand_dims(self._goals, -1) if expand_dims else self._goals
+
+    def info_as_list(self, key) -> list:
+        """
+        get the info values of the given key as a list
+        :param key: the key of the info dictionary
+        :return: a list containing all the info values of the batch corresponding to the given key
+        """
+        return list(self.info(key))
+
+    def info(self, key, expand_dims=False) -> np.ndarray:
+        """
+        if the given info dictionary key was not gathered before, gather it from its column and then return the
+        batch. if the key is not part of the keys in the info dictionary, this will raise an exception
+
+        :param expand_dims: add an extra dimension to the info batch
+        :return: a numpy array containing all the info values of the batch corresponding to the given key
+        """
+        if key not in self._info.keys():
+            self._info[key] = self._gather(self.info_columns[key])
+        return np.expand_dims(self._info[key], -1) if expand_dims else self._info[key]
+
+    @property
+    def size(self) -> int:
+        """
+        :return: the size of the batch
+        """
+        return self._num_rows if self._index is None else len(self._index)
+
 
 class TotalStepsCounter(object):
     """
@@ -771,6 +1049,8 @@ class Episode(object):
 
         :return: None
         """
+        if self.length() == 0:
+            return
         if self.n_step == -1 or self.n_step > self.length():
             curr_n_step = self.length()
         else:
@@ -778,18 +1058,12 @@ class Episode(object):
 
         rewards = np.array([t.reward for t in self.transitions])
         rewards = rewards.astype('float')
-        discounted_rewards = rewards.copy()
-        current_discount = self.discount
-        for i in range(1, curr_n_step):
-            discounted_rewards += current_discount * np.pad(rewards[i:], (0, i), 'constant', constant_values=0)
-            current_discount *= self.discount
 
         # calculate the bootstrapped returns
+        bootstraps = None
         if self.bootstrap_total_return_from_old_policy:
             bootstraps = np.array([np.squeeze(t.info['max_action_value']) for t in self.transitions[curr_n_step:]])
-            bootstrapped_return = discounted_rewards + current_discount * np.pad(bootstraps, (0, curr_n_step),
-                                                                                 'constant', constant_values=0)
-            discounted_rewards = bootstrapped_return
+        discounted_rewards = n_step_returns(rewards, self.discount, curr_n_step, bootstraps)
 
         for transition_idx in range(self.length()):
             self.transitions[transition_idx].n_step_discounted_rewards = discounted_rewards[transition_idx]
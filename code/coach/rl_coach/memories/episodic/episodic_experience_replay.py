@@ -17,6 +17,7 @@
 import ast
 
 import pickle
+from collections import deque
 from copy import deepcopy
 
 import math
@@ -26,9 +27,10 @@ from typing import List, Tuple, Union
 import numpy as np
 import random
 
-from rl_coach.core_types import Transition, Episode
+from rl_coach.core_types import Transition, Episode, ColumnarBatch
 from rl_coach.filters.filter import InputFilter
 from rl_coach.logger import screen
+from rl_coach.memories.episodic.transition_arrays import TransitionArrays
 from rl_coach.memories.memory import Memory, MemoryGranularity, MemoryParameters
 from rl_coach.utils import ReaderWriterLock, ProgressBar
 from rl_coach.core_types import CsvDataset
@@ -40,6 +42,7 @@ class EpisodicExperienceReplayParameters(MemoryParameters):
         self.max_size = (MemoryGranularity.Transitions, 1000000)
         self.n_step = -1
         self.train_to_eval_ratio = 1  # for OPE we'll want a value < 1
+        self.array_storage = False
 
     @property
     def path(self):
@@ -51,16 +54,30 @@ class EpisodicExperienceReplay(Memory):
     A replay buffer that stores episodes of transitions. The additional structure allows performing various
     calculations of total return and other values that depend on the sequential behavior of the transitions
     in the episode.
+
+    With array storage, the transitions of the complete episodes are also stored column-wise in circular arrays
+    (see TransitionArrays), in the order of the episodes, instead of in a flat list of transitions. Removing the oldest
+    episode then takes constant time, and sampling gathers a batch from the arrays and returns it as a ColumnarBatch
+    instead of a list of transitions. The episodes themselves are kept for the episode based API. The arrays hold a
+    copy of the observations, so array storage is meant for vector observations rather than lazily stacked frames.
     """
 
     def __init__(self, max_size: Tuple[MemoryGranularity, int] = (MemoryGranularity.Transitions, 1000000), n_step=-1,
-                 train_to_eval_ratio: int = 1):
+                 train_to_eval_ratio: int = 1, array_storage: bool = False):
         """
         :param max_size: the maximum number of transitions or episodes to hold in the memory
+        :param array_storage: store the transitions of the complete episodes in circular arrays. the episodes keep
+                              their transitions for the episode based API, so the observations are held twice, once
+                              in the transitions and once in the arrays, which about doubles the memory footprint
         """
         super().__init__(max_size)
         self.n_step = n_step
         self._buffer = [Episode(n_step=self.n_step)]  # list of episodes
+        self.transition_arrays = TransitionArrays() if array_storage else None
+        # the episodes whose transitions are in the transition arrays, in the order of their rows
+        self._stored_episodes = deque()
+        # with array storage, the flat list of transitions is only built on demand, once after each change
+        self._flat_transitions = None
         self.transitions = []
         self._length = 1  # the episodic replay buffer starts with a single empty episode
         self._num_transitions = 0
@@ -84,6 +101,31 @@ class EpisodicExperienceReplay(Memory):
 
         return length
 
+    @property
+    def transitions(self) -> List[Transition]:
+        """
+        All the transitions in the memory, in the order in which they were stored. The list must not be modified
+        """
+        if self.transition_arrays is not None:
+            if self._flat_transitions is None:
+                self._flat_transitions = [t for e in self._buffer for t in e.transitions]
+            return self._flat_transitions
+        return self._transitions
+
+    @transitions.setter
+    def transitions(self, transitions: List[Transition]) -> None:
+        self._transitions = transitions
+
+    def _get_transitions(self, transitions_idx) -> Union[List[Transition], ColumnarBatch]:
+        """
+        Get the transitions of the complete episodes at the given indices
+        :param transitions_idx: the indices of the transitions
+        :return: a list of transitions, or a ColumnarBatch with array storage
+        """
+        if self.transition_arrays is not None:
+            return self.transition_arrays.gather(transitions_idx)
+        return [self._transitions[i] for i in transitions_idx]
+
     def num_complete_episodes(self):
         """ Get the number of complete episodes in ER """
         length = self._length - 1
@@ -109,10 +151,12 @@ class EpisodicExperienceReplay(Memory):
         of samples available in the replay buffer then the batch will return empty.
         :param size: the size of the batch to sample
         :param is_consecutive_transitions: if set True, samples a batch of consecutive transitions.
-        :return: a batch (list) of selected transitions from the replay buffer
+        :return: a batch (list) of selected transitions from the replay buffer. with array storage, a batch of
+                 transitions that are not consecutive is returned as a ColumnarBatch
         """
         self.reader_writer_lock.lock_writing()
 
+        located = None
         if self.num_complete_episodes() >= 1:
             if is_consecutive_transitions:
                 episode_idx = np.random.randint(0, self.num_complete_episodes())
@@ -123,14 +167,29 @@ class EpisodicExperienceReplay(Memory):
                     batch = self._buffer[episode_idx].transitions[transition_idx - size:transition_idx]
             else:
                 transitions_idx = np.random.randint(self.num_transitions_in_complete_episodes(), size=size)
-                batch = [self.transitions[i] for i in transitions_idx]
+                if self.transition_arrays is not None:
+                    # the rows are copied after releasing the lock, so that other readers can sample meanwhile
+                    located = self.transition_arrays.locate(transitions_idx)
+                else:
+                    batch = self._get_transitions(transitions_idx)
 
         else:
+            self.reader_writer_lock.release_writing()
             raise ValueError("The episodic replay buffer cannot be sampled since there are no complete episodes yet. "
                              "There is currently 1 episodes with {} transitions".format(self._buffer[0].length()))
 
         self.reader_writer_lock.release_writing()
 
+        if located is not None:
+            rows, columns, version = located
+            batch = TransitionArrays.gather_rows(rows, columns)
+            self.reader_writer_lock.lock_writing()
+            is_overwritten = self.transition_arrays.version != version
+            self.reader_writer_lock.release_writing()
+            if is_overwritten:
+                # episodes were removed or shuffled while copying, so the batch is sampled again
+                batch = self.sample(size)
+
         return batch
 
     # this is something added to sync the sampling of all agents for given index
@@ -140,7 +199,8 @@ class EpisodicExperienceReplay(Memory):
         :param transitions_idx: the list of indices of the batch to sample
         :param episode_idx: the index of an episode
         :param is_consecutive_transitions: if set True, samples a batch of consecutive transitions.
-        :return: a batch (list) of selected transitions from the replay buffer
+        :return: a batch (list) of selected transitions from the replay buffer. with array storage, a batch of
+                 transitions that are not consecutive is returned as a ColumnarBatch
         """
         self.reader_writer_lock.lock_writing()
         size = len(transitions_idx)
@@ -157,9 +217,7 @@ class EpisodicExperienceReplay(Memory):
         else:
             # transitions_idx = np.random.randint(self.num_transitions_in_complete_episodes(), size=size)
             transitions_idx = np.asarray(transitions_idx)
-            batch = [self.transitions[i] for i in transitions_idx]
-
-        print(batch)
+            batch = self._get_transitions(transitions_idx)
 
         self.reader_writer_lock.release_writing()
 
@@ -184,7 +242,7 @@ class EpisodicExperienceReplay(Memory):
         Shuffle all the complete episodes in the replay buffer, while deleting the last non-complete episode
         :return:
         """
-        self.reader_writer_lock.lock_writing()
+        self.reader_writer_lock.lock_writing_and_reading()
 
         self.assert_not_frozen()
 
@@ -194,13 +252,32 @@ class EpisodicExperienceReplay(Memory):
         self.remove_last_episode(lock=False)
 
         random.shuffle(self._buffer)
-        self.transitions = [t for e in self._buffer for t in e.transitions]
+        self._flat_transitions = None
+        if self.transition_arrays is not None:
+            self._reorder_transition_arrays()
+        else:
+            self.transitions = [t for e in self._buffer for t in e.transitions]
 
         # create a new Episode for the next transitions to be placed into
         self._buffer.append(Episode(n_step=self.n_step))
         self._length += 1
 
-        self.reader_writer_lock.release_writing()
+        self.reader_writer_lock.release_writing_and_reading()
+
+    def _reorder_transition_arrays(self) -> None:
+        """
+        Reorder the rows of the transition arrays to follow the order of the episodes in the buffer
+        :return: None
+        """
+        episode_rows = {}
+        start = 0
+        for episode in self._stored_episodes:
+            episode_rows[id(episode)] = np.arange(start, start + episode.length())
+            start += episode.length()
+        stored_episodes = [e for e in self._buffer if id(e) in episode_rows]
+        if stored_episodes:
+            self.transition_arrays.reorder(np.concatenate([episode_rows[id(e)] for e in stored_episodes]))
+        self._stored_episodes = deque(stored_episodes)
 
     def get_shuffled_training_data_generator(self, size: int) -> List[Transition]:
         """
@@ -208,24 +285,29 @@ class EpisodicExperienceReplay(Memory):
         If the requested size is larger than the number of samples available in the replay buffer then the batch will
         return empty. The last returned batch may be smaller than the size requested, to accommodate for all the
         transitions in the replay buffer.
+        The indices are shuffled once, when the iteration starts. If episodes are removed from the memory while
+        iterating, the indices that went past its complete episodes are skipped, so the batches can get smaller, and
+        the remaining indices point to later transitions. Freeze the memory to iterate over a fixed set of transitions.
 
         :param size: the size of the batch to return
         :return: a batch (list) of selected transitions from the replay buffer
         """
         self.reader_writer_lock.lock_writing()
-
         shuffled_transition_indices = list(range(self.last_training_set_transition_id))
+        self.reader_writer_lock.release_writing()
         random.shuffle(shuffled_transition_indices)
 
-        # print(shuffled_transition_indices)
-        # print(random.shuffle(shuffled_transition_indices))
-
         # The last batch drawn will usually be < batch_size (=the size variable)
         for i in range(math.ceil(len(shuffled_transition_indices) / size)):
-            sample_data = [self.transitions[j] for j in shuffled_transition_indices[i * size: (i + 1) * size]]
+            # the lock is only held while gathering a batch, so the memory can be written between the batches
+            self.reader_writer_lock.lock_writing()
+            num_transitions = self.num_transitions_in_complete_episodes()
+            batch_indices = [j for j in shuffled_transition_indices[i * size: (i + 1) * size] if j < num_transitions]
+            sample_data = self._get_transitions(batch_indices) if batch_indices else None
             self.reader_writer_lock.release_writing()
 
-            yield sample_data
+            if sample_data is not None:
+                yield sample_data
 
     # this is something added to sync the sampling of all agents for given index
     def get_shuffled_training_data_generator_with_index(self, size: int, shuffled_transition_indices: List[int]) -> List[Transition]:
@@ -239,12 +321,10 @@ class EpisodicExperienceReplay(Memory):
         :param episode_idx: the index of an episode
         :return: a batch (list) of selected transitions from the replay buffer
         """
-        self.reader_writer_lock.lock_writing()
-
-
         # The last batch drawn will usually be < batch_size (=the size variable)
         for i in range(math.ceil(len(shuffled_transition_indices) / size)):
-            sample_data = [self.transitions[j] for j in shuffled_transition_indices[i * size: (i + 1) * size]]
+            self.reader_writer_lock.lock_writing()
+            sample_data = self._get_transitions(shuffled_transition_indices[i * size: (i + 1) * size])
             self.reader_writer_lock.release_writing()
 
             yield sample_data
@@ -322,6 +402,11 @@ class EpisodicExperienceReplay(Memory):
         # it would be better if this were less state full
         self._update_episode(last_episode)
 
+        if self.transition_arrays is not None:
+            # the transitions are final once the episode was updated
+            self.transition_arrays.append(last_episode.transitions)
+            self._stored_episodes.append(last_episode)
+
         self._enforce_max_length()
 
         if lock:
@@ -347,7 +432,9 @@ class EpisodicExperienceReplay(Memory):
             self._buffer.append(Episode(n_step=self.n_step))
         last_episode = self._buffer[-1]
         last_episode.insert(transition)
-        self.transitions.append(transition)
+        self._flat_transitions = None
+        if self.transition_arrays is None:
+            self.transitions.append(transition)
         self._num_transitions += 1
         if transition.game_over:
             self.close_last_episode(False)
@@ -374,7 +461,9 @@ class EpisodicExperienceReplay(Memory):
             self._buffer[-1] = episode
         else:
             self._buffer.append(episode)
-        self.transitions.extend(episode.transitions)
+        self._flat_transitions = None
+        if self.transition_arrays is None:
+            self.transitions.extend(episode.transitions)
         self._num_transitions += episode.length()
         self.close_last_episode(False)
 
@@ -410,11 +499,21 @@ class EpisodicExperienceReplay(Memory):
                                                           "episode"
 
         if len(self._buffer) > 0:
-            episode_length = self._buffer[episode_index].length()
+            episode = self._buffer[episode_index]
+            episode_length = episode.length()
             self._length -= 1
             self._num_transitions -= episode_length
             self._num_transitions_in_complete_episodes -= episode_length
-            if episode_index == 0:
+            self._flat_transitions = None
+            if self.transition_arrays is not None:
+                # only the complete episodes are in the transition arrays
+                if episode_index == 0 and self._stored_episodes and self._stored_episodes[0] is episode:
+                    self._stored_episodes.popleft()
+                    self.transition_arrays.pop_front(episode_length)
+                elif episode_index == -1 and self._stored_episodes and self._stored_episodes[-1] is episode:
+                    self._stored_episodes.pop()
+                    self.transition_arrays.pop_back(episode_length)
+            elif episode_index == 0:
                 del self.transitions[:episode_length]
             else:  # episode_index = -1
                 del self.transitions[-episode_length:]
@@ -483,6 +582,10 @@ class EpisodicExperienceReplay(Memory):
         self.reader_writer_lock.lock_writing_and_reading()
 
         self.transitions = []
+        self._flat_transitions = None
+        if self.transition_arrays is not None:
+            self.transition_arrays.clear()
+            self._stored_episodes = deque()
         self._buffer = [Episode(n_step=self.n_step)]
         self._length = 1
         self._num_transitions = 0
@@ -497,7 +600,13 @@ class EpisodicExperienceReplay(Memory):
         """
         self.reader_writer_lock.lock_writing()
 
-        mean = np.mean([transition.reward for transition in self.transitions])
+        if self.transition_arrays is not None:
+            stored_episodes = set(id(e) for e in self._stored_episodes)
+            rewards = [self.transition_arrays.column('reward')] + \
+                      [[t.reward for t in e.transitions] for e in self._buffer if id(e) not in stored_episodes]
+            mean = np.mean(np.concatenate(rewards))
+        else:
+            mean = np.mean([transition.reward for transition in self.transitions])
 
         self.reader_writer_lock.release_writing()
         return mean
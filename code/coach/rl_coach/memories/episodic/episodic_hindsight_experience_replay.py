@@ -88,7 +88,9 @@ class EpisodicHindsightExperienceReplay(EpisodicExperienceReplay):
             selected_transition = np.random.choice(episode_transitions)
         elif self.hindsight_goal_selection_method == HindsightGoalSelectionMethod.Random:
             # a random state from the entire replay buffer
-            selected_transition = np.random.choice(self.transitions)
+            # (indexing draws the same index as np.random.choice, without converting the whole list to an array)
+            transitions = self.transitions
+            selected_transition = transitions[np.random.randint(len(transitions))]
         else:
             raise ValueError("Invalid goal selection method was used for the hindsight goal selection")
         return self.goals_space.goal_from_state(selected_transition.state)
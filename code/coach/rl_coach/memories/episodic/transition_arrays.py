@@ -0,0 +1,244 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from rl_coach.core_types import ColumnarBatch, Transition, stack_column
+
+
+class TransitionArrays(object):
+    """
+    Transitions stored column-wise in circular arrays: one (capacity, ...) array for every state, next state and info
+    key and for the actions, rewards, game overs and n step discounted rewards. Transitions are appended at the end and
+    removed from either end without moving the other rows, and a set of transitions is gathered with a single fancy
+    indexing operation per column. The arrays grow (by doubling) when they are full.
+    The version counts the operations that can overwrite or release stored rows, so that a reader can locate a batch
+    holding a lock and gather it after releasing the lock (see locate and gather_rows).
+    Columns are allocated with the shape and dtype of the first values written to them. Values of another shape (or
+    missing values) turn a column into an object array.
+    """
+    def __init__(self, initial_capacity: int=1024):
+        """
+        :param initial_capacity: the number of rows allocated when the first transitions are appended
+        """
+        self.initial_capacity = initial_capacity
+        self._capacity = 0
+        self._start = 0
+        self._size = 0
+        # (kind, key) -> column, where kind is one of 'state', 'next_state', 'info', or the name of a single column
+        self._columns = {}
+        self.version = 0
+
+    def __len__(self):
+        return self._size
+
+    def clear(self) -> None:
+        self.version += 1
+        self._capacity = 0
+        self._start = 0
+        self._size = 0
+        self._columns = {}
+
+    def _rows(self, indices: np.ndarray) -> np.ndarray:
+        return (self._start + indices) % self._capacity
+
+    def _allocate(self, values: np.ndarray, capacity: int) -> np.ndarray:
+        column = np.empty((capacity,) + values.shape[1:], dtype=values.dtype)
+        if column.dtype == object:
+            column.fill(None)
+        return column
+
+    def _to_objects(self, key: Tuple[str, str]) -> np.ndarray:
+        # store one object per row, which allows any value (e.g. arrays of different shapes)
+        column = self._columns[key]
+        objects = np.empty(self._capacity, dtype=object)
+        for row in range(self._capacity):
+            objects[row] = column[row]
+        self._columns[key] = objects
+        return objects
+
+    def _reserve(self, size: int) -> None:
+        if size <= self._capacity:
+            return
+        capacity = max(size, 2 * self._capacity, self.initial_capacity)
+        rows = self._rows(np.arange(self._size)) if self._capacity else np.arange(0)
+        for key, column in self._columns.items():
+            resized = self._allocate(column, capacity)
+            resized[:self._size] = column[rows]
+            self._columns[key] = resized
+        self._capacity = capacity
+        self._start = 0
+
+    def _write(self, key: Tuple[str, str], rows: np.ndarray, values: np.ndarray) -> None:
+        column = self._columns.get(key)
+        if column is None:
+            if self._size > 0:
+                # the rows written before do not have this key
+                column = np.full(self._capacity, None, dtype=object)
+            else:
+                column = self._allocate(values, self._capacity)
+            self._columns[key] = column
+        elif column.dtype != object and (values.dtype == object or values.shape[1:] != column.shape[1:]):
+            column = self._to_objects(key)
+        elif column.dtype != object and values.dtype != column.dtype:
+            column = self._columns[key] = column.astype(np.result_type(column, values))
+        if column.dtype == object and (values.dtype != object or values.ndim > 1):
+            for row, value in zip(rows, values):
+                column[row] = value
+        else:
+            column[rows] = values
+
+    @staticmethod
+    def _episode_columns(transitions: List[Transition]) -> Dict[Tuple[str, str], np.ndarray]:
+        first = transitions[0]
+        columns = {('state', key): stack_column([t.state[key] for t in transitions]) for key in first.state.keys()}
+        columns.update({('next_state', key): stack_column([t.next_state[key] for t in transitions])
+                        for key in first.next_state.keys()})
+        info_keys = set(key for t in transitions for key in t.info.keys())
+        columns.update({('info', key): stack_column([t.info.get(key) for t in transitions]) for key in info_keys})
+        columns[('action', '')] = stack_column([t.action for t in transitions])
+        columns[('reward', '')] = stack_column([t.reward for t in transitions])
+        columns[('game_over', '')] = stack_column([t.game_over for t in transitions])
+        # transitions whose n step discounted rewards were not filled are stored as nan
+        columns[('n_step_discounted_rewards', '')] = np.array(
+            [np.nan if t._n_step_discounted_rewards is None else t._n_step_discounted_rewards for t in transitions],
+            dtype=np.float64)
+        return columns
+
+    def append(self, transitions: List[Transition]) -> None:
+        """
+        Append transitions after the last stored transition
+
+        :param transitions: the transitions to append
+        :return: None
+        """
+        if len(transitions) == 0:
+            return
+        columns = self._episode_columns(transitions)
+        self._reserve(self._size + len(transitions))
+        rows = self._rows(np.arange(self._size, self._size + len(transitions)))
+        for key in set(self._columns.keys()).difference(columns.keys()):
+            # a key that these transitions do not have
+            columns[key] = stack_column([None] * len(transitions))
+        for key, values in columns.items():
+            self._write(key, rows, values)
+        self._size += len(transitions)
+
+    def pop_front(self, num_transitions: int) -> None:
+        """
+        Remove the first transitions
+
+        :param num_transitions: the number of transitions to remove
+        :return: None
+        """
+        assert num_transitions <= self._size, "Cannot remove {} of {} transitions".format(num_transitions, self._size)
+        if num_transitions == 0:
+            return
+        self.version += 1
+        rows = self._rows(np.arange(num_transitions))
+        for column in self._columns.values():
+            if column.dtype == object:
+                # release the stored objects
+                column[rows] = None
+        self._start = (self._start + num_transitions) % self._capacity
+        self._size -= num_transitions
+
+    def pop_back(self, num_transitions: int) -> None:
+        """
+        Remove the last transitions
+
+        :param num_transitions: the number of transitions to remove
+        :return: None
+        """
+        assert num_transitions <= self._size, "Cannot remove {} of {} transitions".format(num_transitions, self._size)
+        # the released rows are overwritten by the next append
+        self.version += 1
+        self._size -= num_transitions
+
+    def reorder(self, order: np.ndarray) -> None:
+        """
+        Permute the stored transitions
+
+        :param order: the indices of the stored transitions in their new order
+        :return: None
+        """
+        self.version += 1
+        rows = self._rows(np.asarray(order))
+        for column in self._columns.values():
+            column[:self._size] = column[rows]
+        self._start = 0
+
+    def column(self, kind: str, key: str='', indices: np.ndarray=None) -> np.ndarray:
+        """
+        Gather a column
+
+        :param kind: the kind of the column ('state', 'next_state', 'info', 'action', 'reward', 'game_over' or
+                     'n_step_discounted_rewards')
+        :param key: the key of the state, next state or info column
+        :param indices: the indices of the transitions to gather. all the transitions if not given
+        :return: an array with a row for each of the gathered transitions
+        """
+        indices = np.arange(self._size) if indices is None else np.asarray(indices)
+        return self._columns[(kind, key)][self._rows(indices)]
+
+    def locate(self, indices: np.ndarray) -> Tuple[np.ndarray, Dict[Tuple[str, str], np.ndarray], int]:
+        """
+        Locate a batch of transitions, to gather it later with gather_rows. Appending transitions (even if the arrays
+        grow) leaves the located rows untouched, and any other change to the arrays increases their version, so the
+        gathered batch is valid as long as the version did not change in between
+
+        :param indices: the indices of the transitions to gather, from 0 for the first stored transition
+        :return: the rows of the transitions, the columns and the version of the arrays
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if np.any(indices >= self._size) or np.any(indices < -self._size):
+            raise IndexError("Transition index out of range for {} transitions".format(self._size))
+        return self._rows(indices % self._size), dict(self._columns), self.version
+
+    @staticmethod
+    def gather_rows(rows: np.ndarray, columns: Dict[Tuple[str, str], np.ndarray]) -> ColumnarBatch:
+        """
+        Gather a batch of transitions located by locate
+
+        :param rows: the rows of the transitions
+        :param columns: the columns of the arrays
+        :return: a ColumnarBatch holding the gathered transitions
+        """
+        keyed_columns = {'state': {}, 'next_state': {}, 'info': {}}
+        for (kind, key), column in columns.items():
+            if kind in keyed_columns:
+                keyed_columns[kind][key] = column[rows]
+        n_step_discounted_rewards = columns[('n_step_discounted_rewards', '')][rows]
+        if n_step_discounted_rewards.dtype == object or np.isnan(n_step_discounted_rewards).any():
+            n_step_discounted_rewards = None
+        return ColumnarBatch(states=keyed_columns['state'],
+                             actions=columns[('action', '')][rows],
+                             rewards=columns[('reward', '')][rows],
+                             next_states=keyed_columns['next_state'],
+                             game_overs=columns[('game_over', '')][rows],
+                             n_step_discounted_rewards=n_step_discounted_rewards,
+                             info=keyed_columns['info'])
+
+    def gather(self, indices: np.ndarray) -> ColumnarBatch:
+        """
+        Gather a batch of transitions
+
+        :param indices: the indices of the transitions to gather, from 0 for the first stored transition
+        :return: a ColumnarBatch holding the gathered transitions
+        """
+        rows, columns, _ = self.locate(indices)
+        return self.gather_rows(rows, columns)
@@ -107,6 +107,7 @@ class BalancedExperienceReplay(ExperienceReplay):
         self.reader_writer_lock.lock_writing()
 
         if size % self.num_classes != 0:
+            self.reader_writer_lock.release_writing()
             raise ValueError("Sampling batches from a balanced replay buffer should be done only using batch sizes "
                              "which are a multiple of the number of classes. The number of classes defined is: {} "
                              "and the batch size requested is: {}".format(self.num_classes, size))
@@ -120,6 +121,7 @@ class BalancedExperienceReplay(ExperienceReplay):
         else:
             for class_idx, class_transitions in enumerate(self.transitions):
                 if self.num_transitions() < batch_size_from_each_class:
+                    self.reader_writer_lock.release_writing()
                     raise ValueError("The replay buffer cannot be sampled since there are not enough transitions yet. "
                                      "There are currently {} transitions for class {}"
                                      .format(len(class_transitions), class_idx))
@@ -84,6 +84,7 @@ class ExperienceReplay(Memory):
             if self.num_transitions() >= size:
                 transitions_idx = np.random.choice(self.num_transitions(), size=size, replace=False)
             else:
+                self.reader_writer_lock.release_writing()
                 raise ValueError("The replay buffer cannot be sampled since there are not enough transitions yet. "
                                  "There are currently {} transitions".format(self.num_transitions()))
 
@@ -98,21 +99,30 @@ class ExperienceReplay(Memory):
         If the requested size is larger than the number of samples available in the replay buffer then the batch will
         return empty. The last returned batch may be smaller than the size requested, to accommodate for all the
         transitions in the replay buffer.
+        The indices are shuffled once, when the iteration starts. If transitions are removed from the memory while
+        iterating, the indices that went past its end are skipped, so the batches can get smaller, and the remaining
+        indices point to later transitions. Freeze the memory to iterate over a fixed set of transitions.
 
         :param size: the size of the batch to return
         :return: a batch (list) of selected transitions from the replay buffer
         """
         self.reader_writer_lock.lock_writing()
         shuffled_transition_indices = list(range(len(self.transitions)))
+        self.reader_writer_lock.release_writing()
         random.shuffle(shuffled_transition_indices)
 
         # we deliberately drop some of the ending data which is left after dividing to batches of size `size`
         # for i in range(math.ceil(len(shuffled_transition_indices) / size)):
         for i in range(int(len(shuffled_transition_indices) / size)):
-            sample_data = [self.transitions[j] for j in shuffled_transition_indices[i * size: (i + 1) * size]]
+            # the lock is only held while gathering a batch, so the memory can be written between the batches
+            self.reader_writer_lock.lock_writing()
+            num_transitions = len(self.transitions)
+            sample_data = [self.transitions[j] for j in shuffled_transition_indices[i * size: (i + 1) * size]
+                           if j < num_transitions]
             self.reader_writer_lock.release_writing()
 
-            yield sample_data
+            if sample_data:
+                yield sample_data
 
     def _enforce_max_length(self) -> None:
         """
@@ -15,7 +15,6 @@
 #
 
 import operator
-import random
 from enum import Enum
 from typing import List, Tuple, Any
 
@@ -45,11 +44,13 @@ class SegmentTree(object):
     A tree which can be used as a min/max heap or a sum tree
     Add or update item value - O(log N)
     Sampling an item - O(log N)
+    The batched operations (update_batch and get_elements_by_partial_sums) process a whole batch of leaves or query
+    values with one vectorized operation per tree level
     """
     class Operation(Enum):
-        MAX = {"operator": max, "initial_value": -float("inf")}
-        MIN = {"operator": min, "initial_value": float("inf")}
-        SUM = {"operator": operator.add, "initial_value": 0}
+        MAX = {"operator": max, "numpy_operator": np.maximum, "initial_value": -float("inf")}
+        MIN = {"operator": min, "numpy_operator": np.minimum, "initial_value": float("inf")}
+        SUM = {"operator": operator.add, "numpy_operator": np.add, "initial_value": 0}
 
     def __init__(self, size: int, operation: Operation):
         self.next_leaf_idx_to_write = 0
@@ -62,16 +63,29 @@ class SegmentTree(object):
 
     def _propagate(self, node_idx: int) -> None:
         """
-        Propagate an update of a node's value to its parent node
+        Propagate an update of a node's value to all its ancestors
         :param node_idx: the index of the node that was updated
         :return: None
         """
-        parent = (node_idx - 1) // 2
+        while node_idx != 0:
+            parent = (node_idx - 1) // 2
+            self.tree[parent] = self.operation.value['operator'](self.tree[parent * 2 + 1], self.tree[parent * 2 + 2])
+            node_idx = parent
 
-        self.tree[parent] = self.operation.value['operator'](self.tree[parent * 2 + 1], self.tree[parent * 2 + 2])
-
-        if parent != 0:
-            self._propagate(parent)
+    def _propagate_batch(self, node_indices: np.ndarray) -> None:
+        """
+        Propagate an update of the values of a batch of nodes in the same tree level to all their ancestors, one level
+        at a time
+        :param node_indices: the indices of the nodes that were updated
+        :return: None
+        """
+        parents = np.unique((node_indices - 1) // 2)
+        while True:
+            self.tree[parents] = self.operation.value['numpy_operator'](self.tree[parents * 2 + 1],
+                                                                        self.tree[parents * 2 + 2])
+            if parents[0] == 0:
+                break
+            parents = np.unique((parents - 1) // 2)
 
     def _retrieve(self, root_node_idx: int, val: float)-> int:
         """
@@ -80,16 +94,33 @@ class SegmentTree(object):
         :param val: the value to query for
         :return: the index of the resulting node
         """
-        left = 2 * root_node_idx + 1
-        right = left + 1
-
-        if left >= len(self.tree):
-            return root_node_idx
-
-        if val <= self.tree[left]:
-            return self._retrieve(left, val)
-        else:
-            return self._retrieve(right, val-self.tree[left])
+        node_idx = root_node_idx
+        while True:
+            left = 2 * node_idx + 1
+            if left >= len(self.tree):
+                return node_idx
+
+            if val <= self.tree[left]:
+                node_idx = left
+            else:
+                val -= self.tree[left]
+                node_idx = left + 1
+
+    def _retrieve_batch(self, vals: np.ndarray) -> np.ndarray:
+        """
+        Retrieve the leaf of each of the given values, descending from the root one level at a time for all the values
+        :param vals: the values to query for
+        :return: the indices of the resulting nodes
+        """
+        vals = np.array(vals, dtype=np.float64)
+        node_indices = np.zeros(len(vals), dtype=np.int64)
+        for _ in range(self.size.bit_length() - 1):
+            left = 2 * node_indices + 1
+            left_values = self.tree[left]
+            go_right = vals > left_values
+            vals -= np.where(go_right, left_values, 0)
+            node_indices = left + go_right
+        return node_indices
 
     def total_value(self) -> float:
         """
@@ -128,6 +159,25 @@ class SegmentTree(object):
         self.tree[node_idx] = new_val
         self._propagate(node_idx)
 
+    def update_batch(self, leaf_indices: np.ndarray, new_vals: np.ndarray) -> None:
+        """
+        Update the values of a batch of leaves. If a leaf appears more than once, its last value is used
+        :param leaf_indices: the indices of the leaves to update
+        :param new_vals: the new values of the leaves
+        :return: None
+        """
+        leaf_indices = np.asarray(leaf_indices, dtype=np.int64)
+        if len(leaf_indices) == 0:
+            return
+        if leaf_indices.min() < 0 or leaf_indices.max() >= self.size:
+            raise ValueError("The given leaf indices ({}) can not be found in the tree. The available leaves are: 0-{}"
+                             .format(leaf_indices, self.size - 1))
+
+        node_indices = leaf_indices + self.size - 1
+        self.tree[node_indices] = new_vals
+        if self.size > 1:
+            self._propagate_batch(node_indices)
+
     def get_element_by_partial_sum(self, val: float) -> Tuple[int, float, Any]:
         """
         Given a value between 0 and the tree sum, return the object which this value is in it's range.
@@ -145,6 +195,18 @@ class SegmentTree(object):
 
         return leaf_idx, data_value, data
 
+    def get_elements_by_partial_sums(self, vals: np.ndarray) -> Tuple[np.ndarray, np.ndarray, List[Any]]:
+        """
+        The batched version of get_element_by_partial_sum, which retrieves the leaves of all the given values together
+        :param vals: values within the range 0 and the tree sum
+        :return: the indices of the resulting leaves in the tree, their values and the objects themselves
+        """
+        node_indices = self._retrieve_batch(vals)
+        leaf_indices = node_indices - self.size + 1
+        data = [self.data[leaf_idx] for leaf_idx in leaf_indices]
+
+        return leaf_indices, self.tree[node_indices], data
+
     def __str__(self):
         result = ""
         start = 0
@@ -185,19 +247,17 @@ class PrioritizedExperienceReplay(ExperienceReplay):
         self.epsilon = epsilon
         self.maximal_priority = 1.0
 
-    def _update_priority(self, leaf_idx: int, error: float) -> None:
+    def _update_priorities(self, leaf_indices: np.ndarray, error_values: np.ndarray) -> None:
         """
-        Update the priority of a given transition, using its index in the tree and its error
-        :param leaf_idx: the index of the transition leaf in the tree
-        :param error: the new error value
+        Update the priorities of a batch of transitions, using their indices in the trees and their errors
+        :param leaf_indices: the indices of the transition leaves in the trees
+        :param error_values: the new non-negative error values
         :return: None
         """
-        if error < 0:
-            raise ValueError("The priorities must be non-negative values")
-        priority = (error + self.epsilon)
-        self.sum_tree.update(leaf_idx, priority ** self.alpha)
-        self.min_tree.update(leaf_idx, priority ** self.alpha)
-        self.max_tree.update(leaf_idx, priority)
+        priorities = error_values + self.epsilon
+        self.sum_tree.update_batch(leaf_indices, priorities ** self.alpha)
+        self.min_tree.update_batch(leaf_indices, priorities ** self.alpha)
+        self.max_tree.update_batch(leaf_indices, priorities)
         self.maximal_priority = self.max_tree.total_value()
 
     def update_priorities(self, indices: List[int], error_values: List[float]) -> None:
@@ -207,13 +267,18 @@ class PrioritizedExperienceReplay(ExperienceReplay):
         :param error_values: the new error values
         :return: None
         """
-        self.reader_writer_lock.lock_writing_and_reading()
-
         if len(indices) != len(error_values):
             raise ValueError("The number of indexes requested for update don't match the number of error values given")
-        for transition_idx, error in zip(indices, error_values):
-            self._update_priority(transition_idx, error)
+        indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+        error_values = np.asarray(error_values, dtype=np.float64).reshape(-1)
+        if np.any(error_values < 0):
+            raise ValueError("The priorities must be non-negative values")
+        if len(indices) > 0 and (indices.min() < 0 or indices.max() >= self.power_of_2_size):
+            raise ValueError("The given leaf indices ({}) can not be found in the tree. The available leaves are: 0-{}"
+                             .format(indices, self.power_of_2_size - 1))
 
+        self.reader_writer_lock.lock_writing_and_reading()
+        self._update_priorities(indices, error_values)
         self.reader_writer_lock.release_writing_and_reading()
 
     def sample(self, size: int) -> List[Transition]:
@@ -228,33 +293,29 @@ class PrioritizedExperienceReplay(ExperienceReplay):
 
         if self.num_transitions() >= size:
             # split the tree leaves to equal segments and sample one transition from each segment
-            batch = []
-            segment_size = self.sum_tree.total_value() / size
+            total_value = self.sum_tree.total_value()
+            segment_size = total_value / size
 
             # get the maximum weight in the memory
-            min_probability = self.min_tree.total_value() / self.sum_tree.total_value()  # min P(j) = min p^a / sum(p^a)
+            min_probability = self.min_tree.total_value() / total_value  # min P(j) = min p^a / sum(p^a)
             max_weight = (min_probability * self.num_transitions()) ** -self.beta.current_value  # max wi
 
-            # sample a batch
-            for i in range(size):
-                segment_start = segment_size * i
-                segment_end = segment_size * (i + 1)
-
-                # sample leaf and calculate its weight
-                val = random.uniform(segment_start, segment_end)
-                leaf_idx, priority, transition = self.sum_tree.get_element_by_partial_sum(val)
-                priority /= self.sum_tree.total_value()   # P(j) = p^a / sum(p^a)
-                weight = (self.num_transitions() * priority) ** -self.beta.current_value  # (N * P(j)) ^ -beta
-                normalized_weight = weight / max_weight  # wj = ((N * P(j)) ^ -beta) / max wi
+            # sample the leaves of the whole batch and calculate their weights
+            segment_starts = segment_size * np.arange(size)
+            vals = np.random.uniform(segment_starts, segment_starts + segment_size)
+            leaf_indices, priorities, batch = self.sum_tree.get_elements_by_partial_sums(vals)
+            probabilities = priorities / total_value   # P(j) = p^a / sum(p^a)
+            weights = (self.num_transitions() * probabilities) ** -self.beta.current_value  # (N * P(j)) ^ -beta
+            normalized_weights = weights / max_weight  # wj = ((N * P(j)) ^ -beta) / max wi
 
+            for transition, leaf_idx, normalized_weight in zip(batch, leaf_indices, normalized_weights):
                 transition.info['idx'] = leaf_idx
                 transition.info['weight'] = normalized_weight
 
-                batch.append(transition)
-
             self.beta.step()
 
         else:
+            self.reader_writer_lock.release_writing()
             raise ValueError("The replay buffer cannot be sampled since there are not enough transitions yet. "
                              "There are currently {} transitions".format(self.num_transitions()))
 
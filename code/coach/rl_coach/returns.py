@@ -0,0 +1,105 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Vectorized return computations over (T,) or (B, T) arrays, with the time steps along the last axis.
+The maddpg package has a copy with the same functions and signatures in maddpg/common/returns.py.
+"""
+
+from typing import Union
+
+import numpy as np
+import scipy.signal
+
+
+def discounted_returns(rewards: np.ndarray, discount: float, dones: np.ndarray=None,
+                       bootstrap: Union[float, np.ndarray]=0.0) -> np.ndarray:
+    """
+    Discounted returns G, with G[t] = rewards[t] + discount * (1 - dones[t]) * G[t + 1].
+    Without dones, this is a linear filter over the reversed rewards. With dones, the recursion is evaluated as an
+    associative scan: after the pass with shift s, returns[t] sums the 2s rewards starting at step t and decay[t] is
+    the discount of the return that follows them, so that log2(T) vectorized passes replace the loop over the steps.
+
+    :param rewards: (T,) or (B, T) rewards
+    :param discount: the discount factor
+    :param dones: optional array of the same shape as rewards. a done at step t ends the return at step t
+    :param bootstrap: the return following the last step (a scalar or a (B,) array), e.g. a value estimate
+    :return: an array of the same shape as rewards
+    """
+    rewards = np.asarray(rewards, dtype=np.float64)
+    bootstrap = np.asarray(bootstrap, dtype=np.float64)[..., None]
+    if dones is None:
+        returns = scipy.signal.lfilter([1], [1, -discount], rewards[..., ::-1], axis=-1)[..., ::-1]
+        if np.any(bootstrap):
+            returns = returns + bootstrap * discount ** np.arange(rewards.shape[-1], 0, -1)
+        return returns
+
+    returns = rewards.copy()
+    decay = discount * (1.0 - np.asarray(dones, dtype=np.float64))
+    shift = 1
+    while shift < rewards.shape[-1]:
+        returns[..., :-shift] += decay[..., :-shift] * returns[..., shift:]
+        decay[..., :-shift] *= decay[..., shift:]
+        shift *= 2
+    return returns + decay * bootstrap
+
+
+def n_step_returns(rewards: np.ndarray, discount: float, n_step: int,
+                   bootstrap_values: np.ndarray=None) -> np.ndarray:
+    """
+    N-step returns R, with R[t] = sum_{k < n_step} discount^k * rewards[t + k] + discount^n_step * bootstrap_values[t],
+    truncated at the end of the sequence
+
+    :param rewards: (T,) or (B, T) rewards of a single episode (or of B episodes of the same length)
+    :param discount: the discount factor
+    :param n_step: the number of summed rewards. -1 (or any n_step >= T) sums all the remaining rewards
+    :param bootstrap_values: optional (T - n_step,) or (B, T - n_step) values of the states that are n_step steps
+                             ahead of the first T - n_step steps (i.e. values[..., n_step:] of per step values). the
+                             returns of the last n_step steps reach the end of the sequence and are not bootstrapped
+    :return: an array of the same shape as rewards
+    """
+    if n_step == 0 or n_step < -1:
+        raise ValueError("n_step must be positive or -1, got {}".format(n_step))
+    rewards = np.asarray(rewards, dtype=np.float64)
+    length = rewards.shape[-1]
+    if n_step == -1 or n_step >= length:
+        return discounted_returns(rewards, discount)
+    returns = scipy.signal.lfilter(discount ** np.arange(n_step), [1], rewards[..., ::-1], axis=-1)[..., ::-1]
+    if bootstrap_values is not None:
+        returns = returns.copy()
+        returns[..., :length - n_step] += discount ** n_step * np.asarray(bootstrap_values, dtype=np.float64)
+    return returns
+
+
+def generalized_advantage_estimation(rewards: np.ndarray, values: np.ndarray, discount: float, gae_lambda: float,
+                                     dones: np.ndarray=None) -> np.ndarray:
+    """
+    Generalized advantage estimation (Schulman et al., 2015) of (T,) or (B, T) rewards
+
+    :param rewards: (T,) or (B, T) rewards
+    :param values: the values of all the states, including the state following the last step, i.e. (T + 1,) or
+                   (B, T + 1) values
+    :param discount: the discount factor
+    :param gae_lambda: the lambda weighting the bootstrap lengths
+    :param dones: optional array of the same shape as rewards. a done at step t cuts both the bootstrap from
+                  values[t + 1] and the advantages of the following steps
+    :return: the advantages. the value targets are the advantages + values[..., :-1]
+    """
+    rewards = np.asarray(rewards, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    not_done = 1.0 if dones is None else 1.0 - np.asarray(dones, dtype=np.float64)
+    deltas = rewards + discount * not_done * values[..., 1:] - values[..., :-1]
+    return discounted_returns(deltas, discount * gae_lambda, dones)
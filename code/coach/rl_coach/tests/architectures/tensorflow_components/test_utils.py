@@ -0,0 +1,42 @@
+import pytest
+import numpy as np
+import tensorflow as tf
+
+from rl_coach.architectures.tensorflow_components.utils import soft_update_op
+
+
+@pytest.fixture
+def variables():
+    tf.reset_default_graph()
+    rng = np.random.RandomState(0)
+    shapes = [(3, 4), (4,)]
+    sources = [tf.Variable(rng.randn(*shape).astype(np.float32)) for shape in shapes]
+    targets = [tf.Variable(rng.randn(*shape).astype(np.float32)) for shape in shapes]
+    return sources, targets
+
+
+@pytest.mark.unit_test
+@pytest.mark.parametrize("rate", [1.0, 0.001])
+def test_soft_update_op(variables, rate):
+    sources, targets = variables
+    update_op = soft_update_op(targets, sources, rate)
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        source_values, target_values = sess.run([sources, targets])
+        num_ops = len(tf.get_default_graph().get_operations())
+        sess.run(update_op)
+        sess.run(update_op)
+        # running the op does not add anything to the graph
+        assert len(tf.get_default_graph().get_operations()) == num_ops
+        for source, target, updated in zip(source_values, target_values, sess.run(targets)):
+            expected = target
+            for _ in range(2):
+                expected = rate * source + (1 - rate) * expected
+            assert np.allclose(updated, expected, atol=1e-6)
+
+
+@pytest.mark.unit_test
+def test_soft_update_op_mismatch(variables):
+    sources, targets = variables
+    with pytest.raises(AssertionError):
+        soft_update_op(targets, sources[:1])
@@ -0,0 +1,182 @@
+# nasty hack to deal with issue #46
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+import random
+
+import pytest
+import numpy as np
+
+from rl_coach.core_types import Transition, Episode, ColumnarBatch
+from rl_coach.memories.episodic.episodic_experience_replay import EpisodicExperienceReplay
+from rl_coach.memories.episodic.transition_arrays import TransitionArrays
+from rl_coach.memories.memory import MemoryGranularity
+
+
+def make_episode(episode_id, length):
+    episode = Episode(discount=0.9)
+    for i in range(length):
+        episode.insert(Transition(state={'observation': np.full(3, episode_id + i / 100.0)}, action=episode_id,
+                                  reward=float(i), next_state={'observation': np.full(3, episode_id + (i + 1) / 100.0)},
+                                  game_over=i == length - 1, info={'step': i}))
+    episode.update_transitions_rewards_and_bootstrap_data()
+    return episode
+
+
+def fill(memory, num_episodes, store_transitions=False):
+    for episode_id in range(num_episodes):
+        episode = make_episode(episode_id, 3 + episode_id % 4)
+        if store_transitions:
+            for transition in episode.transitions:
+                memory.store(transition)
+        else:
+            memory.store_episode(episode)
+
+
+def assert_same_transitions(batch, transitions):
+    assert isinstance(batch, ColumnarBatch)
+    assert batch.size == len(transitions)
+    assert np.array_equal(batch.actions(), [t.action for t in transitions])
+    assert np.array_equal(batch.rewards(), [t.reward for t in transitions])
+    assert np.array_equal(batch.game_overs(), [t.game_over for t in transitions])
+    assert np.array_equal(batch.states(['observation'])['observation'], [t.state['observation'] for t in transitions])
+    assert np.array_equal(batch.next_states(['observation'])['observation'],
+                          [t.next_state['observation'] for t in transitions])
+    assert np.allclose(batch.n_step_discounted_rewards(), [t.n_step_discounted_rewards for t in transitions])
+    assert np.array_equal(batch.info('step'), [t.info['step'] for t in transitions])
+
+
+@pytest.mark.unit_test
+@pytest.mark.parametrize("store_transitions", [False, True])
+def test_array_storage_matches_list_storage(store_transitions):
+    max_size = (MemoryGranularity.Transitions, 40)
+    memories = [EpisodicExperienceReplay(max_size), EpisodicExperienceReplay(max_size, array_storage=True)]
+    memories[1].transition_arrays.initial_capacity = 8
+    for memory in memories:
+        fill(memory, 30, store_transitions)
+        # an incomplete episode is not sampled
+        memory.store(make_episode(100, 3).transitions[0])
+
+    list_memory, array_memory = memories
+    assert array_memory.num_transitions() == list_memory.num_transitions()
+    assert array_memory.num_complete_episodes() == list_memory.num_complete_episodes()
+    assert len(array_memory.transition_arrays) == array_memory.num_transitions_in_complete_episodes()
+    assert [(t.action, t.reward) for t in array_memory.transitions] == \
+        [(t.action, t.reward) for t in list_memory.transitions]
+    assert array_memory.mean_reward() == list_memory.mean_reward()
+
+    np.random.seed(0)
+    expected = list_memory.sample(64)
+    np.random.seed(0)
+    assert_same_transitions(array_memory.sample(64), expected)
+
+    indices = [0, 5, list_memory.num_transitions_in_complete_episodes() - 1]
+    assert_same_transitions(array_memory.sample_with_index(indices), list_memory.sample_with_index(indices))
+
+
+@pytest.mark.unit_test
+def test_array_storage_shuffle_and_remove():
+    memories = [EpisodicExperienceReplay(), EpisodicExperienceReplay(array_storage=True)]
+    for memory in memories:
+        fill(memory, 10)
+        random.seed(1)
+        memory.shuffle_episodes()
+        memory.remove_first_episode()
+        memory.store_episode(make_episode(50, 5))
+
+    list_memory, array_memory = memories
+    indices = np.arange(list_memory.num_transitions_in_complete_episodes())
+    assert_same_transitions(array_memory.sample_with_index(indices), list_memory.sample_with_index(indices))
+
+    array_memory.clean()
+    assert len(array_memory.transition_arrays) == 0
+    fill(array_memory, 2)
+    assert_same_transitions(array_memory.sample_with_index([0, 1]), array_memory.transitions[:2])
+
+
+@pytest.mark.unit_test
+def test_transition_arrays_wrap_around():
+    arrays = TransitionArrays(initial_capacity=4)
+    first, second, third = make_episode(0, 3), make_episode(1, 3), make_episode(2, 2)
+    arrays.append(first.transitions)
+    arrays.pop_front(2)
+    # the rows of the second episode wrap around the end of the arrays
+    arrays.append(second.transitions)
+    assert arrays._capacity == 4
+    assert_same_transitions(arrays.gather([0, 1, 2, 3]), first.transitions[2:] + second.transitions)
+    # growing keeps the order of the rows
+    arrays.append(third.transitions)
+    assert arrays._capacity == 8
+    assert_same_transitions(arrays.gather(np.arange(6)), first.transitions[2:] + second.transitions + third.transitions)
+    arrays.pop_back(2)
+    with pytest.raises(IndexError):
+        arrays.gather([4])
+
+
+@pytest.mark.unit_test
+def test_transition_arrays_mixed_values():
+    arrays = TransitionArrays()
+    episode = make_episode(0, 2)
+    episode.transitions[1].info['extra'] = np.zeros(2)
+    arrays.append(episode.transitions)
+    other = make_episode(1, 2)
+    other.transitions[0].state['observation'] = np.zeros(5)
+    arrays.append(other.transitions)
+    batch = arrays.gather([0, 1, 2, 3])
+    assert batch.info('extra')[0] is None
+    assert np.array_equal(batch.info('extra')[1], np.zeros(2))
+    assert batch.info('extra')[2] is None
+    assert batch.states(['observation'])['observation'][2].shape == (5,)
+    assert np.array_equal(batch.states(['observation'])['observation'][3], other.transitions[1].state['observation'])
+
+
+@pytest.mark.unit_test
+def test_array_storage_caches_flat_transitions():
+    memory = EpisodicExperienceReplay(array_storage=True)
+    fill(memory, 3)
+    transitions = memory.transitions
+    assert memory.transitions is transitions
+
+    memory.store(make_episode(10, 2).transitions[0])
+    assert len(memory.transitions) == len(transitions) + 1
+    memory.remove_first_episode()
+    assert [t.action for t in memory.transitions] == [1] * 4 + [2] * 5 + [10]
+    memory.clean()
+    assert memory.transitions == []
+
+
+@pytest.mark.unit_test
+def test_array_storage_version_tracks_overwritten_rows():
+    arrays = TransitionArrays(initial_capacity=4)
+    arrays.append(make_episode(0, 3).transitions)
+    rows, columns, version = arrays.locate([0, 1])
+    # appending, even with growing arrays, leaves the located rows valid
+    arrays.append(make_episode(1, 3).transitions)
+    assert arrays.version == version
+    assert_same_transitions(TransitionArrays.gather_rows(rows, columns), make_episode(0, 3).transitions[:2])
+    arrays.pop_front(3)
+    assert arrays.version != version
+
+
+@pytest.mark.unit_test
+def test_array_storage_sample_is_redone_after_overwrite(monkeypatch):
+    memory = EpisodicExperienceReplay((MemoryGranularity.Transitions, 30), array_storage=True)
+    fill(memory, 8)
+    gather_rows = TransitionArrays.gather_rows
+    num_gathers = []
+
+    def gather_rows_while_writing(rows, columns):
+        # another thread replaces the oldest episodes while the first batch is copied outside the lock
+        if not num_gathers:
+            for episode_id in range(100, 103):
+                memory.store_episode(make_episode(episode_id, 6))
+        num_gathers.append(len(rows))
+        return gather_rows(rows, columns)
+
+    monkeypatch.setattr(TransitionArrays, 'gather_rows', staticmethod(gather_rows_while_writing))
+    batch = memory.sample(64)
+    assert len(num_gathers) == 2
+    # the observations of every transition follow its action (the episode id)
+    observations = batch.states(['observation'])['observation']
+    assert np.array_equal(np.floor(observations[:, 0] + 1e-9), batch.actions())
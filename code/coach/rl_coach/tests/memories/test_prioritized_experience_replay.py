@@ -4,9 +4,12 @@ import sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
+import numpy as np
 import pytest
 
-from rl_coach.memories.non_episodic.prioritized_experience_replay import SegmentTree
+from rl_coach.core_types import Transition
+from rl_coach.memories.memory import MemoryGranularity
+from rl_coach.memories.non_episodic.prioritized_experience_replay import SegmentTree, PrioritizedExperienceReplay
 
 
 @pytest.mark.unit_test
@@ -87,6 +90,70 @@ def test_max_tree():
     assert max_tree.__str__() == "[5.]\n[5. 3.]\n[5. 2. 3. 3.]\n"
 
 
+@pytest.mark.unit_test
+def test_segment_tree_batch_update():
+    rng = np.random.RandomState(0)
+    for operation in SegmentTree.Operation:
+        batch_tree = SegmentTree(size=64, operation=operation)
+        tree = SegmentTree(size=64, operation=operation)
+        for _ in range(5):
+            # repeated leaves keep their last value, as when updating them one by one
+            leaf_indices = rng.randint(64, size=40)
+            values = rng.uniform(0, 10, size=40)
+            batch_tree.update_batch(leaf_indices, values)
+            for leaf_idx, value in zip(leaf_indices, values):
+                tree.update(leaf_idx, value)
+            assert np.allclose(batch_tree.tree, tree.tree)
+
+    with pytest.raises(ValueError):
+        SegmentTree(size=4, operation=SegmentTree.Operation.SUM).update_batch([1, 4], [1, 1])
+
+
+@pytest.mark.unit_test
+def test_segment_tree_batch_retrieve():
+    sum_tree = SegmentTree(size=8, operation=SegmentTree.Operation.SUM)
+    for value in [2.5, 5, 0, 7.5, 1, 4]:
+        sum_tree.add(value, str(value))
+
+    vals = np.linspace(0, sum_tree.total_value(), 50)
+    leaf_indices, values, data = sum_tree.get_elements_by_partial_sums(vals)
+    for val, leaf_idx, value, element in zip(vals, leaf_indices, values, data):
+        assert (leaf_idx, value, element) == sum_tree.get_element_by_partial_sum(val)
+    # empty leaves are never retrieved
+    assert 2 not in leaf_indices
+
+    single_leaf_tree = SegmentTree(size=1, operation=SegmentTree.Operation.SUM)
+    single_leaf_tree.add(3, "3")
+    assert single_leaf_tree.get_elements_by_partial_sums([0, 3])[0].tolist() == [0, 0]
+
+
+@pytest.mark.unit_test
+def test_prioritized_experience_replay_sample():
+    np.random.seed(0)
+    memory = PrioritizedExperienceReplay((MemoryGranularity.Transitions, 16))
+    for i in range(16):
+        memory.store(Transition(state={'observation': np.array([i])}, action=i, reward=0, game_over=False))
+    errors = np.zeros(16)
+    errors[3] = 100
+    memory.update_priorities(np.arange(16), errors)
+    assert memory.maximal_priority == 100 + memory.epsilon
+
+    batch = memory.sample(16)
+    actions = np.array([transition.action for transition in batch])
+    assert np.mean(actions == 3) > 0.9
+    for transition in batch:
+        assert transition.info['idx'] == transition.action
+        assert 0 < transition.info['weight'] <= 1
+
+    with pytest.raises(ValueError):
+        memory.update_priorities([0, 1], [1, -1])
+    with pytest.raises(ValueError):
+        memory.update_priorities([0, 16], [1, 1])
+    # a failed update leaves the memory unlocked and unchanged
+    assert not memory.reader_writer_lock.some_worker_is_writing()
+    assert memory.maximal_priority == 100 + memory.epsilon
+
+
 if __name__ == "__main__":
     test_sum_tree()
     test_min_tree()
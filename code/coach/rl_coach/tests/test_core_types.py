@@ -1,4 +1,7 @@
 from rl_coach.core_types import (
+    Batch,
+    ColumnarBatch,
+    Transition,
     TotalStepsCounter,
     EnvironmentSteps,
     EnvironmentEpisodes,
@@ -7,6 +10,7 @@ from rl_coach.core_types import (
     EnvironmentEpisodes,
 )
 
+import numpy as np
 import pytest
 
 
@@ -62,3 +66,63 @@ def test_step_method_rdiv():
 def test_step_method_div_type():
     with pytest.raises(TypeError):
         EnvironmentEpisodes(10) / EnvironmentSteps(2)
+
+
+def make_transitions(num_transitions=10):
+    rng = np.random.RandomState(0)
+    transitions = []
+    for i in range(num_transitions):
+        transition = Transition(state={'observation': rng.randn(3), 'measurements': rng.randn(2)}, action=i,
+                                reward=rng.randn(), next_state={'observation': rng.randn(3)},
+                                game_over=i == num_transitions - 1, info={'value': rng.randn(4)})
+        transition.n_step_discounted_rewards = rng.randn()
+        transitions.append(transition)
+    return transitions
+
+
+def assert_batches_equal(batch, expected):
+    assert batch.size == expected.size == len(batch)
+    for key, value in expected.states(['observation', 'measurements']).items():
+        assert np.array_equal(batch.states(['observation', 'measurements'])[key], value)
+    assert np.array_equal(batch.next_states(['observation'], expand_dims=True)['observation'],
+                          expected.next_states(['observation'], expand_dims=True)['observation'])
+    assert np.array_equal(batch.actions(), expected.actions())
+    assert np.array_equal(batch.rewards(expand_dims=True), expected.rewards(expand_dims=True))
+    assert np.array_equal(batch.game_overs(), expected.game_overs())
+    assert np.array_equal(batch.n_step_discounted_rewards(), expected.n_step_discounted_rewards())
+    assert np.array_equal(batch.info('value'), expected.info('value'))
+    assert [t.action for t in batch.transitions] == [t.action for t in expected.transitions]
+
+
+@pytest.mark.unit_test
+def test_columnar_batch_accessors():
+    transitions = make_transitions()
+    assert_batches_equal(ColumnarBatch.from_transitions(transitions), Batch(transitions))
+
+
+@pytest.mark.unit_test
+def test_columnar_batch_slice_and_shuffle():
+    transitions = make_transitions()
+    batch = ColumnarBatch.from_transitions(transitions)
+    batch.actions()
+    batch.slice(2, 8)
+    assert_batches_equal(batch, Batch(transitions[2:8]))
+
+    batch.shuffle()
+    order = list(batch.actions())
+    assert sorted(order) == list(range(2, 8))
+    assert_batches_equal(batch, Batch([transitions[i] for i in order]))
+
+    batch.slice(1, 3)
+    assert_batches_equal(batch, Batch([transitions[i] for i in order[1:3]]))
+    assert batch[1].action == order[2]
+    assert np.array_equal(batch[1].state['observation'], transitions[order[2]].state['observation'])
+
+
+@pytest.mark.unit_test
+def test_columnar_batch_without_next_states():
+    observations = np.arange(12.0).reshape(4, 3)
+    batch = ColumnarBatch(states={'observation': observations}, actions=np.arange(4))
+    assert np.array_equal(batch.next_states(['observation'])['observation'], observations)
+    with pytest.raises(Exception):
+        batch.rewards()
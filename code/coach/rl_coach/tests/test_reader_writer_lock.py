@@ -0,0 +1,124 @@
+import pickle
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from rl_coach.core_types import Transition
+from rl_coach.memories.episodic.episodic_experience_replay import EpisodicExperienceReplay
+from rl_coach.memories.memory import MemoryGranularity
+from rl_coach.memories.non_episodic.experience_replay import ExperienceReplay
+from rl_coach.utils import ReaderWriterLock
+
+
+def start_thread(target):
+    thread = threading.Thread(target=target)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+@pytest.mark.unit_test
+def test_readers_read_in_parallel():
+    lock = ReaderWriterLock()
+    all_readers_in = threading.Barrier(3, timeout=5)
+
+    def read():
+        lock.lock_writing()
+        all_readers_in.wait()
+        lock.release_writing()
+
+    threads = [start_thread(read) for _ in range(3)]
+    for thread in threads:
+        thread.join(5)
+    assert not all_readers_in.broken
+    assert not lock.some_worker_is_reading()
+
+
+@pytest.mark.unit_test
+def test_writer_waits_for_readers():
+    lock = ReaderWriterLock()
+    events = []
+
+    def write():
+        lock.lock_writing_and_reading()
+        events.append('write')
+        lock.release_writing_and_reading()
+
+    lock.lock_writing()
+    writer = start_thread(write)
+    while lock.num_waiting_writers == 0:
+        time.sleep(0.001)
+
+    # a thread which is already reading can keep reading while the writer waits
+    lock.lock_writing()
+    lock.release_writing()
+
+    # new readers wait for the waiting writer
+    reader = start_thread(lambda: (lock.lock_writing(), events.append('read'), lock.release_writing()))
+    time.sleep(0.05)
+    assert events == []
+
+    events.append('release')
+    lock.release_writing()
+    writer.join(5)
+    reader.join(5)
+    assert events == ['release', 'write', 'read']
+    assert not lock.some_worker_is_reading() and not lock.some_worker_is_writing()
+
+
+@pytest.mark.unit_test
+def test_pickled_lock_is_unlocked():
+    lock = ReaderWriterLock()
+    lock.lock_writing_and_reading()
+    copy = pickle.loads(pickle.dumps(lock))
+    assert not copy.some_worker_is_writing()
+    copy.lock_writing()
+    copy.release_writing()
+    lock.release_writing_and_reading()
+
+
+@pytest.mark.unit_test
+def test_memory_is_writable_while_iterating_over_batches():
+    memory = EpisodicExperienceReplay()
+    for i in range(20):
+        memory.store(Transition(state={'observation': np.array([i])}, action=i, reward=0, game_over=i % 5 == 4))
+    memory.last_training_set_transition_id = memory.num_transitions_in_complete_episodes()
+
+    num_batches = 0
+    for batch in memory.get_shuffled_training_data_generator(4):
+        memory.store(Transition(state={'observation': np.array([0])}, action=0, reward=0, game_over=False))
+        num_batches += 1
+    assert num_batches == 5
+    assert not memory.reader_writer_lock.some_worker_is_reading()
+
+
+@pytest.mark.unit_test
+@pytest.mark.parametrize("array_storage", [False, True])
+def test_episodic_generator_skips_evicted_transitions(array_storage):
+    memory = EpisodicExperienceReplay((MemoryGranularity.Transitions, 20), array_storage=array_storage)
+    for i in range(20):
+        memory.store(Transition(state={'observation': np.array([i])}, action=i, reward=0, game_over=i % 5 == 4))
+    memory.last_training_set_transition_id = memory.num_transitions_in_complete_episodes()
+
+    sampled = 0
+    for batch in memory.get_shuffled_training_data_generator(4):
+        memory.remove_first_episode()
+        sampled += batch.size if array_storage else len(batch)
+    assert 0 < sampled < 20
+    assert not memory.reader_writer_lock.some_worker_is_reading()
+
+
+@pytest.mark.unit_test
+def test_generator_skips_evicted_transitions():
+    memory = ExperienceReplay((MemoryGranularity.Transitions, 20))
+    for i in range(20):
+        memory.store(Transition(state={'observation': np.array([i])}, action=i, reward=0, game_over=False))
+
+    batches = []
+    for batch in memory.get_shuffled_training_data_generator(4):
+        batches.append(batch)
+        memory.remove_transition(0)
+    assert 0 < len(batches) <= 5
+    assert all(0 < len(batch) <= 4 for batch in batches)
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+from rl_coach.core_types import Episode, Transition
+from rl_coach.returns import discounted_returns, n_step_returns, generalized_advantage_estimation
+
+
+def reference_discounted_returns(rewards, discount, dones=None, bootstrap=0.0):
+    returns = np.zeros_like(rewards)
+    current = np.broadcast_to(bootstrap, rewards.shape[:-1]).astype('float')
+    for t in reversed(range(rewards.shape[-1])):
+        not_done = 1.0 if dones is None else 1.0 - dones[..., t]
+        current = rewards[..., t] + discount * not_done * current
+        returns[..., t] = current
+    return returns
+
+
+def reference_n_step_returns(rewards, discount, n_step, bootstrap_values=None):
+    # the implementation Episode.update_discounted_rewards used to have
+    discounted_rewards = rewards.copy()
+    current_discount = discount
+    for i in range(1, n_step):
+        discounted_rewards += current_discount * np.pad(rewards[i:], (0, i), 'constant', constant_values=0)
+        current_discount *= discount
+    if bootstrap_values is not None:
+        discounted_rewards += current_discount * np.pad(bootstrap_values, (0, n_step), 'constant', constant_values=0)
+    return discounted_rewards
+
+
+@pytest.mark.unit_test
+@pytest.mark.parametrize("length", [1, 2, 31, 32, 33, 100])
+def test_discounted_returns(length):
+    rng = np.random.RandomState(length)
+    rewards = rng.randn(3, length)
+    dones = (rng.rand(3, length) < 0.1).astype('float')
+    bootstrap = rng.randn(3)
+    assert np.allclose(discounted_returns(rewards[0], 0.9), reference_discounted_returns(rewards[0], 0.9))
+    assert np.allclose(discounted_returns(rewards, 0.9, bootstrap=bootstrap),
+                       reference_discounted_returns(rewards, 0.9, bootstrap=bootstrap))
+    assert np.allclose(discounted_returns(rewards[0], 0.9, dones[0]), reference_discounted_returns(rewards[0], 0.9, dones[0]))
+    assert np.allclose(discounted_returns(rewards, 0.9, dones, bootstrap),
+                       reference_discounted_returns(rewards, 0.9, dones, bootstrap))
+
+
+@pytest.mark.unit_test
+@pytest.mark.parametrize("n_step", [1, 3, 20, 50, -1])
+def test_n_step_returns(n_step):
+    rng = np.random.RandomState(0)
+    rewards = rng.randn(20)
+    curr_n_step = len(rewards) if n_step == -1 else min(n_step, len(rewards))
+    bootstrap_values = rng.randn(len(rewards) - curr_n_step)
+    assert np.allclose(n_step_returns(rewards, 0.99, n_step), reference_n_step_returns(rewards, 0.99, curr_n_step))
+    assert np.allclose(n_step_returns(rewards, 0.99, n_step, bootstrap_values),
+                       reference_n_step_returns(rewards, 0.99, curr_n_step, bootstrap_values))
+    batch = np.stack([rewards, -rewards])
+    assert np.allclose(n_step_returns(batch, 0.99, n_step)[1], -reference_n_step_returns(rewards, 0.99, curr_n_step))
+
+
+@pytest.mark.unit_test
+@pytest.mark.parametrize("n_step", [0, -2])
+def test_n_step_returns_invalid_n_step(n_step):
+    with pytest.raises(ValueError):
+        n_step_returns(np.ones(5), 0.99, n_step)
+
+
+@pytest.mark.unit_test
+def test_generalized_advantage_estimation():
+    rng = np.random.RandomState(0)
+    rewards = rng.randn(2, 50)
+    values = rng.randn(2, 51)
+    dones = (rng.rand(2, 50) < 0.1).astype('float')
+    discount, gae_lambda = 0.99, 0.95
+    expected = np.zeros_like(rewards)
+    advantage = np.zeros(2)
+    for t in reversed(range(50)):
+        delta = rewards[:, t] + discount * (1 - dones[:, t]) * values[:, t + 1] - values[:, t]
+        advantage = delta + discount * gae_lambda * (1 - dones[:, t]) * advantage
+        expected[:, t] = advantage
+    assert np.allclose(generalized_advantage_estimation(rewards, values, discount, gae_lambda, dones), expected)
+
+
+@pytest.mark.unit_test
+@pytest.mark.parametrize("n_step", [1, 3, -1])
+def test_episode_update_discounted_rewards(n_step):
+    rng = np.random.RandomState(0)
+    rewards = rng.randn(10)
+    values = rng.randn(10)
+    episode = Episode(discount=0.9, bootstrap_total_return_from_old_policy=True, n_step=n_step)
+    for reward, value in zip(rewards, values):
+        episode.insert(Transition(state={}, action=0, reward=reward, game_over=False,
+                                  info={'max_action_value': np.array([value])}))
+    episode.update_discounted_rewards()
+    curr_n_step = len(rewards) if n_step == -1 else n_step
+    expected = reference_n_step_returns(rewards, 0.9, curr_n_step, values[curr_n_step:])
+    assert np.allclose([t.n_step_discounted_rewards for t in episode.transitions], expected)
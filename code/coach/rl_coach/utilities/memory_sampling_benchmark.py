@@ -0,0 +1,101 @@
+#
+# Copyright (c) 2017 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Sampling throughput of the replay memories, with one or more threads sampling from the same memory at once.
+The memory is filled with random vector observations, then each thread draws a fixed number of batches, e.g.:
+    python -m rl_coach.utilities.memory_sampling_benchmark --num_threads 1 2 4 --array_storage
+Threads can only add throughput on a machine with several cores, and only for the work that releases the GIL (the
+copies of the rows of the array storage).
+"""
+
+import argparse
+import os
+import threading
+import time
+
+import numpy as np
+
+from rl_coach.core_types import Transition, Episode
+from rl_coach.memories.episodic.episodic_experience_replay import EpisodicExperienceReplay
+from rl_coach.memories.memory import MemoryGranularity
+from rl_coach.memories.non_episodic.experience_replay import ExperienceReplay
+
+
+def create_memory(memory_type, num_episodes, episode_length, observation_size, array_storage=False):
+    max_size = (MemoryGranularity.Transitions, num_episodes * episode_length)
+    if memory_type == 'episodic':
+        memory = EpisodicExperienceReplay(max_size, array_storage=array_storage)
+    else:
+        memory = ExperienceReplay(max_size)
+
+    for _ in range(num_episodes):
+        episode = Episode()
+        for step in range(episode_length):
+            episode.insert(Transition(state={'observation': np.random.rand(observation_size).astype(np.float32)},
+                                      action=step, reward=1.0,
+                                      next_state={'observation': np.random.rand(observation_size).astype(np.float32)},
+                                      game_over=step == episode_length - 1))
+        if memory_type == 'episodic':
+            memory.store_episode(episode)
+        else:
+            for transition in episode.transitions:
+                memory.store(transition)
+    return memory
+
+
+def measure_sampling(memory, num_threads, batch_size, num_batches):
+    """
+    Sample num_batches batches in each of num_threads threads, all sampling from the memory at once
+    :return: the total number of sampled batches per second
+    """
+    def sample():
+        for _ in range(num_batches):
+            memory.sample(batch_size)
+
+    threads = [threading.Thread(target=sample) for _ in range(num_threads)]
+    start_time = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return num_threads * num_batches / (time.time() - start_time)
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument('--memory', choices=['episodic', 'experience_replay'], default='episodic',
+                           help='The memory to sample from')
+    argparser.add_argument('--array_storage', action='store_true',
+                           help='Store the transitions of the episodic memory in arrays')
+    argparser.add_argument('--num_threads', type=int, nargs='+', default=[1, 2, 4],
+                           help='The numbers of sampling threads to measure')
+    argparser.add_argument('--batch_size', type=int, default=256)
+    argparser.add_argument('--num_batches', type=int, default=150, help='The number of batches sampled per thread')
+    argparser.add_argument('--num_episodes', type=int, default=200)
+    argparser.add_argument('--episode_length', type=int, default=100)
+    argparser.add_argument('--observation_size', type=int, default=64)
+    args = argparser.parse_args()
+
+    memory = create_memory(args.memory, args.num_episodes, args.episode_length, args.observation_size,
+                           args.array_storage)
+    # a first round, so that the measured rounds do not include any one-time setup
+    measure_sampling(memory, 1, args.batch_size, 1)
+    print("{} cores".format(os.cpu_count()))
+    for num_threads in args.num_threads:
+        batches_per_second = measure_sampling(memory, num_threads, args.batch_size, args.num_batches)
+        print("{} threads: {:.0f} batches/s of {} transitions".format(num_threads, batches_per_second,
+                                                                       args.batch_size))
@@ -24,7 +24,6 @@ import sys
 import threading
 import time
 import traceback
-from multiprocessing import Manager
 from subprocess import Popen
 from typing import List, Tuple, Union
 
@@ -462,11 +461,33 @@ class Timer(object):
 
 
 class ReaderWriterLock(object):
+    """
+    A lock which allows many threads to read in parallel while a single thread writes.
+    lock_writing / release_writing are taken by readers: they block writing but not other readers.
+    lock_writing_and_reading / release_writing_and_reading are taken by a writer: they block everyone else.
+    A waiting writer blocks readers who haven't started reading yet, so readers can't starve the writers. A thread that
+    is already reading can lock reading again without waiting.
+    Readers and writers wait on a condition instead of polling, and the lock is local to the process - a pickled
+    copy of the lock (e.g. in a memory that is shared through the SharedMemoryScratchPad) is a new unlocked lock.
+    """
     def __init__(self):
-        self.num_readers_lock = Manager().Lock()
-        self.writers_lock = Manager().Lock()
+        self._create_lock()
+
+    def _create_lock(self):
+        self.condition = threading.Condition(threading.Lock())
         self.num_readers = 0
+        self.num_waiting_writers = 0
         self.now_writing = False
+        self.thread_state = threading.local()
+
+    def __getstate__(self):
+        return {}
+
+    def __setstate__(self, state):
+        self._create_lock()
+
+    def _reading_depth(self):
+        return getattr(self.thread_state, 'reading_depth', 0)
 
     def some_worker_is_reading(self):
         return self.num_readers > 0
@@ -475,27 +496,33 @@ class ReaderWriterLock(object):
         return self.now_writing is True
 
     def lock_writing_and_reading(self):
-        self.writers_lock.acquire()  # first things first - block all other writers
-        self.now_writing = True  # block new readers who haven't started reading yet
-        while self.some_worker_is_reading():  # let existing readers finish their homework
-            time.sleep(0.05)
+        with self.condition:
+            self.num_waiting_writers += 1  # block new readers who haven't started reading yet
+            while self.now_writing or self.some_worker_is_reading():  # let existing readers finish their homework
+                self.condition.wait()
+            self.num_waiting_writers -= 1
+            self.now_writing = True
 
     def release_writing_and_reading(self):
-        self.now_writing = False  # release readers - guarantee no readers starvation
-        self.writers_lock.release()  # release writers
+        with self.condition:
+            self.now_writing = False
+            self.condition.notify_all()  # release the waiting readers and writers
 
     def lock_writing(self):
-        while self.now_writing:
-            time.sleep(0.05)
-
-        self.num_readers_lock.acquire()
-        self.num_readers += 1
-        self.num_readers_lock.release()
+        reading_depth = self._reading_depth()
+        with self.condition:
+            if reading_depth == 0:
+                while self.now_writing or self.num_waiting_writers > 0:
+                    self.condition.wait()
+            self.num_readers += 1
+        self.thread_state.reading_depth = reading_depth + 1
 
     def release_writing(self):
-        self.num_readers_lock.acquire()
-        self.num_readers -= 1
-        self.num_readers_lock.release()
+        self.thread_state.reading_depth = self._reading_depth() - 1
+        with self.condition:
+            self.num_readers -= 1
+            if self.num_readers == 0:
+                self.condition.notify_all()
 
 
 class ProgressBar(object):
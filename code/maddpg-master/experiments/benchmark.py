@@ -0,0 +1,181 @@
+import argparse
+import time
+import numpy as np
+import tensorflow as tf
+
+import maddpg.common.tf_util as U
+from maddpg.trainer.replay_buffer import ReplayBuffer, JointReplayBuffer
+from multiagent import benchmark as env_benchmark
+import train
+
+def parse_args():
+    parser = argparse.ArgumentParser("Throughput benchmarks of the particle environments, replay buffers and MADDPG updates")
+    parser.add_argument("--suites", type=str, nargs="+", default=["env", "replay", "update"], help="benchmarks to run")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--output", type=str, default="./benchmark_files/throughput.json", help="JSON file the results are written to")
+    # env
+    parser.add_argument("--scenarios", type=str, nargs="+", default=None, help="scenarios of the env suite (default: all)")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 4], help="agent replication factors of the env suite")
+    parser.add_argument("--num-envs", type=int, nargs="+", default=[1, 8], help="environment batch sizes of the env suite")
+    parser.add_argument("--num-steps", type=int, default=200, help="timed environment steps per configuration")
+    # replay
+    parser.add_argument("--capacities", type=float, nargs="+", default=[1e4, 1e5, 1e6], help="replay buffer capacities")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[32, 256, 1024], help="replay sample / update batch sizes")
+    parser.add_argument("--replay-agents", type=int, default=4, help="number of agents of the JointReplayBuffer")
+    parser.add_argument("--repeats", type=int, default=100, help="timed calls per replay configuration")
+    # update
+    parser.add_argument("--update-scenario", type=str, default="simple_spread", help="scenario of the update suite")
+    parser.add_argument("--update-scales", type=int, nargs="+", default=[1, 2, 4], help="agent replication factors of the update suite")
+    parser.add_argument("--policies", type=str, nargs="+", default=["maddpg", "m3ddpg"], help="policies of the update suite")
+    parser.add_argument("--num-rounds", type=int, default=20, help="timed update rounds per configuration")
+    parser.add_argument("--num-units", type=int, default=64, help="number of units in the mlp")
+    return parser.parse_args()
+
+def replay_latency(joint, capacity, batch_size, num_agents=1, obs_dim=16, act_dim=5, repeats=100):
+    # microseconds per add / add_batch / sample on a buffer filled to capacity
+    capacity = int(capacity)
+    if joint:
+        replay_buffer = JointReplayBuffer(capacity, num_agents)
+        def transitions(size):
+            return ([np.random.randn(size, obs_dim) for _ in range(num_agents)],
+                    [np.random.rand(size, act_dim) for _ in range(num_agents)],
+                    np.random.randn(size, num_agents),
+                    [np.random.randn(size, obs_dim) for _ in range(num_agents)],
+                    np.zeros((size, num_agents)))
+        def single():
+            obs_n, act_n, rew_n, obs_next_n, done_n = transitions(1)
+            return [obs[0] for obs in obs_n], [act[0] for act in act_n], rew_n[0], [obs[0] for obs in obs_next_n], done_n[0]
+        def sample():
+            return replay_buffer.sample_index(replay_buffer.make_index(batch_size))
+    else:
+        replay_buffer = ReplayBuffer(capacity)
+        def transitions(size):
+            return (np.random.randn(size, obs_dim), np.random.rand(size, act_dim), np.random.randn(size),
+                    np.random.randn(size, obs_dim), np.zeros(size))
+        def single():
+            return [x[0] for x in transitions(1)]
+        def sample():
+            return replay_buffer.sample(batch_size)
+    chunk = min(capacity, 10000)
+    for _ in range(capacity // chunk):
+        replay_buffer.add_batch(*transitions(chunk))
+
+    def latency(fn, args_list):
+        t_start = time.time()
+        for args in args_list:
+            fn(*args)
+        return 1e6 * (time.time() - t_start) / len(args_list)
+
+    return {
+        'buffer': 'JointReplayBuffer' if joint else 'ReplayBuffer',
+        'num_agents': num_agents,
+        'capacity': capacity,
+        'batch_size': batch_size,
+        'add_us': latency(replay_buffer.add, [single() for _ in range(repeats)]),
+        'add_batch_us': latency(replay_buffer.add_batch, [transitions(batch_size) for _ in range(repeats)]),
+        'sample_us': latency(sample, [() for _ in range(repeats)]),
+    }
+
+def run_replay_suite(args):
+    results = []
+    for joint in [False, True]:
+        for capacity in args.capacities:
+            for batch_size in args.batch_sizes:
+                result = replay_latency(joint, capacity, batch_size, args.replay_agents if joint else 1, repeats=args.repeats)
+                print('{buffer} capacity={capacity} batch={batch_size}: add {add_us:.1f}us, '
+                      'add_batch {add_batch_us:.1f}us, sample {sample_us:.1f}us'.format(**result))
+                results.append(result)
+    return results
+
+def update_phases(trainers, gamma, num_rounds):
+    # seconds per update round spent in each phase of MADDPGAgentTrainer.update, summed over the agents
+    phases = dict.fromkeys(['sample', 'target_act', 'critic', 'actor', 'polyak'], 0.0)
+    for _ in range(num_rounds):
+        for agent in trainers:
+            agent.preupdate()
+        for agent in trainers:
+            t0 = time.time()
+            obs_n, act_n, rew, obs_next_n, done = agent.sample_batch(trainers)
+            t1 = time.time()
+            target_act_next_n = [trainers[i].p_debug['target_act'](obs_next_n[i]) for i in range(len(trainers))]
+            t2 = time.time()
+            target_q_next = agent.q_debug['target_q_values'](*(obs_next_n + target_act_next_n))
+            agent.q_train(*(obs_n + act_n + [rew + gamma * (1.0 - done) * target_q_next]))
+            t3 = time.time()
+            agent.p_train(*(obs_n + act_n))
+            t4 = time.time()
+            agent.p_update()
+            agent.q_update()
+            t5 = time.time()
+            for phase, dt in zip(['sample', 'target_act', 'critic', 'actor', 'polyak'], [t1 - t0, t2 - t1, t3 - t2, t4 - t3, t5 - t4]):
+                phases[phase] += dt
+    return {phase: total / num_rounds for phase, total in phases.items()}
+
+def update_timing(scenario_name, scale, policy, batch_size, args):
+    arglist = train.parse_args([])
+    arglist.good_policy = arglist.adv_policy = policy
+    arglist.batch_size = batch_size
+    arglist.num_units = args.num_units
+    arglist.max_episode_len = 1  # updates are possible once a single batch is stored
+    with tf.Graph().as_default(), U.single_threaded_session():
+        tf.set_random_seed(args.seed)
+        np.random.seed(args.seed)
+        env = env_benchmark.make_scaled_env(scenario_name, scale)
+        obs_shape_n = [env.observation_space[i].shape for i in range(env.n)]
+        num_adversaries = sum(getattr(agent, 'adversary', False) for agent in env.agents)
+        trainers = train.get_trainers(env, num_adversaries, obs_shape_n, arglist)
+        fused_update = train.MADDPGFusedUpdate(trainers, obs_shape_n, env.action_space, arglist)
+        U.initialize()
+
+        # fill the replay buffers with random transitions
+        obs_n = env.reset()
+        for _ in range(batch_size):
+            action_n = [agent.action(obs) for agent, obs in zip(trainers, obs_n)]
+            new_obs_n, rew_n, done_n, _ = env.step(action_n)
+            train.store_experience(trainers, obs_n, action_n, rew_n, new_obs_n, done_n, False)
+            obs_n = new_obs_n
+
+        update_phases(trainers, arglist.gamma, 1)  # warm-up
+        phases = update_phases(trainers, arglist.gamma, args.num_rounds)
+        fused_update.update_batch(fused_update.sample())
+        t_start = time.time()
+        for _ in range(args.num_rounds):
+            fused_update.update_batch(fused_update.sample())
+        fused_round = (time.time() - t_start) / args.num_rounds
+    return {
+        'scenario': scenario_name,
+        'scale': scale,
+        'num_agents': len(trainers),
+        'policy': policy,
+        'batch_size': batch_size,
+        'phases': phases,
+        'round': sum(phases.values()),
+        'fused_round': fused_round,
+    }
+
+def run_update_suite(args):
+    results = []
+    for scale in args.update_scales:
+        for policy in args.policies:
+            for batch_size in args.batch_sizes:
+                result = update_timing(args.update_scenario, scale, policy, batch_size, args)
+                print('{} n={} {} batch={}: {:.1f} ms per round ({}), fused {:.1f} ms'.format(
+                    result['scenario'], result['num_agents'], policy, batch_size, 1000 * result['round'],
+                    ', '.join('{} {:.1f}'.format(phase, 1000 * t) for phase, t in result['phases'].items()),
+                    1000 * result['fused_round']))
+                results.append(result)
+    return results
+
+if __name__ == '__main__':
+    args = parse_args()
+    results = {'meta': env_benchmark.metadata(args)}
+    results['meta']['tensorflow'] = tf.__version__
+    if "env" in args.suites:
+        results['env'] = env_benchmark.run_env_suite(args.scenarios or env_benchmark.scenario_names(), args.scales,
+                                                     args.num_envs, num_steps=args.num_steps, seed=args.seed)
+    if "replay" in args.suites:
+        np.random.seed(args.seed)
+        results['replay'] = run_replay_suite(args)
+    if "update" in args.suites:
+        results['update'] = run_update_suite(args)
+    env_benchmark.write_json(results, args.output)
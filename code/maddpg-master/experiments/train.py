@@ -1,32 +1,51 @@
 import argparse
+import contextlib
+import functools
 import numpy as np
 import tensorflow as tf
 import time
 import pickle
 
 import maddpg.common.tf_util as U
-from maddpg.trainer.maddpg import MADDPGAgentTrainer
+from maddpg.common import checkpoint, profiling
+from maddpg.trainer.maddpg import MADDPGAgentTrainer, MADDPGFusedUpdate, MADDPGGroupPolicy, MADDPGPopulationTrainer, PolicySnapshot
+from maddpg.trainer.learner import AsyncLearner
+from maddpg.trainer.replay_buffer import JointReplayBuffer
 import tensorflow.contrib.layers as layers
 
-def parse_args():
+def parse_args(args=None):
     parser = argparse.ArgumentParser("Reinforcement Learning experiments for multiagent environments")
     # Environment
     parser.add_argument("--scenario", type=str, default="simple_push", help="name of the scenario script")
     parser.add_argument("--max-episode-len", type=int, default=25, help="maximum episode length")
     parser.add_argument("--num-episodes", type=int, default=60000, help="number of episodes")
     parser.add_argument("--num-adversaries", type=int, default=0, help="number of adversaries")
+    parser.add_argument("--vectorized-world", action="store_true", default=False, help="simulate physics with array-backed VectorizedWorld")
+    parser.add_argument("--num-envs", type=int, default=1, help="number of environments simulated as one batch")
+    parser.add_argument("--num-workers", type=int, default=0, help="number of environments run in worker processes (0: no workers)")
     parser.add_argument("--good-policy", type=str, default="maddpg", help="policy for good agents")
     parser.add_argument("--adv-policy", type=str, default="maddpg", help="policy of adversaries")
+    parser.add_argument("--population-size", type=int, default=1, help="number of policy variants per adversary (1: no population)")
+    parser.add_argument("--adv-eps", type=float, default=1e-3, help="size of the worst-case action perturbation of m3ddpg policies")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the environments, replay buffers and graph (default: unseeded)")
     # Core training parameters
     parser.add_argument("--lr", type=float, default=1e-2, help="learning rate for Adam optimizer")
     parser.add_argument("--gamma", type=float, default=0.95, help="discount factor")
     parser.add_argument("--batch-size", type=int, default=1024, help="number of episodes to optimize at the same time")
     parser.add_argument("--num-units", type=int, default=64, help="number of units in the mlp")
+    parser.add_argument("--joint-replay", action="store_true", default=False, help="store all agents' transitions in one shared replay buffer")
+    parser.add_argument("--fused-update", action="store_true", default=False, help="update all agents with a single session run per training round")
+    parser.add_argument("--group-inference", action="store_true", default=False, help="select the actions of all agents with a single session run")
+    parser.add_argument("--async-learner", action="store_true", default=False, help="run the updates in a learner thread, acting with a policy snapshot")
+    parser.add_argument("--update-ratio", type=float, default=1.0, help="update rounds of the learner thread per 100 environment steps (<= 0: no limit)")
+    parser.add_argument("--snapshot-rate", type=int, default=1, help="update rounds between two refreshes of the acting policy snapshot")
     # Checkpointing
     parser.add_argument("--exp-name", type=str, default=None, help="name of the experiment")
     parser.add_argument("--save-dir", type=str, default="/tmp/policy/", help="directory in which training state and model should be saved")
     parser.add_argument("--save-rate", type=int, default=1000, help="save model once every time this many episodes are completed")
     parser.add_argument("--load-dir", type=str, default="", help="directory in which training state and model are loaded")
+    parser.add_argument("--async-checkpoint", action="store_true", default=False, help="write checkpoints and learning curves from a background thread")
+    parser.add_argument("--keep-checkpoints", type=int, default=5, help="number of most recent asynchronous checkpoints kept")
     # Evaluation
     parser.add_argument("--restore", action="store_true", default=False)
     parser.add_argument("--display", action="store_true", default=False)
@@ -34,7 +53,13 @@ def parse_args():
     parser.add_argument("--benchmark-iters", type=int, default=100000, help="number of iterations run for benchmarking")
     parser.add_argument("--benchmark-dir", type=str, default="./benchmark_files/", help="directory where benchmark data is saved")
     parser.add_argument("--plots-dir", type=str, default="./learning_curves/", help="directory where plot data is saved")
-    return parser.parse_args()
+    # Profiling
+    parser.add_argument("--profile", action="store_true", default=False, help="report the time spent per loop phase and per session run")
+    parser.add_argument("--trace-step", type=int, default=None, help="write TensorFlow timelines of the session runs of this training step")
+    parser.add_argument("--stack-sample-steps", type=int, nargs=2, default=None, metavar=("START", "END"), help="sample the Python stack from training step START to END")
+    parser.add_argument("--stack-sample-interval", type=float, default=0.005, help="seconds between two Python stack samples")
+    parser.add_argument("--profile-dir", type=str, default="./profile_files/", help="directory where timelines and stack samples are saved")
+    return parser.parse_args(args)
 
 def mlp_model(input, num_outputs, scope, reuse=False, num_units=64, rnn_cell=None):
     # This model takes as input an observation and returns values of all actions
@@ -45,44 +70,238 @@ def mlp_model(input, num_outputs, scope, reuse=False, num_units=64, rnn_cell=Non
         out = layers.fully_connected(out, num_outputs=num_outputs, activation_fn=None)
         return out
 
-def make_env(scenario_name, arglist, benchmark=False):
+# independent streams derived from --seed
+ENV_SEEDS = 0
+TRAINER_SEEDS = 1
+
+def spawn_seeds(arglist, stream, num):
+    # num independent seeds of one of the streams above (None each without --seed)
+    if arglist.seed is None:
+        return [None] * num
+    return np.random.SeedSequence([arglist.seed, stream]).spawn(num)
+
+def make_env(scenario_name, arglist, benchmark=False, seed=None):
     from multiagent.environment import MultiAgentEnv
+    from multiagent.core import VectorizedWorld
     import multiagent.scenarios as scenarios
 
     # load scenario from script
     scenario = scenarios.load(scenario_name + ".py").Scenario()
     # create world
     world = scenario.make_world()
+    if arglist.vectorized_world:
+        world = VectorizedWorld(world)
     # create multiagent environment
     if benchmark:
-        env = MultiAgentEnv(world, scenario.reset_world, scenario.reward, scenario.observation, scenario.benchmark_data)
+        env = MultiAgentEnv(world, scenario.reset_world, scenario.reward, scenario.observation, scenario.benchmark_data,
+                            observations_callback=scenario.observations_all, rewards_callback=scenario.rewards_all)
     else:
-        env = MultiAgentEnv(world, scenario.reset_world, scenario.reward, scenario.observation)
+        env = MultiAgentEnv(world, scenario.reset_world, scenario.reward, scenario.observation,
+                            observations_callback=scenario.observations_all, rewards_callback=scenario.rewards_all)
+    if seed is not None:
+        env.seed(seed)
     return env
 
+def make_batch_env(scenario_name, arglist):
+    from multiagent.environment import BatchMultiAgentEnv
+    env_batch = [make_env(scenario_name, arglist, seed=seed) for seed in spawn_seeds(arglist, ENV_SEEDS, arglist.num_envs)]
+    return BatchMultiAgentEnv(env_batch, arglist.max_episode_len)
+
+def make_subproc_env(scenario_name, arglist):
+    from maddpg.common.vec_env import SubprocBatchMultiAgentEnv
+    env_fns = [functools.partial(make_env, scenario_name, arglist, seed=seed)
+               for seed in spawn_seeds(arglist, ENV_SEEDS, arglist.num_workers)]
+    return SubprocBatchMultiAgentEnv(env_fns, arglist.max_episode_len)
+
 def get_trainers(env, num_adversaries, obs_shape_n, arglist):
     trainers = []
     model = mlp_model
     trainer = MADDPGAgentTrainer
+    # one seed per agent, and one more for the shared buffer
+    seeds = spawn_seeds(arglist, TRAINER_SEEDS, env.n + 1)
+    replay_buffer = JointReplayBuffer(1e6, env.n, seed=seeds[-1]) if arglist.joint_replay else None
     for i in range(num_adversaries):
+        if arglist.population_size > 1:
+            # fused updates and group inference need one mlp_model policy per agent
+            assert not (arglist.fused_update or arglist.group_inference), "populations are updated and evaluated by their own trainers"
+            trainers.append(MADDPGPopulationTrainer(
+                "agent_%d" % i, obs_shape_n, env.action_space, i, arglist, arglist.population_size,
+                local_q_func=(arglist.adv_policy=='ddpg'), replay_buffer=replay_buffer,
+                adv_eps=(arglist.adv_eps if arglist.adv_policy=='m3ddpg' else 0.0),
+                policy_snapshot=arglist.async_learner, seed=seeds[i]))
+            continue
         trainers.append(trainer(
             "agent_%d" % i, model, obs_shape_n, env.action_space, i, arglist,
-            local_q_func=(arglist.adv_policy=='ddpg')))
+            local_q_func=(arglist.adv_policy=='ddpg'), replay_buffer=replay_buffer,
+            adv_eps=(arglist.adv_eps if arglist.adv_policy=='m3ddpg' else 0.0),
+            policy_snapshot=arglist.async_learner, seed=seeds[i]))
     for i in range(num_adversaries, env.n):
         trainers.append(trainer(
             "agent_%d" % i, model, obs_shape_n, env.action_space, i, arglist,
-            local_q_func=(arglist.good_policy=='ddpg')))
+            local_q_func=(arglist.good_policy=='ddpg'), replay_buffer=replay_buffer,
+            adv_eps=(arglist.adv_eps if arglist.good_policy=='m3ddpg' else 0.0),
+            policy_snapshot=arglist.async_learner, seed=seeds[i]))
     return trainers
 
+def get_fused_update(trainers, obs_shape_n, env, arglist):
+    # must be built before the variables are initialized
+    if not arglist.fused_update:
+        return None
+    return MADDPGFusedUpdate(trainers, obs_shape_n, env.action_space, arglist)
+
+def get_group_policy(trainers, obs_shape_n, env, arglist):
+    if not arglist.group_inference:
+        return None
+    return MADDPGGroupPolicy(trainers, obs_shape_n, env.action_space, use_snapshot=arglist.async_learner)
+
+def get_learner(trainers, fused_update, arglist):
+    # must be built before the variables are initialized
+    if not arglist.async_learner:
+        return None
+
+    def sample():
+        with profiling.phase("sample"):
+            if fused_update is not None:
+                return fused_update.sample()
+            for agent in trainers:
+                agent.preupdate()
+            return [agent.sample_batch(trainers) for agent in trainers]
+
+    def update(batches):
+        if fused_update is not None:
+            return fused_update.update_batch(batches)
+        loss = None
+        for agent, batch in zip(trainers, batches):
+            loss = agent.update_batch(trainers, batch)
+        return loss
+
+    def ready():
+        return len(trainers[0].replay_buffer) >= trainers[0].max_replay_buffer_len
+
+    return AsyncLearner(sample, update, ready, PolicySnapshot(trainers),
+                        update_ratio=arglist.update_ratio, snapshot_rate=arglist.snapshot_rate)
+
+def get_profiler(arglist):
+    if not (arglist.profile or arglist.trace_step is not None or arglist.stack_sample_steps is not None):
+        return None
+    return profiling.Profiler(arglist.profile_dir, function_timers=arglist.profile, trace_step=arglist.trace_step,
+                              stack_sample_steps=arglist.stack_sample_steps,
+                              stack_sample_interval=arglist.stack_sample_interval)
+
+def make_session(arglist):
+    if arglist.seed is not None:
+        # weight initialization and action sampling of the graph built in the session
+        tf.set_random_seed(arglist.seed)
+    # the learner thread needs a second inter-op thread to train next to action selection
+    return U.make_session(2) if arglist.async_learner else U.single_threaded_session()
+
+def get_checkpointer(arglist):
+    # must be built once all variables exist
+    if not arglist.async_checkpoint:
+        return None
+    return checkpoint.AsyncCheckpointer(arglist.save_dir, max_to_keep=arglist.keep_checkpoints)
+
+def load_state(arglist):
+    # the latest asynchronous checkpoint if there is one, else a tf.train.Saver checkpoint
+    path = checkpoint.latest_checkpoint(arglist.load_dir)
+    if path is None:
+        U.load_state(arglist.load_dir)
+    else:
+        checkpoint.restore(path)
+
+def save_state(arglist, saver, learner, checkpointer=None, train_step=0, curves=None):
+    # with a learner thread, the variables are read between two update rounds
+    with learner.paused() if learner is not None else contextlib.nullcontext():
+        if checkpointer is not None:
+            checkpointer.save(train_step, curves)
+        else:
+            U.save_state(arglist.save_dir, saver=saver)
+
+def sample_opponents(trainers, num_envs=1, done=None):
+    # draw the adversary variants of the episodes that start (all, or those of the finished environments)
+    for agent in trainers:
+        if isinstance(agent, MADDPGPopulationTrainer):
+            agent.sample_variants(num_envs, done)
+
+def update_trainers(trainers, fused_update, t):
+    if fused_update is not None:
+        return fused_update.update(t)
+    loss = None
+    for agent in trainers:
+        agent.preupdate()
+    for agent in trainers:
+        loss = agent.update(trainers, t) # this is where the update of agents' parameters is
+    return loss
+
+def store_experience(trainers, obs_n, action_n, rew_n, new_obs_n, done_n, terminal):
+    if trainers[0].joint_replay:
+        trainers[0].replay_buffer.add(obs_n, action_n, rew_n, new_obs_n, done_n)
+    else:
+        for i, agent in enumerate(trainers):
+            agent.experience(obs_n[i], action_n[i], rew_n[i], new_obs_n[i], done_n[i], terminal)
+
+def store_experience_batch(trainers, obs_n, action_n, rew_n, new_obs_n, done_n, terminal):
+    # rew_n / done_n are (num_envs, n) arrays, the others one (num_envs, dim) array per agent
+    if trainers[0].joint_replay:
+        trainers[0].replay_buffer.add_batch(obs_n, action_n, rew_n, new_obs_n, done_n)
+    else:
+        for i, agent in enumerate(trainers):
+            agent.experience_batch(obs_n[i], action_n[i], rew_n[:, i], new_obs_n[i], done_n[:, i], terminal)
+
+
+def report(arglist, train_step, episode_rewards, agent_rewards, num_adversaries, t_start, learner=None, profiler=None):
+    # print statement depends on whether or not there are adversaries
+    if num_adversaries == 0:
+        print("steps: {}, episodes: {}, mean episode reward: {}, time: {}".format(
+            train_step, len(episode_rewards), np.mean(episode_rewards[-arglist.save_rate:]), round(time.time()-t_start, 3)))
+    else:
+        print("steps: {}, episodes: {}, mean episode reward: {}, agent episode reward: {}, time: {}".format(
+            train_step, len(episode_rewards), np.mean(episode_rewards[-arglist.save_rate:]),
+            [np.mean(rew[-arglist.save_rate:]) for rew in agent_rewards], round(time.time()-t_start, 3)))
+    if learner is not None:
+        stats = learner.stats()
+        print("collect: {:.0f} steps/s, learner: {:.2f} updates/s ({:.2f} per 100 steps, {:.1f} ms each, idle {:.0%}), "
+              "replay lock wait: {:.3f}s, snapshots loaded: {}".format(
+            stats['steps_per_sec'], stats['updates_per_sec'], stats['updates_per_100_steps'], 1000 * stats['update_time'],
+            stats['learner_idle'], stats['collect_wait'], stats['snapshot_loads']))
+    if profiler is not None:
+        print(profiler.summary())
+
+def curve_files(arglist, final_ep_rewards, final_ep_ag_rewards):
+    # copies, as the asynchronous checkpointer pickles them while training goes on
+    if arglist.exp_name is None:
+        # the curves of an unnamed experiment are not saved
+        return {}
+    return {arglist.plots_dir + arglist.exp_name + '_rewards.pkl': list(final_ep_rewards),
+            arglist.plots_dir + arglist.exp_name + '_agrewards.pkl': list(final_ep_ag_rewards)}
+
+def checkpoint_curves(arglist, checkpointer, final_ep_rewards, final_ep_ag_rewards):
+    # only the asynchronous checkpointer writes the curves together with a checkpoint
+    if checkpointer is None:
+        return None
+    return curve_files(arglist, final_ep_rewards, final_ep_ag_rewards)
+
+def save_curves(arglist, final_ep_rewards, final_ep_ag_rewards):
+    for file_name, curve in curve_files(arglist, final_ep_rewards, final_ep_ag_rewards).items():
+        with open(file_name, 'wb') as fp:
+            pickle.dump(curve, fp)
+
 
 def train(arglist):
-    with U.single_threaded_session():
+    if arglist.num_envs > 1 or arglist.num_workers > 0:
+        return train_batch(arglist)
+    with make_session(arglist):
         # Create environment
-        env = make_env(arglist.scenario, arglist, arglist.benchmark)
+        env = make_env(arglist.scenario, arglist, arglist.benchmark, seed=spawn_seeds(arglist, ENV_SEEDS, 1)[0])
         # Create agent trainers
         obs_shape_n = [env.observation_space[i].shape for i in range(env.n)]
         num_adversaries = min(env.n, arglist.num_adversaries)
         trainers = get_trainers(env, num_adversaries, obs_shape_n, arglist)
+        fused_update = get_fused_update(trainers, obs_shape_n, env, arglist)
+        group_policy = get_group_policy(trainers, obs_shape_n, env, arglist)
+        learner = get_learner(trainers, fused_update, arglist)
+        profiler = get_profiler(arglist)
+        checkpointer = get_checkpointer(arglist)
         print('Using good policy {} and adv policy {}'.format(arglist.good_policy, arglist.adv_policy))
 
         # Initialize
@@ -93,7 +312,10 @@ def train(arglist):
             arglist.load_dir = arglist.save_dir
         if arglist.display or arglist.restore or arglist.benchmark:
             print('Loading previous state...')
-            U.load_state(arglist.load_dir)
+            load_state(arglist)
+        if learner is not None:
+            assert not (arglist.display or arglist.benchmark), "the learner thread is only used for training"
+            learner.start()
 
         episode_rewards = [0.0]  # sum of rewards for all agents
         agent_rewards = [[0.0] for _ in range(env.n)]  # individual agent reward
@@ -102,22 +324,36 @@ def train(arglist):
         agent_info = [[[]]]  # placeholder for benchmarking info
         saver = tf.train.Saver()
         obs_n = env.reset()
+        sample_opponents(trainers)
         episode_step = 0
         train_step = 0
         t_start = time.time()
 
         print('Starting iterations...')
+        if profiler is not None:
+            profiler.start()
         while True:
+            if profiler is not None:
+                profiler.step(train_step)
             # get action
-            action_n = [agent.action(obs) for agent, obs in zip(trainers,obs_n)]
+            with profiling.phase("act"):
+                if group_policy is not None:
+                    action_n = group_policy.action(obs_n)
+                else:
+                    action_n = [agent.action(obs) for agent, obs in zip(trainers,obs_n)]
             # environment step
-            new_obs_n, rew_n, done_n, info_n = env.step(action_n)
+            with profiling.phase("env"):
+                new_obs_n, rew_n, done_n, info_n = env.step(action_n)
             episode_step += 1
             done = all(done_n)
             terminal = (episode_step >= arglist.max_episode_len)
             # collect experience
-            for i, agent in enumerate(trainers):
-                agent.experience(obs_n[i], action_n[i], rew_n[i], new_obs_n[i], done_n[i], terminal)
+            with profiling.phase("store"):
+                if learner is not None:
+                    with learner.collecting(1):
+                        store_experience(trainers, obs_n, action_n, rew_n, new_obs_n, done_n, terminal)
+                else:
+                    store_experience(trainers, obs_n, action_n, rew_n, new_obs_n, done_n, terminal)
             obs_n = new_obs_n
 
             for i, rew in enumerate(rew_n):
@@ -125,7 +361,9 @@ def train(arglist):
                 agent_rewards[i][-1] += rew
 
             if done or terminal:
-                obs_n = env.reset()
+                with profiling.phase("env"):
+                    obs_n = env.reset()
+                sample_opponents(trainers)
                 episode_step = 0
                 episode_rewards.append(0)
                 for a in agent_rewards:
@@ -154,39 +392,149 @@ def train(arglist):
                 continue
 
             # update all trainers, if not in display or benchmark mode
-            loss = None
-            for agent in trainers:
-                agent.preupdate()
-            for agent in trainers:
-                loss = agent.update(trainers, train_step) # this is where the update of agents' parameters is
+            with profiling.phase("update"):
+                if learner is not None:
+                    learner.refresh()
+                else:
+                    loss = update_trainers(trainers, fused_update, train_step)
 
             # save model, display training output
             if terminal and (len(episode_rewards) % arglist.save_rate == 0):
-                U.save_state(arglist.save_dir, saver=saver)
-                # print statement depends on whether or not there are adversaries
-                if num_adversaries == 0:
-                    print("steps: {}, episodes: {}, mean episode reward: {}, time: {}".format(
-                        train_step, len(episode_rewards), np.mean(episode_rewards[-arglist.save_rate:]), round(time.time()-t_start, 3)))
-                else:
-                    print("steps: {}, episodes: {}, mean episode reward: {}, agent episode reward: {}, time: {}".format(
-                        train_step, len(episode_rewards), np.mean(episode_rewards[-arglist.save_rate:]),
-                        [np.mean(rew[-arglist.save_rate:]) for rew in agent_rewards], round(time.time()-t_start, 3)))
+                # Keep track of final episode reward
+                final_ep_rewards.append(np.mean(episode_rewards[-arglist.save_rate:]))
+                for rew in agent_rewards:
+                    final_ep_ag_rewards.append(np.mean(rew[-arglist.save_rate:]))
+                with profiling.phase("save"):
+                    save_state(arglist, saver, learner, checkpointer, train_step,
+                               checkpoint_curves(arglist, checkpointer, final_ep_rewards, final_ep_ag_rewards))
+                report(arglist, train_step, episode_rewards, agent_rewards, num_adversaries, t_start, learner, profiler)
                 t_start = time.time()
+
+            # saves final episode reward for plotting training curve later
+            if len(episode_rewards) > arglist.num_episodes:
+                save_curves(arglist, final_ep_rewards, final_ep_ag_rewards)
+                print('...Finished total of {} episodes.'.format(len(episode_rewards)))
+                break
+        if learner is not None:
+            learner.stop()
+        if checkpointer is not None:
+            checkpointer.close()
+        if profiler is not None:
+            profiler.stop()
+
+def train_batch(arglist):
+    # same as train(), but every iteration steps a batch of environments at once: either
+    # arglist.num_envs environments in this process, or one environment per worker process
+    assert not (arglist.display or arglist.benchmark), "batched environments are only used for training"
+    # Create batch of environments (workers are started before the session exists)
+    if arglist.num_workers > 0:
+        env = make_subproc_env(arglist.scenario, arglist)
+    else:
+        env = make_batch_env(arglist.scenario, arglist)
+    with make_session(arglist):
+        # Create agent trainers
+        obs_shape_n = [env.observation_space[i].shape for i in range(env.n)]
+        num_adversaries = min(env.n, arglist.num_adversaries)
+        trainers = get_trainers(env, num_adversaries, obs_shape_n, arglist)
+        fused_update = get_fused_update(trainers, obs_shape_n, env, arglist)
+        group_policy = get_group_policy(trainers, obs_shape_n, env, arglist)
+        learner = get_learner(trainers, fused_update, arglist)
+        profiler = get_profiler(arglist)
+        checkpointer = get_checkpointer(arglist)
+        print('Using good policy {} and adv policy {}'.format(arglist.good_policy, arglist.adv_policy))
+
+        # Initialize
+        U.initialize()
+
+        # Load previous results, if necessary
+        if arglist.load_dir == "":
+            arglist.load_dir = arglist.save_dir
+        if arglist.restore:
+            print('Loading previous state...')
+            load_state(arglist)
+        if learner is not None:
+            learner.start()
+
+        episode_rewards = []  # sum of rewards for all agents, per finished episode
+        agent_rewards = [[] for _ in range(env.n)]  # individual agent reward, per finished episode
+        final_ep_rewards = []  # sum of rewards for training curve
+        final_ep_ag_rewards = []  # agent rewards for training curve
+        running_rewards = np.zeros((env.num_envs, env.n))  # rewards of the episodes in progress
+        saver = tf.train.Saver()
+        obs_n = env.reset()
+        sample_opponents(trainers, env.num_envs)
+        train_step = 0
+        t_start = time.time()
+
+        print('Starting iterations...')
+        if profiler is not None:
+            profiler.start()
+        while True:
+            if profiler is not None:
+                profiler.step(train_step, env.num_envs)
+            # get actions for the whole batch, one call per agent
+            with profiling.phase("act"):
+                if group_policy is not None:
+                    action_n = group_policy.act(obs_n)
+                else:
+                    action_n = [agent.act(obs) for agent, obs in zip(trainers, obs_n)]
+            # environment step (finished episodes are reset in place)
+            with profiling.phase("env"):
+                new_obs_n, rew_n, done_n, info_n = env.step(action_n)
+            terminal = info_n['terminal']
+            next_obs_n = info_n['terminal_obs_n']
+            # collect experience
+            with profiling.phase("store"):
+                if learner is not None:
+                    with learner.collecting(env.num_envs):
+                        store_experience_batch(trainers, obs_n, action_n, rew_n, next_obs_n, done_n, terminal)
+                else:
+                    store_experience_batch(trainers, obs_n, action_n, rew_n, next_obs_n, done_n, terminal)
+            obs_n = new_obs_n
+            sample_opponents(trainers, env.num_envs, terminal)
+
+            num_episodes = len(episode_rewards)
+            running_rewards += rew_n
+            for b in np.flatnonzero(terminal):
+                episode_rewards.append(np.sum(running_rewards[b]))
+                for i, rew in enumerate(running_rewards[b]):
+                    agent_rewards[i].append(rew)
+                running_rewards[b] = 0.0
+
+            # update all trainers at every multiple of 100 environment steps crossed, as train() does
+            with profiling.phase("update"):
+                if learner is not None:
+                    learner.refresh()
+                else:
+                    for t in range((train_step // 100 + 1) * 100, train_step + env.num_envs + 1, 100):
+                        update_trainers(trainers, fused_update, t)
+            train_step += env.num_envs
+
+            # save model, display training output
+            if len(episode_rewards) // arglist.save_rate > num_episodes // arglist.save_rate:
                 # Keep track of final episode reward
                 final_ep_rewards.append(np.mean(episode_rewards[-arglist.save_rate:]))
                 for rew in agent_rewards:
                     final_ep_ag_rewards.append(np.mean(rew[-arglist.save_rate:]))
+                with profiling.phase("save"):
+                    save_state(arglist, saver, learner, checkpointer, train_step,
+                               checkpoint_curves(arglist, checkpointer, final_ep_rewards, final_ep_ag_rewards))
+                report(arglist, train_step, episode_rewards, agent_rewards, num_adversaries, t_start, learner, profiler)
+                t_start = time.time()
 
             # saves final episode reward for plotting training curve later
             if len(episode_rewards) > arglist.num_episodes:
-                rew_file_name = arglist.plots_dir + arglist.exp_name + '_rewards.pkl'
-                with open(rew_file_name, 'wb') as fp:
-                    pickle.dump(final_ep_rewards, fp)
-                agrew_file_name = arglist.plots_dir + arglist.exp_name + '_agrewards.pkl'
-                with open(agrew_file_name, 'wb') as fp:
-                    pickle.dump(final_ep_ag_rewards, fp)
+                save_curves(arglist, final_ep_rewards, final_ep_ag_rewards)
                 print('...Finished total of {} episodes.'.format(len(episode_rewards)))
                 break
+        if learner is not None:
+            learner.stop()
+        if checkpointer is not None:
+            checkpointer.close()
+        if profiler is not None:
+            profiler.stop()
+    if arglist.num_workers > 0:
+        env.close()
 
 if __name__ == '__main__':
     arglist = parse_args()
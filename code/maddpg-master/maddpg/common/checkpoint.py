@@ -0,0 +1,175 @@
+import glob
+import os
+import pickle
+import queue
+import re
+import threading
+import time
+
+import numpy as np
+import tensorflow as tf
+
+import maddpg.common.tf_util as U
+
+
+def _prefix(fname):
+    # fname is used like the path given to U.save_state: a directory ("/tmp/policy/") or a file prefix
+    return os.path.dirname(fname), os.path.basename(fname) or "model"
+
+
+def list_checkpoints(fname):
+    """Paths of the checkpoints written for `fname`, oldest first.
+
+    Checkpoints are ordered by the time they were written rather than by the
+    step in their name: a run restarted from a checkpoint counts its steps
+    from 0 again, so its newest checkpoints can have lower steps than those
+    of the earlier run.
+    """
+    directory, prefix = _prefix(fname)
+    pattern = re.compile(re.escape(prefix) + r"-(\d+)\.npz$")
+    found = []
+    for path in glob.glob(os.path.join(glob.escape(directory), prefix + "-*.npz")):
+        match = pattern.match(os.path.basename(path))
+        if match:
+            found.append((os.stat(path).st_mtime_ns, int(match.group(1)), path))
+    return [path for _, _, path in sorted(found)]
+
+
+def latest_checkpoint(fname):
+    """Path of the last complete checkpoint written for `fname`, or None."""
+    directory, prefix = _prefix(fname)
+    try:
+        with open(os.path.join(directory, prefix + "-latest")) as fp:
+            path = os.path.join(directory, fp.read().strip())
+    except FileNotFoundError:
+        return None
+    return path if os.path.exists(path) else None
+
+
+def restore(path, var_list=None):
+    """Loads the checkpoint at `path` into the variables (default: all global
+    variables) with a single session run. The whole file is read and checked
+    against the variables before anything is assigned."""
+    var_list = tf.global_variables() if var_list is None else var_list
+    with np.load(path) as data:
+        values = {name: data[name] for name in data.files}
+    missing = [var.name for var in var_list if var.name not in values]
+    if missing:
+        raise ValueError("checkpoint {} lacks the variables {}".format(path, missing))
+    for var in var_list:
+        if tuple(values[var.name].shape) != tuple(var.shape.as_list()):
+            raise ValueError("checkpoint {} has shape {} for {}, expected {}".format(
+                path, values[var.name].shape, var.name, var.shape.as_list()))
+    placeholders = [tf.placeholder(var.dtype.base_dtype, var.shape) for var in var_list]
+    assign = tf.group(*[var.assign(ph) for var, ph in zip(var_list, placeholders)])
+    U.get_session().run(assign, feed_dict={ph: values[var.name] for ph, var in zip(placeholders, var_list)})
+
+
+def atomic_write(path, write):
+    """Calls write(fp) on a temporary file that replaces `path` once complete,
+    so that readers (and a crash) never see a partially written file."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as fp:
+        write(fp)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_path, path)
+
+
+def write_pickle(path, obj):
+    atomic_write(path, lambda fp: pickle.dump(obj, fp))
+
+
+class AsyncCheckpointer(object):
+    def __init__(self, fname, var_list=None, max_to_keep=5):
+        """Checkpoints the variables without stalling the training loop.
+
+        `save` reads all variable values with a single session run and hands
+        them to a writer thread, which saves them as one .npz file per
+        checkpoint (written to a temporary file and renamed once complete),
+        then points `<prefix>-latest` to it and deletes the oldest checkpoints
+        beyond `max_to_keep`. A checkpoint that is being written when the
+        process dies is therefore never the one restored (see `restore` and
+        `latest_checkpoint`).
+
+        Parameters
+        ----------
+        fname: str
+            directory or file prefix, as given to U.save_state
+        var_list: [tf.Variable]
+            variables to checkpoint (default: all global variables, as tf.train.Saver)
+        max_to_keep: int
+            number of most recent checkpoints kept on disk
+        """
+        self.fname = fname
+        self.directory, self.prefix = _prefix(fname)
+        self.var_list = list(tf.global_variables() if var_list is None else var_list)
+        self.max_to_keep = max_to_keep
+        # at most one snapshot waits for the writer, so a slow disk bounds the memory used
+        self._queue = queue.Queue(maxsize=1)
+        self._checkpoints = list_checkpoints(fname)
+        self._error = None
+        self.num_saved = 0
+        self.write_time = 0.0
+        self._writer = threading.Thread(target=self._run, name="checkpoint-writer")
+        # if the main thread crashes, we should not cause things to hang
+        self._writer.daemon = True
+        self._writer.start()
+
+    def save(self, step, files=None):
+        """Snapshots the variables and queues the checkpoint of training step `step`.
+
+        `files` maps further paths to picklable objects (e.g. the learning
+        curves) that are written atomically together with the checkpoint; the
+        objects must not be modified afterwards.
+        """
+        self._check()
+        values = U.get_session().run(self.var_list)
+        self._queue.put((step, values, files or {}))
+
+    def wait(self):
+        """Blocks until all queued checkpoints are written."""
+        self._queue.join()
+        self._check()
+
+    def close(self):
+        self._queue.put(None)
+        self._writer.join()
+        self._check()
+
+    def _check(self):
+        if self._error is not None:
+            raise RuntimeError("checkpoint writer failed") from self._error
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                if self._error is None:
+                    self._write(*item)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _write(self, step, values, files):
+        t_start = time.time()
+        path = os.path.join(self.directory, "{}-{}.npz".format(self.prefix, step))
+        arrays = {var.name: value for var, value in zip(self.var_list, values)}
+        atomic_write(path, lambda fp: np.savez(fp, **arrays))
+        for file_path, obj in files.items():
+            write_pickle(file_path, obj)
+        atomic_write(os.path.join(self.directory, self.prefix + "-latest"),
+                     lambda fp: fp.write(os.path.basename(path).encode()))
+        if path in self._checkpoints:
+            self._checkpoints.remove(path)
+        self._checkpoints.append(path)
+        while len(self._checkpoints) > self.max_to_keep:
+            os.remove(self._checkpoints.pop(0))
+        self.num_saved += 1
+        self.write_time += time.time() - t_start
@@ -0,0 +1,270 @@
+import collections
+import os
+import sys
+import threading
+import time
+
+
+class PhaseTimers(object):
+    def __init__(self):
+        """Cumulative wall-clock time and number of calls per named phase.
+
+        Phases are timed with `phase(name)` (a context manager) or recorded
+        with `add`; `summary` formats the totals since the previous summary,
+        sorted by time. Timings of all threads are summed, so with a learner
+        thread the phases can add up to more than the elapsed time. Timers can
+        be shared between threads: `add`, `reset` and `stats` hold a lock.
+        """
+        self.totals = collections.defaultdict(float)
+        self.counts = collections.defaultdict(int)
+        self._lock = threading.Lock()
+        self._t_start = time.perf_counter()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.totals[name] += seconds
+            self.counts[name] += 1
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def reset(self):
+        with self._lock:
+            self._reset()
+
+    def _reset(self):
+        self.totals.clear()
+        self.counts.clear()
+        self._t_start = time.perf_counter()
+
+    def stats(self, reset=True):
+        """Seconds and calls of every phase, and the elapsed time ('elapsed')."""
+        with self._lock:
+            stats = {name: (self.totals[name], self.counts[name]) for name in self.totals}
+            stats['elapsed'] = (time.perf_counter() - self._t_start, 1)
+            if reset:
+                self._reset()
+        return stats
+
+    def summary(self, reset=True, limit=None):
+        stats = self.stats(reset)
+        elapsed = max(stats.pop('elapsed')[0], 1e-9)
+        phases = sorted(stats.items(), key=lambda item: -item[1][0])[:limit]
+        return ", ".join("{}: {:.2f}s ({:.0%}, {} calls)".format(name, seconds, seconds / elapsed, count)
+                         for name, (seconds, count) in phases)
+
+
+class _Phase(object):
+    __slots__ = ('timers', 'name', 't_start')
+
+    def __init__(self, timers, name):
+        self.timers = timers
+        self.name = name
+
+    def __enter__(self):
+        self.t_start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.timers.add(self.name, time.perf_counter() - self.t_start)
+
+
+class _NoPhase(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_PHASE = _NoPhase()
+_phase_timers = None
+_function_timers = None
+_trace = None
+
+
+def set_phase_timers(timers):
+    """Timers of the `phase` calls made inside the trainers (None: disabled)."""
+    global _phase_timers
+    _phase_timers = timers
+
+
+def phase(name):
+    timers = _phase_timers
+    return _NO_PHASE if timers is None else timers.phase(name)
+
+
+def set_function_timers(timers):
+    """Timers of every U.function call, split into feed dict construction
+    ('<name>/feed') and session run ('<name>/run'); None disables them."""
+    global _function_timers
+    _function_timers = timers
+
+
+def get_function_timers():
+    return _function_timers
+
+
+class Trace(object):
+    def __init__(self, directory, prefix):
+        """Writes a Chrome trace (chrome://tracing) of every U.function call
+        made while it is active (see `trace`), by any thread: the file names
+        hold a run number shared by all threads and the name of the thread."""
+        self.directory = directory
+        self.prefix = prefix
+        self.num_runs = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, name, run_metadata):
+        from tensorflow.python.client import timeline
+        with self._lock:
+            run = self.num_runs
+            self.num_runs += 1
+        path = os.path.join(self.directory, "{}_{:03d}_{}_{}.json".format(
+            self.prefix, run, threading.current_thread().name, name))
+        with open(path, 'w') as fp:
+            fp.write(timeline.Timeline(run_metadata.step_stats).generate_chrome_trace_format())
+
+
+def get_trace():
+    return _trace
+
+
+class trace(object):
+    def __init__(self, directory, prefix="timeline"):
+        """Context in which every U.function call is run with full tracing and
+        its RunMetadata timeline written to `directory`."""
+        self.trace = Trace(directory, prefix)
+
+    def __enter__(self):
+        global _trace
+        _trace = self.trace
+        return self.trace
+
+    def __exit__(self, *exc):
+        global _trace
+        _trace = None
+
+
+class StackSampler(object):
+    def __init__(self, interval=0.005, thread=None):
+        """Samples the Python stack of `thread` (default: the calling thread)
+        every `interval` seconds from a background thread.
+
+        `write` saves the samples in the folded format of flame graph tools:
+        one line per distinct stack, 'outer;...;inner count'.
+        """
+        self.interval = interval
+        self.thread_id = (thread or threading.current_thread()).ident
+        self.samples = collections.Counter()
+        self._stopped = threading.Event()
+        self._sampler = None
+
+    def start(self):
+        self._stopped.clear()
+        self._sampler = threading.Thread(target=self._run, name="stack-sampler")
+        self._sampler.daemon = True
+        self._sampler.start()
+
+    def stop(self):
+        if self._sampler is not None:
+            self._stopped.set()
+            self._sampler.join()
+            self._sampler = None
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("{}:{}:{}".format(os.path.basename(code.co_filename), code.co_name, frame.f_lineno))
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def write(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as fp:
+            for stack, count in self.samples.most_common():
+                fp.write("{} {}\n".format(stack, count))
+
+
+class Profiler(object):
+    def __init__(self, directory, function_timers=True, trace_step=None, stack_sample_steps=None, stack_sample_interval=0.005):
+        """Profiling hooks of the training loop in experiments/train.py.
+
+        Parameters
+        ----------
+        directory: str
+            where the timelines and stack samples are written
+        function_timers: bool
+            time every U.function call next to the phases of the loop
+        trace_step: int or None
+            training step whose loop iteration is traced: every session run
+            of that iteration (and of the learner thread meanwhile) writes a
+            Chrome timeline of its RunMetadata
+        stack_sample_steps: (int, int) or None
+            window [start, end) of training steps in which the Python stack of
+            the training loop is sampled
+        stack_sample_interval: float
+            seconds between two stack samples
+        """
+        self.directory = directory
+        self.phase_timers = PhaseTimers()
+        self.function_timers = PhaseTimers() if function_timers else None
+        self.trace_step = trace_step
+        self.stack_sample_steps = stack_sample_steps
+        self.stack_sample_interval = stack_sample_interval
+        self._tracing = None
+        self._sampler = None
+
+    def start(self):
+        set_phase_timers(self.phase_timers)
+        set_function_timers(self.function_timers)
+
+    def step(self, train_step, num_steps=1):
+        """Called at the start of every loop iteration, which covers the
+        training steps train_step + 1, ..., train_step + num_steps (an update
+        of step t runs in the iteration that reaches t)."""
+        self._stop_trace()
+        if self.trace_step is not None and train_step < self.trace_step <= train_step + num_steps:
+            self._tracing = trace(self.directory, "timeline_step{}".format(self.trace_step))
+            self._tracing.__enter__()
+        if self.stack_sample_steps is not None:
+            start, end = self.stack_sample_steps
+            if self._sampler is None and start <= train_step < end:
+                self._sampler = StackSampler(self.stack_sample_interval)
+                self._sampler.start()
+            elif self._sampler is not None and train_step >= end:
+                self._stop_sampler()
+
+    def summary(self):
+        """Phase and session run timings since the previous summary."""
+        lines = ["phases: " + self.phase_timers.summary()]
+        if self.function_timers is not None:
+            lines.append("session runs: " + self.function_timers.summary(limit=8))
+        return "\n".join(lines)
+
+    def stop(self):
+        self._stop_trace()
+        self._stop_sampler()
+        set_phase_timers(None)
+        set_function_timers(None)
+
+    def _stop_trace(self):
+        if self._tracing is not None:
+            self._tracing.__exit__(None, None, None)
+            self._tracing = None
+
+    def _stop_sampler(self):
+        if self._sampler is None:
+            return
+        self._sampler.stop()
+        start, end = self.stack_sample_steps
+        self._sampler.write(os.path.join(self.directory, "stacks_{}_{}.folded".format(start, end)))
+        self._sampler = None
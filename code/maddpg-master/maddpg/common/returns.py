@@ -0,0 +1,84 @@
+import numpy as np
+
+# Returns over (T,) or (B, T) arrays, time along the last axis.
+# Same functions and signatures as rl_coach/returns.py in the coach package.
+
+
+def discounted_returns(rewards, discount, dones=None, bootstrap=0.0):
+    """Returns G with G[t] = rewards[t] + discount * (1 - dones[t]) * G[t + 1].
+
+    The recursion is an associative scan: after the pass with shift s, returns[t]
+    sums the 2s rewards from step t on and decay[t] is the discount of the return
+    that follows them, so log2(T) vectorized passes replace the loop over steps.
+
+    Parameters
+    ----------
+    rewards: np.array
+        (T,) or (B, T) rewards
+    discount: float
+        discount factor
+    dones: np.array or None
+        same shape as rewards; a done at step t ends the return at step t
+    bootstrap: float or np.array
+        return following the last step (scalar or (B,)), e.g. a value estimate
+    """
+    returns = np.array(rewards, dtype=np.float64)
+    if dones is None:
+        decay = np.full(returns.shape, float(discount))
+    else:
+        decay = discount * (1.0 - np.asarray(dones, dtype=np.float64))
+    T = returns.shape[-1]
+    shift = 1
+    while shift < T:
+        returns[..., :-shift] += decay[..., :-shift] * returns[..., shift:]
+        decay[..., :-shift] *= decay[..., shift:]
+        shift *= 2
+    return returns + decay * np.asarray(bootstrap, dtype=np.float64)[..., None]
+
+
+def n_step_returns(rewards, discount, n_step, bootstrap_values=None):
+    """Returns R with R[t] = sum_{k < n_step} discount^k rewards[t + k] + discount^n_step bootstrap_values[t],
+    truncated at the end of the sequence.
+
+    Parameters
+    ----------
+    rewards: np.array
+        (T,) or (B, T) rewards of one episode (or of B episodes of equal length)
+    discount: float
+        discount factor
+    n_step: int
+        number of rewards summed; -1 (or n_step >= T) sums all the remaining rewards
+    bootstrap_values: np.array or None
+        (T - n_step,) or (B, T - n_step) values of the states n_step steps ahead
+        of the first T - n_step steps (values[..., n_step:] of per-step values);
+        the last n_step returns
+        reach the end of the sequence and are not bootstrapped
+    """
+    if n_step == 0 or n_step < -1:
+        raise ValueError("n_step must be positive or -1, got {}".format(n_step))
+    rewards = np.asarray(rewards, dtype=np.float64)
+    T = rewards.shape[-1]
+    if n_step == -1 or n_step >= T:
+        return discounted_returns(rewards, discount)
+    padded = np.concatenate([rewards, np.zeros(rewards.shape[:-1] + (n_step - 1,))], axis=-1)
+    windows = np.lib.stride_tricks.as_strided(padded, shape=rewards.shape + (n_step,),
+                                              strides=padded.strides + padded.strides[-1:], writeable=False)
+    returns = windows @ (discount ** np.arange(n_step))
+    if bootstrap_values is not None:
+        returns[..., :T - n_step] += discount ** n_step * np.asarray(bootstrap_values, dtype=np.float64)
+    return returns
+
+
+def generalized_advantage_estimation(rewards, values, discount, gae_lambda, dones=None):
+    """Generalized advantage estimates of (T,) or (B, T) rewards.
+
+    `values` holds one more step than `rewards`: the value of every state and
+    of the state following the last step. A done at step t cuts both the
+    bootstrap from values[t + 1] and the accumulation of later advantages.
+    Value targets are the advantages plus values[..., :-1].
+    """
+    rewards = np.asarray(rewards, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    not_done = 1.0 if dones is None else 1.0 - np.asarray(dones, dtype=np.float64)
+    deltas = rewards + discount * not_done * values[..., 1:] - values[..., :-1]
+    return discounted_returns(deltas, discount * gae_lambda, dones)
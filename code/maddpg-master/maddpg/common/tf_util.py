@@ -1,8 +1,11 @@
 import collections
 import numpy as np
 import os
+import time
 import tensorflow as tf
 
+from maddpg.common import profiling
+
 def sum(x, axis=None, keepdims=False):
     return tf.reduce_sum(x, axis=None if axis is None else [axis], keep_dims = keepdims)
 def mean(x, axis=None, keepdims=False):
@@ -244,7 +247,7 @@ def save_state(fname, saver=None):
 # ================================================================
 
 
-def function(inputs, outputs, updates=None, givens=None):
+def function(inputs, outputs, updates=None, givens=None, name="function"):
     """Just like Theano function. Take a bunch of tensorflow placeholders and expersions
     computed based on those placeholders and produces f(inputs) -> outputs. Function f takes
     values to be feed to the inputs placeholders and produces the values of the experessions
@@ -274,19 +277,22 @@ def function(inputs, outputs, updates=None, givens=None):
     outputs: [tf.Variable] or tf.Variable
         list of outputs or a single output to be returned from function. Returned
         value will also have the same shape.
+    name: str
+        label of the function in profiling timers and traces (see
+        maddpg.common.profiling)
     """
     if isinstance(outputs, list):
-        return _Function(inputs, outputs, updates, givens=givens)
+        return _Function(inputs, outputs, updates, givens=givens, name=name)
     elif isinstance(outputs, (dict, collections.OrderedDict)):
-        f = _Function(inputs, outputs.values(), updates, givens=givens)
+        f = _Function(inputs, outputs.values(), updates, givens=givens, name=name)
         return lambda *args, **kwargs: type(outputs)(zip(outputs.keys(), f(*args, **kwargs)))
     else:
-        f = _Function(inputs, [outputs], updates, givens=givens)
+        f = _Function(inputs, [outputs], updates, givens=givens, name=name)
         return lambda *args, **kwargs: f(*args, **kwargs)[0]
 
 
 class _Function(object):
-    def __init__(self, inputs, outputs, updates, givens, check_nan=False):
+    def __init__(self, inputs, outputs, updates, givens, check_nan=False, name="function"):
         for inpt in inputs:
             if not issubclass(type(inpt), TfInput):
                 assert len(inpt.op.inputs) == 0, "inputs should all be placeholders of rl_algs.common.TfInput"
@@ -296,6 +302,7 @@ class _Function(object):
         self.outputs_update = list(outputs) + [self.update_group]
         self.givens = {} if givens is None else givens
         self.check_nan = check_nan
+        self.name = name
 
     def _feed_input(self, feed_dict, inpt, value):
         if issubclass(type(inpt), TfInput):
@@ -304,6 +311,9 @@ class _Function(object):
             feed_dict[inpt] = value
 
     def __call__(self, *args, **kwargs):
+        timers = profiling.get_function_timers()
+        if timers is not None:
+            t_start = time.perf_counter()
         assert len(args) <= len(self.inputs), "Too many arguments provided"
         feed_dict = {}
         # Update the args
@@ -325,7 +335,20 @@ class _Function(object):
         # Update feed dict with givens.
         for inpt in self.givens:
             feed_dict[inpt] = feed_dict.get(inpt, self.givens[inpt])
-        results = get_session().run(self.outputs_update, feed_dict=feed_dict)[:-1]
+        if timers is not None:
+            t_feed = time.perf_counter()
+        trace = profiling.get_trace()
+        if trace is not None:
+            run_metadata = tf.RunMetadata()
+            results = get_session().run(self.outputs_update, feed_dict=feed_dict, run_metadata=run_metadata,
+                                        options=tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE))[:-1]
+            trace.write(self.name, run_metadata)
+        else:
+            results = get_session().run(self.outputs_update, feed_dict=feed_dict)[:-1]
+        if timers is not None:
+            t_run = time.perf_counter()
+            timers.add(self.name + "/feed", t_feed - t_start)
+            timers.add(self.name + "/run", t_run - t_feed)
         if self.check_nan:
             if any(np.isnan(r).any() for r in results):
                 raise RuntimeError("Nan detected")
@@ -0,0 +1,194 @@
+import multiprocessing as mp
+import numpy as np
+
+from multiagent.multi_discrete import MultiDiscrete
+
+
+def flat_action_dim(ac_space):
+    """Size of the flat action vector the trainers produce for `ac_space` (see make_pdtype)."""
+    from gym import spaces
+    if isinstance(ac_space, spaces.Box):
+        assert len(ac_space.shape) == 1
+        return ac_space.shape[0]
+    elif isinstance(ac_space, spaces.Discrete):
+        return ac_space.n
+    elif isinstance(ac_space, MultiDiscrete):
+        return int(np.sum(ac_space.high - ac_space.low + 1))
+    elif isinstance(ac_space, spaces.MultiBinary):
+        return ac_space.n
+    else:
+        raise NotImplementedError
+
+
+class SharedBuffers(object):
+    def __init__(self, num_envs, obs_dims, act_dims):
+        """Observation, action, reward and done arrays shared between the learner and the workers.
+
+        Every array has the environment index as leading axis, so worker k only
+        ever touches row k.
+
+        Parameters
+        ----------
+        num_envs: int
+            number of environments (K)
+        obs_dims: [int]
+            observation size of every agent
+        act_dims: [int]
+            flat action size of every agent
+        """
+        self.num_envs = num_envs
+        self.obs_dims = list(obs_dims)
+        self.act_dims = list(act_dims)
+        n = len(self.obs_dims)
+        self._raw = {
+            'obs': [mp.RawArray('d', num_envs * d) for d in self.obs_dims],
+            'terminal_obs': [mp.RawArray('d', num_envs * d) for d in self.obs_dims],
+            'act': [mp.RawArray('d', num_envs * d) for d in self.act_dims],
+            'rew': mp.RawArray('d', num_envs * n),
+            'done': mp.RawArray('b', num_envs * n),
+            'terminal': mp.RawArray('b', num_envs),
+        }
+        self._attach()
+
+    def _attach(self):
+        # numpy views on the shared memory (recreated in every process)
+        k = self.num_envs
+        n = len(self.obs_dims)
+        self.obs_n = [np.frombuffer(raw, dtype=np.float64).reshape(k, d)
+                      for raw, d in zip(self._raw['obs'], self.obs_dims)]
+        self.terminal_obs_n = [np.frombuffer(raw, dtype=np.float64).reshape(k, d)
+                               for raw, d in zip(self._raw['terminal_obs'], self.obs_dims)]
+        self.act_n = [np.frombuffer(raw, dtype=np.float64).reshape(k, d)
+                      for raw, d in zip(self._raw['act'], self.act_dims)]
+        self.rew = np.frombuffer(self._raw['rew'], dtype=np.float64).reshape(k, n)
+        self.done = np.frombuffer(self._raw['done'], dtype=np.int8).reshape(k, n)
+        self.terminal = np.frombuffer(self._raw['terminal'], dtype=np.int8)
+
+    def __getstate__(self):
+        return {'num_envs': self.num_envs, 'obs_dims': self.obs_dims, 'act_dims': self.act_dims, '_raw': self._raw}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._attach()
+
+
+def _worker(remote, parent_remote, env_fn, buffers, index, max_episode_len):
+    parent_remote.close()
+    # forked workers inherit the global random state of the parent; draw a fresh one
+    np.random.seed()
+    env = env_fn()
+    episode_step = 0
+
+    def write_obs(obs_n, target_n):
+        for target, obs in zip(target_n, obs_n):
+            target[index] = obs
+
+    try:
+        while True:
+            cmd = remote.recv()
+            if cmd == 'step':
+                # copy: the environment may modify actions in place
+                action_n = [act[index].copy() for act in buffers.act_n]
+                obs_n, rew_n, done_n, info_n = env.step(action_n)
+                episode_step += 1
+                terminal = all(done_n) or (max_episode_len is not None and episode_step >= max_episode_len)
+                buffers.rew[index] = rew_n
+                buffers.done[index] = done_n
+                buffers.terminal[index] = terminal
+                write_obs(obs_n, buffers.terminal_obs_n)
+                if terminal:
+                    obs_n = env.reset()
+                    episode_step = 0
+                write_obs(obs_n, buffers.obs_n)
+                remote.send(info_n['n'])
+            elif cmd == 'reset':
+                episode_step = 0
+                write_obs(env.reset(), buffers.obs_n)
+                remote.send(None)
+            elif cmd == 'close':
+                break
+            else:
+                raise NotImplementedError(cmd)
+    except KeyboardInterrupt:
+        print('SubprocBatchMultiAgentEnv worker: got KeyboardInterrupt')
+    finally:
+        remote.close()
+
+
+class SubprocBatchMultiAgentEnv(object):
+    def __init__(self, env_fns, max_episode_len=None):
+        """Runs one MultiAgentEnv per worker process.
+
+        Actions, observations, rewards and dones are exchanged through shared
+        memory; the pipes to the workers only carry commands and the (small)
+        info dicts. The interface matches BatchMultiAgentEnv: actions and
+        observations are one (K, dim) array per agent, rewards and dones are
+        (K, n) arrays, and finished episodes are reset inside the workers.
+
+        Parameters
+        ----------
+        env_fns: [callable]
+            functions creating the environment of each worker
+        max_episode_len: int
+            episodes are finished (and reset) after this many steps
+        """
+        self.num_envs = len(env_fns)
+        self.max_episode_len = max_episode_len
+        # probe environment for the spaces
+        env = env_fns[0]()
+        self.n = env.n
+        self.action_space = env.action_space
+        self.observation_space = env.observation_space
+        del env
+        self.buffers = SharedBuffers(self.num_envs, [space.shape[0] for space in self.observation_space],
+                                     [flat_action_dim(space) for space in self.action_space])
+        self.remotes, work_remotes = zip(*[mp.Pipe() for _ in range(self.num_envs)])
+        self.processes = [mp.Process(target=_worker,
+                                     args=(work_remote, remote, env_fn, self.buffers, index, max_episode_len))
+                          for index, (work_remote, remote, env_fn) in enumerate(zip(work_remotes, self.remotes, env_fns))]
+        for p in self.processes:
+            # if the main process crashes, we should not cause things to hang
+            p.daemon = True
+            p.start()
+        for remote in work_remotes:
+            remote.close()
+        self.waiting = False
+        self.closed = False
+
+    def step_async(self, action_n):
+        for act, action in zip(self.buffers.act_n, action_n):
+            act[...] = action
+        for remote in self.remotes:
+            remote.send('step')
+        self.waiting = True
+
+    def step_wait(self):
+        info_n = {'n': [remote.recv() for remote in self.remotes]}
+        self.waiting = False
+        buffers = self.buffers
+        info_n['terminal'] = buffers.terminal.astype(bool)
+        info_n['terminal_obs_n'] = [obs.copy() for obs in buffers.terminal_obs_n]
+        return [obs.copy() for obs in buffers.obs_n], buffers.rew.copy(), buffers.done.astype(bool), info_n
+
+    def step(self, action_n):
+        self.step_async(action_n)
+        return self.step_wait()
+
+    def reset(self):
+        for remote in self.remotes:
+            remote.send('reset')
+        for remote in self.remotes:
+            remote.recv()
+        return [obs.copy() for obs in self.buffers.obs_n]
+
+    def close(self):
+        if self.closed:
+            return
+        if self.waiting:
+            for remote in self.remotes:
+                remote.recv()
+        for remote in self.remotes:
+            remote.send('close')
+        for p in self.processes:
+            p.join()
+        self.closed = True
@@ -0,0 +1,180 @@
+import contextlib
+import threading
+import time
+
+import maddpg.common.tf_util as U
+
+
+class AsyncLearner(object):
+    def __init__(self, sample, update, ready, snapshot, update_ratio=1.0, snapshot_rate=1):
+        """Runs the update rounds of the trainers in a background thread.
+
+        The acting thread keeps stepping the environments with a policy
+        snapshot, stores its transitions inside `collecting` and loads fresh
+        snapshots with `refresh`; the learner thread draws batches (holding the
+        same lock, so it never sees half-stored transitions) and trains on them
+        without the lock, while TensorFlow has released the GIL.
+
+        Parameters
+        ----------
+        sample: callable
+            draws the batches of one update round from the replay buffers
+        update: callable
+            trains on the batches returned by `sample`
+        ready: callable
+            True once the replay buffers are large enough for training
+        snapshot: PolicySnapshot
+            policy snapshot the acting thread selects actions with
+        update_ratio: float
+            update rounds per 100 collected environment steps (the synchronous
+            loop of train.py does 1); <= 0 lets the learner run freely
+        snapshot_rate: int
+            update rounds between two refreshes of the policy snapshot
+        """
+        self._sample = sample
+        self._update = update
+        self._ready = ready
+        self.snapshot = snapshot
+        self.update_ratio = update_ratio
+        self.snapshot_rate = max(int(snapshot_rate), 1)
+        self.lock = threading.Lock()
+        self._cond = threading.Condition(self.lock)
+        self._round_lock = threading.Lock()
+        self._thread = None
+        self._stopped = False
+        self._error = None
+        self._pending_snapshot = None
+        self._ready_steps = None
+        self.num_steps = 0
+        self.num_rounds = 0
+        self.loss = None
+        # cumulative timings, see stats()
+        self._update_time = 0.0
+        self._idle_time = 0.0
+        # start of the learner's current wait for data (None while it updates)
+        self._wait_start = None
+        self._wait_time = 0.0
+        self._snapshot_loads = 0
+        self._window = None
+
+    def start(self):
+        """Loads the current policies into the snapshot and starts the learner thread."""
+        self.snapshot.load(self.snapshot.fetch())
+        self._window = self._counters()
+        self._thread = threading.Thread(target=self._run, args=(U.get_session(),), name="maddpg-learner")
+        # if the main thread crashes, we should not cause things to hang
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join()
+        self._thread = None
+
+    @contextlib.contextmanager
+    def collecting(self, num_steps):
+        """Context for storing `num_steps` environment steps in the replay buffers."""
+        self._check()
+        t_start = time.time()
+        with self._cond:
+            self._wait_time += time.time() - t_start
+            yield
+            self.num_steps += num_steps
+            self._cond.notify()
+
+    @contextlib.contextmanager
+    def paused(self):
+        """Context in which no update round runs (e.g. to save a consistent checkpoint)."""
+        with self._round_lock:
+            yield
+
+    def refresh(self):
+        """Loads the latest policy snapshot of the learner, if there is a new one."""
+        self._check()
+        with self.lock:
+            values, self._pending_snapshot = self._pending_snapshot, None
+        if values is not None:
+            self.snapshot.load(values)
+            self._snapshot_loads += 1
+
+    def stats(self):
+        """Throughput of both threads since the previous call.
+
+        Returns
+        -------
+        stats: dict
+            collected steps and update rounds per second, update rounds per
+            100 steps, mean time per update round, fraction of the time the
+            learner was idle (waiting for data), time the acting thread waited
+            for the replay lock, and number of snapshots loaded
+        """
+        counters = self._counters()
+        window = {key: counters[key] - self._window[key] for key in counters}
+        self._window = counters
+        elapsed = max(window['time'], 1e-9)
+        rounds = window['num_rounds']
+        return {
+            'steps_per_sec': window['num_steps'] / elapsed,
+            'updates_per_sec': rounds / elapsed,
+            'updates_per_100_steps': 100.0 * rounds / max(window['num_steps'], 1),
+            'update_time': window['update_time'] / max(rounds, 1),
+            'learner_idle': window['idle_time'] / elapsed,
+            'collect_wait': window['wait_time'],
+            'snapshot_loads': window['snapshot_loads'],
+        }
+
+    def _counters(self):
+        with self.lock:
+            now = time.time()
+            # a wait in progress counts up to now, so that a wait spanning several
+            # windows is split over them
+            idle_time = self._idle_time
+            if self._wait_start is not None:
+                idle_time += now - self._wait_start
+            return {'time': now, 'num_steps': self.num_steps, 'num_rounds': self.num_rounds,
+                    'update_time': self._update_time, 'idle_time': idle_time,
+                    'wait_time': self._wait_time, 'snapshot_loads': self._snapshot_loads}
+
+    def _check(self):
+        if self._error is not None:
+            raise RuntimeError("learner thread failed") from self._error
+
+    def _may_update(self):
+        # called holding the lock
+        if not self._ready():
+            return False
+        if self._ready_steps is None:
+            self._ready_steps = self.num_steps
+        if self.update_ratio <= 0:
+            return True
+        return self.num_rounds < 1 + (self.num_steps - self._ready_steps) * self.update_ratio / 100.0
+
+    def _run(self, session):
+        try:
+            with session.as_default():
+                while True:
+                    with self._cond:
+                        self._wait_start = time.time()
+                        while not self._stopped and not self._may_update():
+                            self._cond.wait()
+                        self._idle_time += time.time() - self._wait_start
+                        self._wait_start = None
+                        if self._stopped:
+                            return
+                    with self._round_lock:
+                        t_start = time.time()
+                        with self.lock:
+                            batch = self._sample()
+                        self.loss = self._update(batch)
+                        self.num_rounds += 1
+                        if self.num_rounds % self.snapshot_rate == 0:
+                            values = self.snapshot.fetch()
+                            with self.lock:
+                                self._pending_snapshot = values
+                        self._update_time += time.time() - t_start
+        except Exception as e:
+            self._error = e
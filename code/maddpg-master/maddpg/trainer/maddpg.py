@@ -3,19 +3,17 @@ import random
 import tensorflow as tf
 import maddpg.common.tf_util as U
 
+from maddpg.common import profiling, returns
 from maddpg.common.distributions import make_pdtype
 from maddpg import AgentTrainer
-from maddpg.trainer.replay_buffer import ReplayBuffer
+from maddpg.trainer.replay_buffer import ReplayBuffer, JointReplayBuffer, make_rng, randint, split_seed
 
 
 def discount_with_dones(rewards, dones, gamma):
-    discounted = []
-    r = 0
-    for reward, done in zip(rewards[::-1], dones[::-1]):
-        r = reward + gamma*r
-        r = r*(1.-done)
-        discounted.append(r)
-    return discounted[::-1]
+    # the return of a done step is 0, so the return of step t is cut by the done of step t + 1
+    dones = np.asarray(dones, dtype=np.float64)
+    next_dones = np.concatenate([dones[..., 1:], np.zeros_like(dones[..., :1])], axis=-1)
+    return list((1. - dones) * returns.discounted_returns(rewards, gamma, dones=next_dones))
 
 def make_update_exp(vals, target_vals):
     polyak = 1.0 - 1e-2
@@ -23,9 +21,31 @@ def make_update_exp(vals, target_vals):
     for var, var_target in zip(sorted(vals, key=lambda v: v.name), sorted(target_vals, key=lambda v: v.name)):
         expression.append(var_target.assign(polyak * var_target + (1.0-polyak) * var))
     expression = tf.group(*expression)
-    return U.function([], [], updates=[expression])
-
-def p_train(make_obs_ph_n, act_space_n, p_index, p_func, q_func, optimizer, grad_norm_clipping=None, local_q_func=False, num_units=64, scope="trainer", reuse=None):
+    return U.function([], [], updates=[expression], name="target_update")
+
+def snapshot_getter(getter, *args, **kwargs):
+    # acting copies of the policies are neither trained nor checkpointed (see PolicySnapshot)
+    kwargs['trainable'] = False
+    kwargs['collections'] = [tf.GraphKeys.LOCAL_VARIABLES]
+    return getter(*args, **kwargs)
+
+def snapshot_pairs(vals, scope):
+    snapshot_vals = tf.get_collection(tf.GraphKeys.LOCAL_VARIABLES, scope=scope)
+    return list(zip(sorted(vals, key=lambda v: v.name), sorted(snapshot_vals, key=lambda v: v.name)))
+
+def adversarial_act_n(q, act_n, index, adv_eps):
+    """Worst-case perturbation of the other agents' actions (M3DDPG).
+
+    Takes one normalized gradient step of size `adv_eps` on every action in
+    `act_n` except `act_n[index]`, in the direction that decreases `q`. The
+    perturbations are constants w.r.t. the networks (stop_gradient), so the
+    minimax objective costs one extra forward/backward pass of the critic.
+    """
+    grads = tf.gradients(-tf.reduce_mean(q), act_n)
+    return [act if j == index or grad is None else act + adv_eps * tf.stop_gradient(tf.nn.l2_normalize(grad, axis=1))
+            for j, (act, grad) in enumerate(zip(act_n, grads))]
+
+def p_train(make_obs_ph_n, act_space_n, p_index, p_func, q_func, optimizer, grad_norm_clipping=None, local_q_func=False, num_units=64, scope="trainer", reuse=None, adv_eps=0.0, snapshot=False):
     with tf.variable_scope(scope, reuse=reuse):
         # create distribtuions
         act_pdtype_n = [make_pdtype(act_space) for act_space in act_space_n]
@@ -51,15 +71,27 @@ def p_train(make_obs_ph_n, act_space_n, p_index, p_func, q_func, optimizer, grad
         if local_q_func:
             q_input = tf.concat([obs_ph_n[p_index], act_input_n[p_index]], 1)
         q = q_func(q_input, 1, scope="q_func", reuse=True, num_units=num_units)[:,0]
+        if adv_eps > 0 and not local_q_func:
+            # evaluate the policy against the worst-case actions of the others
+            act_input_n = adversarial_act_n(q, act_input_n, p_index, adv_eps)
+            q = q_func(tf.concat(obs_ph_n + act_input_n, 1), 1, scope="q_func", reuse=True, num_units=num_units)[:,0]
         pg_loss = -tf.reduce_mean(q)
 
         loss = pg_loss + p_reg * 1e-3
 
         optimize_expr = U.minimize_and_clip(optimizer, loss, p_func_vars, grad_norm_clipping)
 
+        snapshot_vars = []
+        if snapshot:
+            # act with a copy of p_func that is only refreshed through PolicySnapshot
+            with tf.variable_scope("snapshot", custom_getter=snapshot_getter):
+                snapshot_p = p_func(p_input, int(act_pdtype_n[p_index].param_shape()[0]), scope="p_func", num_units=num_units)
+            snapshot_vars = snapshot_pairs(p_func_vars, U.absolute_scope_name("snapshot/p_func"))
+            act_sample = act_pdtype_n[p_index].pdfromflat(snapshot_p).sample()
+
         # Create callable functions
-        train = U.function(inputs=obs_ph_n + act_ph_n, outputs=loss, updates=[optimize_expr])
-        act = U.function(inputs=[obs_ph_n[p_index]], outputs=act_sample)
+        train = U.function(inputs=obs_ph_n + act_ph_n, outputs=loss, updates=[optimize_expr], name="p_train")
+        act = U.function(inputs=[obs_ph_n[p_index]], outputs=act_sample, name="act")
         p_values = U.function([obs_ph_n[p_index]], p)
 
         # target network
@@ -68,11 +100,11 @@ def p_train(make_obs_ph_n, act_space_n, p_index, p_func, q_func, optimizer, grad
         update_target_p = make_update_exp(p_func_vars, target_p_func_vars)
 
         target_act_sample = act_pdtype_n[p_index].pdfromflat(target_p).sample()
-        target_act = U.function(inputs=[obs_ph_n[p_index]], outputs=target_act_sample)
+        target_act = U.function(inputs=[obs_ph_n[p_index]], outputs=target_act_sample, name="target_act")
 
-        return act, train, update_target_p, {'p_values': p_values, 'target_act': target_act}
+        return act, train, update_target_p, {'p_values': p_values, 'target_act': target_act, 'snapshot_vars': snapshot_vars}
 
-def q_train(make_obs_ph_n, act_space_n, q_index, q_func, optimizer, grad_norm_clipping=None, local_q_func=False, scope="trainer", reuse=None, num_units=64):
+def q_train(make_obs_ph_n, act_space_n, q_index, q_func, optimizer, grad_norm_clipping=None, local_q_func=False, scope="trainer", reuse=None, num_units=64, adv_eps=0.0):
     with tf.variable_scope(scope, reuse=reuse):
         # create distribtuions
         act_pdtype_n = [make_pdtype(act_space) for act_space in act_space_n]
@@ -97,24 +129,570 @@ def q_train(make_obs_ph_n, act_space_n, q_index, q_func, optimizer, grad_norm_cl
         optimize_expr = U.minimize_and_clip(optimizer, loss, q_func_vars, grad_norm_clipping)
 
         # Create callable functions
-        train = U.function(inputs=obs_ph_n + act_ph_n + [target_ph], outputs=loss, updates=[optimize_expr])
+        train = U.function(inputs=obs_ph_n + act_ph_n + [target_ph], outputs=loss, updates=[optimize_expr], name="q_train")
         q_values = U.function(obs_ph_n + act_ph_n, q)
 
         # target network
         target_q = q_func(q_input, 1, scope="target_q_func", num_units=num_units)[:,0]
         target_q_func_vars = U.scope_vars(U.absolute_scope_name("target_q_func"))
         update_target_q = make_update_exp(q_func_vars, target_q_func_vars)
+        if adv_eps > 0 and not local_q_func:
+            # minimax target: the other agents' target actions are perturbed against this agent
+            adv_act_n = adversarial_act_n(target_q, act_ph_n, q_index, adv_eps)
+            target_q = q_func(tf.concat(obs_ph_n + adv_act_n, 1), 1, scope="target_q_func", reuse=True, num_units=num_units)[:,0]
 
-        target_q_values = U.function(obs_ph_n + act_ph_n, target_q)
+        target_q_values = U.function(obs_ph_n + act_ph_n, target_q, name="target_q_values")
 
         return train, update_target_q, {'q_values': q_values, 'target_q_values': target_q_values}
 
+def fused_train(trainers, make_obs_ph_n, act_space_n, gamma, lr, grad_norm_clipping=None, num_units=64, scope="fused_update"):
+    """Builds one op that runs a whole MADDPG training round for all `trainers`.
+
+    The target actions of all agents are computed once and shared by every TD
+    target; then the critics and actors of all agents are trained and their
+    target networks Polyak-averaged, all within a single session.run. The
+    networks are the trainers' own variables (reused by scope); the optimizer
+    state is separate from the one of the per-agent train functions.
+
+    All gradients are taken at the parameters the round starts with: unlike
+    the sequential MADDPGAgentTrainer.update, an actor does not see its
+    critic's update from the same round and target actions do not reflect the
+    Polyak updates of earlier agents.
+
+    Trainers with `adv_eps > 0` use the M3DDPG minimax target and actor loss
+    (see adversarial_act_n).
+    """
+    n = len(trainers)
+    with tf.variable_scope(scope):
+        act_pdtype_n = [make_pdtype(act_space) for act_space in act_space_n]
+
+        # set up placeholders
+        obs_ph_n = make_obs_ph_n
+        act_ph_n = [act_pdtype_n[i].sample_placeholder([None], name="action"+str(i)) for i in range(n)]
+        obs_next_ph_n = [U.BatchInput(obs_ph.shape[1:], name="observation_next"+str(i)).get() for i, obs_ph in enumerate(obs_ph_n)]
+        rew_ph = tf.placeholder(tf.float32, [None, n], name="reward")
+        done_ph = tf.placeholder(tf.float32, [None, n], name="done")
+
+    def q_input(i, obs_n, act_n):
+        if trainers[i].local_q_func:
+            return tf.concat([obs_n[i], act_n[i]], 1)
+        return tf.concat(obs_n + act_n, 1)
+
+    # target actions of all agents (computed once per round)
+    target_act_n = []
+    for i, trainer in enumerate(trainers):
+        with tf.variable_scope(trainer.name, reuse=True):
+            target_p = trainer.model(obs_next_ph_n[i], int(act_pdtype_n[i].param_shape()[0]), scope="target_p_func", reuse=True, num_units=num_units)
+            target_act_n.append(act_pdtype_n[i].pdfromflat(target_p).sample())
+
+    grads_and_vars = []
+    optimizers = []
+    q_loss_n = []
+    p_loss_n = []
+    for i, trainer in enumerate(trainers):
+        with tf.variable_scope(trainer.name, reuse=True):
+            # critic
+            target_q_next = trainer.model(q_input(i, obs_next_ph_n, target_act_n), 1, scope="target_q_func", reuse=True, num_units=num_units)[:,0]
+            if trainer.robust:
+                adv_act_n = adversarial_act_n(target_q_next, target_act_n, i, trainer.adv_eps)
+                target_q_next = trainer.model(q_input(i, obs_next_ph_n, adv_act_n), 1, scope="target_q_func", reuse=True, num_units=num_units)[:,0]
+            target_q = tf.stop_gradient(rew_ph[:, i] + gamma * (1.0 - done_ph[:, i]) * target_q_next)
+            q = trainer.model(q_input(i, obs_ph_n, act_ph_n), 1, scope="q_func", reuse=True, num_units=num_units)[:,0]
+            q_loss = tf.reduce_mean(tf.square(q - target_q))
+
+            # actor
+            p = trainer.model(obs_ph_n[i], int(act_pdtype_n[i].param_shape()[0]), scope="p_func", reuse=True, num_units=num_units)
+            act_pd = act_pdtype_n[i].pdfromflat(p)
+            p_reg = tf.reduce_mean(tf.square(act_pd.flatparam()))
+            act_input_n = act_ph_n + []
+            act_input_n[i] = act_pd.sample()
+            q_pi = trainer.model(q_input(i, obs_ph_n, act_input_n), 1, scope="q_func", reuse=True, num_units=num_units)[:,0]
+            if trainer.robust:
+                act_input_n = adversarial_act_n(q_pi, act_input_n, i, trainer.adv_eps)
+                q_pi = trainer.model(q_input(i, obs_ph_n, act_input_n), 1, scope="q_func", reuse=True, num_units=num_units)[:,0]
+            p_loss = -tf.reduce_mean(q_pi) + p_reg * 1e-3
+        q_loss_n.append(q_loss)
+        p_loss_n.append(p_loss)
+
+        for loss, func in [(q_loss, "q_func"), (p_loss, "p_func")]:
+            with tf.variable_scope(scope):
+                optimizer = tf.train.AdamOptimizer(learning_rate=lr)
+            gradients = optimizer.compute_gradients(loss, var_list=U.scope_vars(trainer.name + "/" + func, trainable_only=True))
+            if grad_norm_clipping is not None:
+                gradients = [(tf.clip_by_norm(grad, grad_norm_clipping), var) if grad is not None else (grad, var)
+                             for grad, var in gradients]
+            optimizers.append(optimizer)
+            grads_and_vars.append(gradients)
+
+    # apply all updates once every gradient has been computed
+    all_grads = [grad for gradients in grads_and_vars for grad, _ in gradients if grad is not None]
+    with tf.control_dependencies(all_grads):
+        optimize_expr = tf.group(*[optimizer.apply_gradients(gradients) for optimizer, gradients in zip(optimizers, grads_and_vars)])
+
+    # Polyak-average the target networks with the freshly updated parameters
+    polyak = 1.0 - 1e-2
+    expression = []
+    with tf.control_dependencies([optimize_expr]):
+        for trainer in trainers:
+            for func in ["p_func", "q_func"]:
+                # trainable only: the optimizer slots live in the same scopes
+                vals = U.scope_vars(trainer.name + "/" + func, trainable_only=True)
+                target_vals = U.scope_vars(trainer.name + "/target_" + func, trainable_only=True)
+                for var, var_target in zip(sorted(vals, key=lambda v: v.name), sorted(target_vals, key=lambda v: v.name)):
+                    expression.append(var_target.assign(polyak * var_target.read_value() + (1.0-polyak) * var.read_value()))
+    update_expr = tf.group(*expression)
+
+    train = U.function(inputs=obs_ph_n + act_ph_n + obs_next_ph_n + [rew_ph, done_ph], outputs=q_loss_n + p_loss_n, updates=[update_expr], name="fused_train")
+    return train
+
+class MADDPGFusedUpdate(object):
+    def __init__(self, trainers, obs_shape_n, act_space_n, args):
+        """Trains all agents with one fused op (see fused_train), i.e. a single
+        session.run per training round instead of several per agent.
+
+        Must be built before the variables are initialized.
+        """
+        self.trainers = trainers
+        self.n = len(trainers)
+        self.args = args
+        obs_ph_n = [U.BatchInput(obs_shape_n[i], name="fused_observation"+str(i)).get() for i in range(self.n)]
+        self.train = fused_train(
+            trainers=trainers,
+            make_obs_ph_n=obs_ph_n,
+            act_space_n=act_space_n,
+            gamma=args.gamma,
+            lr=args.lr,
+            grad_norm_clipping=0.5,
+            num_units=args.num_units
+        )
+        self.max_replay_buffer_len = args.batch_size * args.max_episode_len
+
+    def sample(self):
+        replay_buffer = self.trainers[0].replay_buffer
+        if self.trainers[0].joint_replay:
+            return replay_buffer.sample_index(replay_buffer.make_index(self.args.batch_size))
+        # same index into every agent's buffer
+        index = replay_buffer.make_index(self.args.batch_size)
+        obs_n, act_n, rew_n, obs_next_n, done_n = [], [], [], [], []
+        for trainer in self.trainers:
+            obs, act, rew, obs_next, done = trainer.replay_buffer.sample_index(index)
+            obs_n.append(obs)
+            act_n.append(act)
+            rew_n.append(rew)
+            obs_next_n.append(obs_next)
+            done_n.append(done)
+        return obs_n, act_n, np.stack(rew_n, axis=1), obs_next_n, np.stack(done_n, axis=1)
+
+    def update(self, t):
+        if len(self.trainers[0].replay_buffer) < self.max_replay_buffer_len: # replay buffer is not large enough
+            return
+        if not t % 100 == 0:  # only update every 100 steps
+            return
+        with profiling.phase("sample"):
+            batch = self.sample()
+        return self.update_batch(batch)
+
+    def update_batch(self, batch):
+        obs_n, act_n, rew_n, obs_next_n, done_n = batch
+        losses = self.train(*(obs_n + act_n + obs_next_n + [rew_n, done_n]))
+        # per-agent [q_loss, p_loss]
+        return [[q_loss, p_loss] for q_loss, p_loss in zip(losses[:self.n], losses[self.n:])]
+
+def batched_mlp(input, weights, biases, activation_fn=tf.nn.relu):
+    """Applies G fully connected networks with the same shapes in one pass.
+
+    `input` has shape (G, batch, in); `weights` and `biases` hold the
+    (G, in, out) and (G, out) parameters of every layer. Hidden layers use
+    `activation_fn`, the output layer is linear. Returns the (G, batch, out)
+    outputs.
+    """
+    out = input
+    for k, (w, b) in enumerate(zip(weights, biases)):
+        out = tf.matmul(out, w) + b[:, None, :]
+        if k < len(weights) - 1:
+            out = activation_fn(out)
+    return out
+
+def stacked_mlp(input, var_lists, activation_fn=tf.nn.relu):
+    """batched_mlp over G separate networks; `var_lists` holds the [weights,
+    biases, weights, biases, ...] variables of every network, as created by
+    stacked layers.fully_connected calls."""
+    num_layers = len(var_lists[0]) // 2
+    weights = [tf.stack([var_list[2 * k] for var_list in var_lists]) for k in range(num_layers)]
+    biases = [tf.stack([var_list[2 * k + 1] for var_list in var_lists]) for k in range(num_layers)]
+    return batched_mlp(input, weights, biases, activation_fn)
+
+def population_mlp(input, num_outputs, scope, population_size, reuse=False, num_units=64):
+    """The mlp_model of experiments/train.py for a population of networks.
+
+    Every layer is one (population_size, in, out) weight tensor (Glorot
+    uniform initialized, like layers.fully_connected), so all variants are
+    evaluated by batched_mlp; `input` has shape (population_size, batch, in).
+    """
+    with tf.variable_scope(scope, reuse=reuse):
+        weights = []
+        biases = []
+        in_size = int(input.shape[-1])
+        for k, size in enumerate([num_units, num_units, num_outputs]):
+            limit = np.sqrt(6.0 / (in_size + size))
+            weights.append(tf.get_variable("weights_%d" % k, [population_size, in_size, size],
+                                           initializer=tf.random_uniform_initializer(-limit, limit)))
+            biases.append(tf.get_variable("biases_%d" % k, [population_size, size], initializer=tf.zeros_initializer()))
+            in_size = size
+        return batched_mlp(input, weights, biases)
+
+def group_policies(trainers, obs_shape_n, act_space_n):
+    """Partitions agent indices into groups whose policies can be stacked:
+    same model, observation shape, action space and p_func variable shapes."""
+    groups = {}
+    for i, trainer in enumerate(trainers):
+        var_list = U.scope_vars(trainer.name + "/p_func", trainable_only=True)
+        shapes = tuple(tuple(var.shape.as_list()) for var in var_list)
+        stackable = len(shapes) % 2 == 0 and all(len(shape) == 2 for shape in shapes[::2]) \
+            and all(len(shape) == 1 for shape in shapes[1::2])
+        key = (trainer.model, tuple(obs_shape_n[i]), repr(act_space_n[i]), shapes) if stackable else i
+        groups.setdefault(key, []).append(i)
+    return list(groups.values())
+
+class MADDPGGroupPolicy(object):
+    def __init__(self, trainers, obs_shape_n, act_space_n, stack_weights=True, use_snapshot=False, scope="group_policy"):
+        """Evaluates the policies of all `trainers` in a single session call.
+
+        Agents with the same model, observation shape and action space (e.g.
+        the adversaries of simple_tag) form a group whose p_func weights are
+        stacked into per-agent weight tensors and applied as batched matmuls.
+        Stacking assumes the model is a stack of fully connected layers with
+        ReLU hidden activations and a linear output, like mlp_model in
+        experiments/train.py; with `stack_weights=False` every agent runs its
+        own p_func (still within the same session call). With `use_snapshot`
+        the policy snapshots of the trainers are evaluated instead (see
+        PolicySnapshot).
+        """
+        self.n = len(trainers)
+        with tf.variable_scope(scope):
+            act_pdtype_n = [make_pdtype(act_space) for act_space in act_space_n]
+            obs_ph_n = [U.BatchInput(obs_shape_n[i], name="observation"+str(i)).get() for i in range(self.n)]
+        p_n = [None] * self.n
+        self.groups = group_policies(trainers, obs_shape_n, act_space_n) if stack_weights else [[i] for i in range(self.n)]
+        for group in self.groups:
+            if len(group) > 1:
+                var_lists = [U.scope_vars(trainers[i].name + "/p_func", trainable_only=True) for i in group]
+                if use_snapshot:
+                    var_lists = [[dict(trainers[i].p_debug['snapshot_vars'])[var] for var in var_list]
+                                 for i, var_list in zip(group, var_lists)]
+                p = stacked_mlp(tf.stack([obs_ph_n[i] for i in group]), var_lists)
+                for g, i in enumerate(group):
+                    p_n[i] = p[g]
+            else:
+                i = group[0]
+                func_scope = "snapshot/p_func" if use_snapshot else "p_func"
+                with tf.variable_scope(trainers[i].name, reuse=True):
+                    p_n[i] = trainers[i].model(obs_ph_n[i], int(act_pdtype_n[i].param_shape()[0]), scope=func_scope,
+                                               reuse=True, num_units=trainers[i].args.num_units)
+        act_n = [act_pdtype_n[i].pdfromflat(p_n[i]).sample() for i in range(self.n)]
+        self._act = U.function(inputs=obs_ph_n, outputs=act_n, name="group_act")
+        self.p_values = U.function(inputs=obs_ph_n, outputs=p_n)
+
+    def act(self, obs_n):
+        """Actions of all agents for a batch of observations per agent."""
+        return self._act(*obs_n)
+
+    def action(self, obs_n):
+        """Actions of all agents for a single observation per agent."""
+        return [act[0] for act in self._act(*[obs[None] for obs in obs_n])]
+
+class PolicySnapshot(object):
+    def __init__(self, trainers):
+        """Refreshes the policy snapshots of `trainers` (built with policy_snapshot=True).
+
+        The copy goes through numpy in two steps, so that every snapshot is
+        consistent even though training and acting run in different threads:
+        `fetch` reads the live policy weights and is called by the thread that
+        trains them, between updates; `load` writes the fetched weights into the
+        snapshot variables and is called by the thread that acts with them,
+        between actions. Must be built before the variables are initialized.
+        """
+        pairs = [pair for trainer in trainers for pair in trainer.p_debug['snapshot_vars']]
+        assert len(pairs) > 0, "trainers were built without policy snapshots"
+        self.live_vars = [var for var, _ in pairs]
+        self.placeholders = [tf.placeholder(var.dtype.base_dtype, var.shape) for var, _ in pairs]
+        self.load_expr = tf.group(*[snapshot_var.assign(ph) for (_, snapshot_var), ph in zip(pairs, self.placeholders)])
+
+    def fetch(self):
+        return U.get_session().run(self.live_vars)
+
+    def load(self, values):
+        U.get_session().run(self.load_expr, feed_dict=dict(zip(self.placeholders, values)))
+
+def minimize_and_clip_per_variant(optimizer, objective, var_list, clip_val=None):
+    """U.minimize_and_clip for population variables: the gradient of every
+    variant (slice along the leading axis) is clipped separately."""
+    gradients = optimizer.compute_gradients(objective, var_list=var_list)
+    if clip_val is not None:
+        for i, (grad, var) in enumerate(gradients):
+            if grad is not None:
+                gradients[i] = (tf.clip_by_norm(grad, clip_val, axes=list(range(1, grad.shape.ndims))), var)
+    return optimizer.apply_gradients(gradients)
+
+def population_train(make_obs_ph_n, act_space_n, index, population_size, optimizer, grad_norm_clipping=None, local_q_func=False, num_units=64, scope="trainer", reuse=None, adv_eps=0.0, snapshot=False):
+    """Critic and actor training for the `population_size` variants of agent `index`.
+
+    The training placeholders hold population_size * batch rows, variant
+    major: rows [k * batch, (k + 1) * batch) train variant k. Losses are the
+    sum over the variants of their batch means, so every variant gets the
+    gradient it would get when trained alone.
+    """
+    K = population_size
+    with tf.variable_scope(scope, reuse=reuse):
+        # create distribtuions
+        act_pdtype_n = [make_pdtype(act_space) for act_space in act_space_n]
+        act_pdtype = act_pdtype_n[index]
+        param_dim = int(act_pdtype.param_shape()[0])
+
+        # set up placeholders
+        obs_ph_n = make_obs_ph_n
+        act_ph_n = [act_pdtype_n[i].sample_placeholder([None], name="action"+str(i)) for i in range(len(act_space_n))]
+        target_ph = tf.placeholder(tf.float32, [None], name="target")
+        obs_ph = U.BatchInput(obs_ph_n[index].shape[1:], name="act_observation").get()
+        variant_ph = tf.placeholder(tf.int32, [None], name="variant")
+
+        def population(input, num_outputs, func_scope, reuse=False):
+            # variant-major (K * batch, in) rows to (K * batch, out)
+            out = population_mlp(tf.reshape(input, [K, -1, int(input.shape[-1])]), num_outputs, scope=func_scope,
+                                 population_size=K, reuse=reuse, num_units=num_units)
+            return tf.reshape(out, [-1, num_outputs])
+
+        def select(func_scope, variant):
+            # row b of obs_ph evaluated by variant[b] (all variants run, one is kept)
+            p_all = population_mlp(tf.tile(obs_ph[None], [K, 1, 1]), param_dim, scope=func_scope,
+                                   population_size=K, reuse=True, num_units=num_units)
+            return tf.gather_nd(p_all, tf.stack([variant, tf.range(tf.shape(variant)[0])], axis=1))
+
+        def variant_mean(x):
+            return tf.reduce_sum(tf.reduce_mean(tf.reshape(x, [K, -1]), axis=1))
+
+        def q_input(act_n):
+            if local_q_func:
+                return tf.concat([obs_ph_n[index], act_n[index]], 1)
+            return tf.concat(obs_ph_n + act_n, 1)
+
+        # critic
+        q = population(q_input(act_ph_n), 1, "q_func")[:,0]
+        q_func_vars = U.scope_vars(U.absolute_scope_name("q_func"))
+        q_loss = variant_mean(tf.square(q - target_ph))
+        q_optimize_expr = minimize_and_clip_per_variant(optimizer(), q_loss, q_func_vars, grad_norm_clipping)
+
+        target_q = population(q_input(act_ph_n), 1, "target_q_func")[:,0]
+        target_q_func_vars = U.scope_vars(U.absolute_scope_name("target_q_func"))
+        if adv_eps > 0 and not local_q_func:
+            adv_act_n = adversarial_act_n(target_q, act_ph_n, index, adv_eps)
+            target_q = population(q_input(adv_act_n), 1, "target_q_func", reuse=True)[:,0]
+
+        # actor
+        p = population(obs_ph_n[index], param_dim, "p_func")
+        p_func_vars = U.scope_vars(U.absolute_scope_name("p_func"))
+        act_pd = act_pdtype.pdfromflat(p)
+        p_reg = variant_mean(tf.reduce_mean(tf.square(act_pd.flatparam()), axis=1))
+        act_input_n = act_ph_n + []
+        act_input_n[index] = act_pd.sample()
+        q_pi = population(q_input(act_input_n), 1, "q_func", reuse=True)[:,0]
+        if adv_eps > 0 and not local_q_func:
+            act_input_n = adversarial_act_n(q_pi, act_input_n, index, adv_eps)
+            q_pi = population(q_input(act_input_n), 1, "q_func", reuse=True)[:,0]
+        p_loss = -variant_mean(q_pi) + p_reg * 1e-3
+        p_optimize_expr = minimize_and_clip_per_variant(optimizer(), p_loss, p_func_vars, grad_norm_clipping)
+
+        target_p = population(obs_ph_n[index], param_dim, "target_p_func")
+        target_p_func_vars = U.scope_vars(U.absolute_scope_name("target_p_func"))
+
+        # acting with the variant of every row, and with a uniformly drawn variant
+        p_selected = select("p_func", variant_ph)
+        mixture_variant = tf.random_uniform(tf.shape(obs_ph)[:1], maxval=K, dtype=tf.int32)
+        target_mixture_act = act_pdtype.pdfromflat(select("target_p_func", mixture_variant)).sample()
+        p_act = p_selected
+        snapshot_vars = []
+        if snapshot:
+            # act with a copy of p_func that is only refreshed through PolicySnapshot
+            with tf.variable_scope("snapshot", custom_getter=snapshot_getter):
+                population(obs_ph_n[index], param_dim, "p_func")
+                p_act = select("p_func", variant_ph)
+            snapshot_vars = snapshot_pairs(p_func_vars, U.absolute_scope_name("snapshot/p_func"))
+
+        # Create callable functions
+        act = U.function(inputs=[obs_ph, variant_ph], outputs=act_pdtype.pdfromflat(p_act).sample(), name="act")
+        q_train = U.function(inputs=obs_ph_n + act_ph_n + [target_ph], outputs=q_loss, updates=[q_optimize_expr], name="q_train")
+        p_train = U.function(inputs=obs_ph_n + act_ph_n, outputs=p_loss, updates=[p_optimize_expr], name="p_train")
+        q_update = make_update_exp(q_func_vars, target_q_func_vars)
+        p_update = make_update_exp(p_func_vars, target_p_func_vars)
+        debug = {
+            'p_values': U.function([obs_ph, variant_ph], p_selected),
+            'target_act': U.function([obs_ph], target_mixture_act, name="target_act"),
+            'population_target_act': U.function([obs_ph_n[index]], act_pdtype.pdfromflat(target_p).sample(), name="target_act"),
+            'q_values': U.function(obs_ph_n + act_ph_n, q),
+            'target_q_values': U.function(obs_ph_n + act_ph_n, target_q, name="target_q_values"),
+            'snapshot_vars': snapshot_vars,
+        }
+        return act, q_train, p_train, q_update, p_update, debug
+
+class MADDPGPopulationTrainer(AgentTrainer):
+    def __init__(self, name, obs_shape_n, act_space_n, agent_index, args, population_size, local_q_func=False, replay_buffer=None, adv_eps=0.0, policy_snapshot=False, seed=None):
+        """Agent slot holding `population_size` MADDPG policy variants.
+
+        The actors and critics of all variants are population_mlp networks,
+        i.e. one batched weight tensor per layer, and all variants are
+        evaluated or trained in one session call. Every episode (every
+        environment of a batch) is played by the variant drawn with
+        `sample_variants`; every variant trains on its own minibatch from the
+        slot's replay buffer. The other agents see the population as a
+        mixture: their TD targets use the target policy of a uniformly drawn
+        variant (p_debug['target_act']). With `policy_snapshot` the variants
+        act with a snapshot of their weights (see PolicySnapshot).
+
+        `seed` seeds the streams of the replay buffer and of the variant
+        draws, which are spawned from it as two independent children
+        (default: the global numpy stream).
+        """
+        self.name = name
+        self.n = len(obs_shape_n)
+        self.agent_index = agent_index
+        self.args = args
+        self.population_size = population_size
+        self.local_q_func = local_q_func
+        self.adv_eps = adv_eps
+        self.robust = adv_eps > 0 and not local_q_func
+        obs_ph_n = []
+        for i in range(self.n):
+            obs_ph_n.append(U.BatchInput(obs_shape_n[i], name="observation"+str(i)).get())
+
+        # Create all the functions necessary to train the population
+        self._act, self.q_train, self.p_train, self.q_update, self.p_update, debug = population_train(
+            scope=self.name,
+            make_obs_ph_n=obs_ph_n,
+            act_space_n=act_space_n,
+            index=agent_index,
+            population_size=population_size,
+            optimizer=lambda: tf.train.AdamOptimizer(learning_rate=args.lr),
+            grad_norm_clipping=0.5,
+            local_q_func=local_q_func,
+            num_units=args.num_units,
+            adv_eps=adv_eps,
+            snapshot=policy_snapshot
+        )
+        self.p_debug = {key: debug[key] for key in ['p_values', 'target_act', 'population_target_act', 'snapshot_vars']}
+        self.q_debug = {key: debug[key] for key in ['q_values', 'target_q_values']}
+        # Create experience buffer (or use a JointReplayBuffer shared by all trainers)
+        buffer_seed, variant_seed = split_seed(seed, 2)
+        self.replay_buffer = ReplayBuffer(1e6, seed=buffer_seed) if replay_buffer is None else replay_buffer
+        self.joint_replay = isinstance(self.replay_buffer, JointReplayBuffer)
+        self.max_replay_buffer_len = args.batch_size * args.max_episode_len
+        self.replay_sample_index = None
+        # active variant of every environment
+        self.variants = np.zeros(1, dtype=np.int32)
+        self.np_random = make_rng(variant_seed)
+
+    def sample_variants(self, num_envs=1, done=None):
+        """Draws the variants playing the next episodes: of all `num_envs`
+        environments, or only of those flagged in `done`."""
+        if done is None or len(self.variants) != num_envs:
+            self.variants = randint(self.np_random, self.population_size, num_envs).astype(np.int32)
+        else:
+            done = np.asarray(done, dtype=bool)
+            self.variants[done] = randint(self.np_random, self.population_size, np.sum(done))
+
+    def act(self, obs):
+        # one row per environment, each acted on by its own variant
+        return self._act(obs, self.variants)
+
+    def action(self, obs):
+        return self._act(obs[None], self.variants[:1])[0]
+
+    def experience(self, obs, act, rew, new_obs, done, terminal):
+        # Store transition in the replay buffer.
+        assert not self.joint_replay, "joint transitions are added to the shared JointReplayBuffer directly"
+        self.replay_buffer.add(obs, act, rew, new_obs, float(done))
+
+    def experience_batch(self, obs, act, rew, new_obs, done, terminal):
+        # Store a batch of transitions (one per environment) in the replay buffer.
+        assert not self.joint_replay, "joint transitions are added to the shared JointReplayBuffer directly"
+        self.replay_buffer.add_batch(obs, act, rew, new_obs, np.asarray(done, dtype=np.float64))
+
+    def preupdate(self):
+        self.replay_sample_index = None
+        if self.joint_replay:
+            self.replay_buffer.preupdate()
+
+    def update(self, agents, t):
+        if len(self.replay_buffer) < self.max_replay_buffer_len: # replay buffer is not large enough
+            return
+        if not t % 100 == 0:  # only update every 100 steps
+            return
+        with profiling.phase("sample"):
+            batch = self.sample_batch(agents)
+        return self.update_batch(agents, batch)
+
+    def sample_batch(self, agents):
+        # one minibatch per variant, variant major
+        self.replay_sample_index = self.replay_buffer.make_index(self.population_size * self.args.batch_size)
+        index = self.replay_sample_index
+        if self.joint_replay:
+            obs_n, act_n, rew_n, obs_next_n, done_n = self.replay_buffer.sample_index(index)
+            rew = rew_n[:, self.agent_index]
+            done = done_n[:, self.agent_index]
+        else:
+            obs_n = []
+            obs_next_n = []
+            act_n = []
+            for i in range(self.n):
+                obs, act, rew, obs_next, done = agents[i].replay_buffer.sample_index(index)
+                obs_n.append(obs)
+                obs_next_n.append(obs_next)
+                act_n.append(act)
+            obs, act, rew, obs_next, done = self.replay_buffer.sample_index(index)
+        return obs_n, act_n, rew, obs_next_n, done
+
+    def update_batch(self, agents, batch):
+        obs_n, act_n, rew, obs_next_n, done = batch
+
+        # train q network (the rows of every variant use its own target policy)
+        target_act_next_n = [agents[i].p_debug['target_act'](obs_next_n[i]) if i != self.agent_index
+                             else self.p_debug['population_target_act'](obs_next_n[i]) for i in range(self.n)]
+        target_q_next = self.q_debug['target_q_values'](*(obs_next_n + target_act_next_n))
+        target_q = rew + self.args.gamma * (1.0 - done) * target_q_next
+        q_loss = self.q_train(*(obs_n + act_n + [target_q]))
+
+        # train p network
+        p_loss = self.p_train(*(obs_n + act_n))
+
+        self.p_update()
+        self.q_update()
+
+        # losses are summed over the variants; report the per-variant mean
+        return [q_loss / self.population_size, p_loss / self.population_size, np.mean(target_q), np.mean(rew), np.mean(target_q_next), np.std(target_q)]
+
 class MADDPGAgentTrainer(AgentTrainer):
-    def __init__(self, name, model, obs_shape_n, act_space_n, agent_index, args, local_q_func=False):
+    def __init__(self, name, model, obs_shape_n, act_space_n, agent_index, args, local_q_func=False, replay_buffer=None, adv_eps=0.0, policy_snapshot=False, seed=None):
+        """MADDPG trainer of agent `agent_index`.
+
+        With `adv_eps > 0` the agent is trained with the M3DDPG minimax
+        objective: its critic target and actor loss are evaluated at the other
+        agents' actions perturbed by one gradient step of size `adv_eps` that
+        minimizes its Q-value (ignored with a local, DDPG critic).
+
+        With `policy_snapshot` the agent acts with a copy of its policy weights
+        that is only refreshed through PolicySnapshot, so that actions can be
+        selected while another thread trains the policy.
+
+        `seed` seeds the sampling stream of the agent's own replay buffer
+        (default: the global numpy stream).
+        """
         self.name = name
         self.n = len(obs_shape_n)
         self.agent_index = agent_index
         self.args = args
+        self.model = model
+        self.local_q_func = local_q_func
+        self.adv_eps = adv_eps
+        self.robust = adv_eps > 0 and not local_q_func
         obs_ph_n = []
         for i in range(self.n):
             obs_ph_n.append(U.BatchInput(obs_shape_n[i], name="observation"+str(i)).get())
@@ -129,7 +707,8 @@ class MADDPGAgentTrainer(AgentTrainer):
             optimizer=tf.train.AdamOptimizer(learning_rate=args.lr),
             grad_norm_clipping=0.5,
             local_q_func=local_q_func,
-            num_units=args.num_units
+            num_units=args.num_units,
+            adv_eps=adv_eps
         )
         self.act, self.p_train, self.p_update, self.p_debug = p_train(
             scope=self.name,
@@ -141,10 +720,13 @@ class MADDPGAgentTrainer(AgentTrainer):
             optimizer=tf.train.AdamOptimizer(learning_rate=args.lr),
             grad_norm_clipping=0.5,
             local_q_func=local_q_func,
-            num_units=args.num_units
+            num_units=args.num_units,
+            adv_eps=adv_eps,
+            snapshot=policy_snapshot
         )
-        # Create experience buffer
-        self.replay_buffer = ReplayBuffer(1e6)
+        # Create experience buffer (or use a JointReplayBuffer shared by all trainers)
+        self.replay_buffer = ReplayBuffer(1e6, seed=seed) if replay_buffer is None else replay_buffer
+        self.joint_replay = isinstance(self.replay_buffer, JointReplayBuffer)
         self.max_replay_buffer_len = args.batch_size * args.max_episode_len
         self.replay_sample_index = None
 
@@ -153,38 +735,56 @@ class MADDPGAgentTrainer(AgentTrainer):
 
     def experience(self, obs, act, rew, new_obs, done, terminal):
         # Store transition in the replay buffer.
+        assert not self.joint_replay, "joint transitions are added to the shared JointReplayBuffer directly"
         self.replay_buffer.add(obs, act, rew, new_obs, float(done))
 
+    def experience_batch(self, obs, act, rew, new_obs, done, terminal):
+        # Store a batch of transitions (one per environment) in the replay buffer.
+        assert not self.joint_replay, "joint transitions are added to the shared JointReplayBuffer directly"
+        self.replay_buffer.add_batch(obs, act, rew, new_obs, np.asarray(done, dtype=np.float64))
+
     def preupdate(self):
         self.replay_sample_index = None
+        if self.joint_replay:
+            self.replay_buffer.preupdate()
 
     def update(self, agents, t):
         if len(self.replay_buffer) < self.max_replay_buffer_len: # replay buffer is not large enough
             return
         if not t % 100 == 0:  # only update every 100 steps
             return
-
-        self.replay_sample_index = self.replay_buffer.make_index(self.args.batch_size)
-        # collect replay sample from all agents
-        obs_n = []
-        obs_next_n = []
-        act_n = []
-        index = self.replay_sample_index
-        for i in range(self.n):
-            obs, act, rew, obs_next, done = agents[i].replay_buffer.sample_index(index)
-            obs_n.append(obs)
-            obs_next_n.append(obs_next)
-            act_n.append(act)
-        obs, act, rew, obs_next, done = self.replay_buffer.sample_index(index) # this is your own reward and everything, not others'
+        with profiling.phase("sample"):
+            batch = self.sample_batch(agents)
+        return self.update_batch(agents, batch)
+
+    def sample_batch(self, agents):
+        if self.joint_replay:
+            # joint batch drawn once per update round and shared by all trainers
+            obs_n, act_n, rew_n, obs_next_n, done_n = self.replay_buffer.sample_round(self.args.batch_size)
+            rew = rew_n[:, self.agent_index]
+            done = done_n[:, self.agent_index]
+        else:
+            self.replay_sample_index = self.replay_buffer.make_index(self.args.batch_size)
+            # collect replay sample from all agents
+            obs_n = []
+            obs_next_n = []
+            act_n = []
+            index = self.replay_sample_index
+            for i in range(self.n):
+                obs, act, rew, obs_next, done = agents[i].replay_buffer.sample_index(index)
+                obs_n.append(obs)
+                obs_next_n.append(obs_next)
+                act_n.append(act)
+            obs, act, rew, obs_next, done = self.replay_buffer.sample_index(index) # this is your own reward and everything, not others'
+        return obs_n, act_n, rew, obs_next_n, done
+
+    def update_batch(self, agents, batch):
+        obs_n, act_n, rew, obs_next_n, done = batch
 
         # train q network
-        num_sample = 1
-        target_q = 0.0
-        for i in range(num_sample):
-            target_act_next_n = [agents[i].p_debug['target_act'](obs_next_n[i]) for i in range(self.n)]
-            target_q_next = self.q_debug['target_q_values'](*(obs_next_n + target_act_next_n))
-            target_q += rew + self.args.gamma * (1.0 - done) * target_q_next
-        target_q /= num_sample
+        target_act_next_n = [agents[i].p_debug['target_act'](obs_next_n[i]) for i in range(self.n)]
+        target_q_next = self.q_debug['target_q_values'](*(obs_next_n + target_act_next_n))
+        target_q = rew + self.args.gamma * (1.0 - done) * target_q_next
         q_loss = self.q_train(*(obs_n + act_n + [target_q]))
 
         # train p network
@@ -1,54 +1,105 @@
 import numpy as np
-import random
+
+
+def make_rng(seed=None):
+    # the global numpy stream by default, a np.random.Generator of its own if seeded
+    return np.random if seed is None else np.random.default_rng(seed)
+
+
+def split_seed(seed, num_streams):
+    # independent child seeds of `seed` for several streams (all None if unseeded)
+    if seed is None:
+        return [None] * num_streams
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return seed.spawn(num_streams)
+
+
+def randint(np_random, high, size):
+    # integers in [0, high) drawn from the global numpy stream or a np.random.Generator
+    if isinstance(np_random, np.random.Generator):
+        return np_random.integers(high, size=size)
+    return np_random.randint(high, size=size)
+
 
 class ReplayBuffer(object):
-    def __init__(self, size):
+    def __init__(self, size, seed=None):
         """Create Prioritized Replay buffer.
 
+        Transitions are kept in preallocated arrays (one per field) that are
+        used as a ring buffer. The arrays are allocated when the first
+        transition is added, with shapes and dtypes taken from it.
+
         Parameters
         ----------
         size: int
             Max number of transitions to store in the buffer. When the buffer
             overflows the old memories are dropped.
+        seed: int, np.random.SeedSequence or None
+            Seed of the buffer's own sampling stream (default: the global
+            numpy stream).
         """
-        self._storage = []
         self._maxsize = int(size)
+        self.np_random = make_rng(seed)
         self._next_idx = 0
+        self._size = 0
+        self._obs_t = None
+        self._actions = None
+        self._rewards = None
+        self._obs_tp1 = None
+        self._dones = None
 
     def __len__(self):
-        return len(self._storage)
+        return self._size
 
     def clear(self):
-        self._storage = []
         self._next_idx = 0
+        self._size = 0
 
-    def add(self, obs_t, action, reward, obs_tp1, done):
-        data = (obs_t, action, reward, obs_tp1, done)
+    def _allocate(self, obs_t, action):
+        obs_t = np.asarray(obs_t)
+        action = np.asarray(action)
+        self._obs_t = np.empty((self._maxsize,) + obs_t.shape, dtype=obs_t.dtype)
+        self._actions = np.empty((self._maxsize,) + action.shape, dtype=action.dtype)
+        self._rewards = np.empty(self._maxsize, dtype=np.float64)
+        self._obs_tp1 = np.empty((self._maxsize,) + obs_t.shape, dtype=obs_t.dtype)
+        self._dones = np.empty(self._maxsize, dtype=np.float64)
 
-        if self._next_idx >= len(self._storage):
-            self._storage.append(data)
-        else:
-            self._storage[self._next_idx] = data
+    def add(self, obs_t, action, reward, obs_tp1, done):
+        if self._obs_t is None:
+            self._allocate(obs_t, action)
+        idx = self._next_idx
+        self._obs_t[idx] = obs_t
+        self._actions[idx] = action
+        self._rewards[idx] = reward
+        self._obs_tp1[idx] = obs_tp1
+        self._dones[idx] = done
         self._next_idx = (self._next_idx + 1) % self._maxsize
+        self._size = min(self._size + 1, self._maxsize)
+
+    def add_batch(self, obs_t, action, reward, obs_tp1, done):
+        """Add a batch of transitions, each argument having the batch as leading axis."""
+        if self._obs_t is None:
+            self._allocate(obs_t[0], action[0])
+        batch_size = len(reward)
+        idxes = (self._next_idx + np.arange(batch_size)) % self._maxsize
+        self._obs_t[idxes] = obs_t
+        self._actions[idxes] = action
+        self._rewards[idxes] = reward
+        self._obs_tp1[idxes] = obs_tp1
+        self._dones[idxes] = done
+        self._next_idx = (self._next_idx + batch_size) % self._maxsize
+        self._size = min(self._size + batch_size, self._maxsize)
 
     def _encode_sample(self, idxes):
-        obses_t, actions, rewards, obses_tp1, dones = [], [], [], [], []
-        for i in idxes:
-            data = self._storage[i]
-            obs_t, action, reward, obs_tp1, done = data
-            obses_t.append(np.array(obs_t, copy=False))
-            actions.append(np.array(action, copy=False))
-            rewards.append(reward)
-            obses_tp1.append(np.array(obs_tp1, copy=False))
-            dones.append(done)
-        return np.array(obses_t), np.array(actions), np.array(rewards), np.array(obses_tp1), np.array(dones)
+        return self._obs_t[idxes], self._actions[idxes], self._rewards[idxes], self._obs_tp1[idxes], self._dones[idxes]
 
     def make_index(self, batch_size):
-        return [random.randint(0, len(self._storage) - 1) for _ in range(batch_size)]
+        return randint(self.np_random, self._size, batch_size)
 
     def make_latest_index(self, batch_size):
-        idx = [(self._next_idx - 1 - i) % self._maxsize for i in range(batch_size)]
-        np.random.shuffle(idx)
+        idx = (self._next_idx - 1 - np.arange(batch_size)) % self._maxsize
+        self.np_random.shuffle(idx)
         return idx
 
     def sample_index(self, idxes):
@@ -79,8 +130,114 @@ class ReplayBuffer(object):
         if batch_size > 0:
             idxes = self.make_index(batch_size)
         else:
-            idxes = range(0, len(self._storage))
+            idxes = np.arange(self._size)
         return self._encode_sample(idxes)
 
     def collect(self):
         return self.sample(-1)
+
+
+class JointReplayBuffer(object):
+    def __init__(self, size, num_agents, seed=None):
+        """Create a replay buffer holding the transitions of all agents.
+
+        Every agent has its own obs, act and obs_tp1 column and rewards/dones
+        are stored as (size, num_agents) arrays, all indexed by the same ring
+        position. A joint batch is gathered once per sampled index set, and
+        `sample_round` hands the same batch to every trainer of an update
+        round instead of each trainer regathering all agents' data.
+
+        Parameters
+        ----------
+        size: int
+            Max number of joint transitions to store in the buffer. When the
+            buffer overflows the old memories are dropped.
+        num_agents: int
+            Number of agents whose transitions are stored.
+        seed: int, np.random.SeedSequence or None
+            Seed of the buffer's own sampling stream (default: the global
+            numpy stream).
+        """
+        self._maxsize = int(size)
+        self.np_random = make_rng(seed)
+        self._num_agents = num_agents
+        self._next_idx = 0
+        self._size = 0
+        self._obs_t = None
+        self._actions = None
+        self._rewards = None
+        self._obs_tp1 = None
+        self._dones = None
+        self._round_batch = None
+
+    def __len__(self):
+        return self._size
+
+    def clear(self):
+        self._next_idx = 0
+        self._size = 0
+        self._round_batch = None
+
+    def _allocate(self, obs_t_n, action_n):
+        def column(x):
+            x = np.asarray(x)
+            return np.empty((self._maxsize,) + x.shape, dtype=x.dtype)
+        self._obs_t = [column(obs) for obs in obs_t_n]
+        self._actions = [column(act) for act in action_n]
+        self._rewards = np.empty((self._maxsize, self._num_agents), dtype=np.float64)
+        self._obs_tp1 = [column(obs) for obs in obs_t_n]
+        self._dones = np.empty((self._maxsize, self._num_agents), dtype=np.float64)
+
+    def _write(self, idx, obs_t_n, action_n, reward_n, obs_tp1_n, done_n):
+        for i in range(self._num_agents):
+            self._obs_t[i][idx] = obs_t_n[i]
+            self._actions[i][idx] = action_n[i]
+            self._obs_tp1[i][idx] = obs_tp1_n[i]
+        self._rewards[idx] = reward_n
+        self._dones[idx] = done_n
+
+    def add(self, obs_t_n, action_n, reward_n, obs_tp1_n, done_n):
+        """Add one joint transition (lists with one entry per agent)."""
+        if self._obs_t is None:
+            self._allocate(obs_t_n, action_n)
+        self._write(self._next_idx, obs_t_n, action_n, reward_n, obs_tp1_n, done_n)
+        self._next_idx = (self._next_idx + 1) % self._maxsize
+        self._size = min(self._size + 1, self._maxsize)
+
+    def add_batch(self, obs_t_n, action_n, reward_n, obs_tp1_n, done_n):
+        """Add a batch of joint transitions: one (B, ...) array per agent, (B, num_agents) rewards/dones."""
+        if self._obs_t is None:
+            self._allocate([obs[0] for obs in obs_t_n], [act[0] for act in action_n])
+        batch_size = len(reward_n)
+        idxes = (self._next_idx + np.arange(batch_size)) % self._maxsize
+        self._write(idxes, obs_t_n, action_n, reward_n, obs_tp1_n, done_n)
+        self._next_idx = (self._next_idx + batch_size) % self._maxsize
+        self._size = min(self._size + batch_size, self._maxsize)
+
+    def make_index(self, batch_size):
+        return randint(self.np_random, self._size, batch_size)
+
+    def sample_index(self, idxes):
+        """Gather a joint batch.
+
+        Returns
+        -------
+        obs_n, act_n, obs_next_n: [np.array]
+            one batch per agent
+        rew_n, done_n: np.array
+            (batch_size, num_agents) rewards and done masks
+        """
+        obs_n = [obs[idxes] for obs in self._obs_t]
+        act_n = [act[idxes] for act in self._actions]
+        obs_next_n = [obs[idxes] for obs in self._obs_tp1]
+        return obs_n, act_n, self._rewards[idxes], obs_next_n, self._dones[idxes]
+
+    def preupdate(self):
+        """Start a new update round (the next `sample_round` draws a fresh batch)."""
+        self._round_batch = None
+
+    def sample_round(self, batch_size):
+        """Joint batch shared by all trainers of the current update round."""
+        if self._round_batch is None:
+            self._round_batch = self.sample_index(self.make_index(batch_size))
+        return self._round_batch
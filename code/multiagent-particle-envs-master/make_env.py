@@ -12,7 +12,7 @@ of size (env.world.dim_p + env.world.dim_c, 1). Physical actions precede
 communication actions in this array. See environment.py for more details.
 """
 
-def make_env(scenario_name, benchmark=False):
+def make_env(scenario_name, benchmark=False, vectorized=False, seed=None):
     '''
     Creates a MultiAgentEnv object as env. This can be used similar to a gym
     environment by calling env.reset() and env.step().
@@ -23,6 +23,10 @@ def make_env(scenario_name, benchmark=False):
                             (without the .py extension)
         benchmark       :   whether you want to produce benchmarking data
                             (usually only done during evaluation)
+        vectorized      :   whether to simulate the world with the array-backed
+                            VectorizedWorld physics (faster with many entities)
+        seed            :   seed of the world's own random stream (noise and
+                            resets); None keeps the global numpy stream
 
     Some useful env properties (see environment.py):
         .observation_space  :   Returns the observation space for each agent
@@ -30,15 +34,49 @@ def make_env(scenario_name, benchmark=False):
         .n                  :   Returns the number of Agents
     '''
     from multiagent.environment import MultiAgentEnv
+    from multiagent.core import VectorizedWorld
     import multiagent.scenarios as scenarios
 
     # load scenario from script
     scenario = scenarios.load(scenario_name + ".py").Scenario()
     # create world
     world = scenario.make_world()
+    if vectorized:
+        world = VectorizedWorld(world)
     # create multiagent environment
     if benchmark:        
-        env = MultiAgentEnv(world, scenario.reset_world, scenario.reward, scenario.observation, scenario.benchmark_data)
+        env = MultiAgentEnv(world, scenario.reset_world, scenario.reward, scenario.observation, scenario.benchmark_data,
+                            observations_callback=scenario.observations_all, rewards_callback=scenario.rewards_all)
     else:
-        env = MultiAgentEnv(world, scenario.reset_world, scenario.reward, scenario.observation)
+        env = MultiAgentEnv(world, scenario.reset_world, scenario.reward, scenario.observation,
+                            observations_callback=scenario.observations_all, rewards_callback=scenario.rewards_all)
+    if seed is not None:
+        env.seed(seed)
+    return env
+
+
+def make_batch_env(scenario_name, num_envs, max_episode_len=None, benchmark=False, seed=None):
+    '''
+    Creates a BatchMultiAgentEnv that simulates num_envs copies of a scenario
+    with a single vectorized physics update per step.
+
+    Input:
+        scenario_name   :   name of the scenario from ./scenarios/ to be Returns
+                            (without the .py extension)
+        num_envs        :   number of environments (B) in the batch
+        max_episode_len :   episodes are finished and reset in place after this
+                            many steps (None: only when all agents are done)
+        benchmark       :   whether you want to produce benchmarking data
+        seed            :   seed from which independent random streams of all
+                            environments are spawned (None: global numpy stream)
+
+    Observations are returned as one (B, obs_dim) array per agent, rewards
+    and dones as (B, n) arrays (see BatchMultiAgentEnv in environment.py).
+    '''
+    from multiagent.environment import BatchMultiAgentEnv
+
+    env_batch = [make_env(scenario_name, benchmark, vectorized=True) for _ in range(num_envs)]
+    env = BatchMultiAgentEnv(env_batch, max_episode_len)
+    if seed is not None:
+        env.seed(seed)
     return env
@@ -0,0 +1,148 @@
+"""
+Throughput benchmark of the scenarios in ./scenarios/.
+
+Measures environment steps per second of every scenario, with the agents of
+the scenario replicated `scale` times, for MultiAgentEnv (World or
+VectorizedWorld physics) and BatchMultiAgentEnv. Results are written as JSON,
+e.g.:
+    python -m multiagent.benchmark --scales 1 4 16 --num-envs 1 8 --output env.json
+Total steps/sec of BatchMultiAgentEnv grow with the batch size, since physics,
+observations and rewards (of scenarios with batched callbacks) are computed
+once for the whole batch:
+    python -m multiagent.benchmark --scales 1 --num-envs 1 4 16 64 --output batch.json
+"""
+import argparse
+import copy
+import json
+import os
+import platform
+import time
+
+import numpy as np
+from gym import spaces
+
+from multiagent.core import VectorizedWorld
+from multiagent.environment import MultiAgentEnv, BatchMultiAgentEnv
+from multiagent.multi_discrete import MultiDiscrete
+import multiagent.scenarios as scenarios
+
+
+# names of all scenarios in ./scenarios/
+def scenario_names():
+    directory = os.path.dirname(scenarios.__file__)
+    return sorted(name[:-3] for name in os.listdir(directory) if name.endswith('.py') and not name.startswith('_'))
+
+# size of the action vectors a policy produces for an action space
+def action_dim(space):
+    if isinstance(space, spaces.Discrete):
+        return space.n
+    if isinstance(space, MultiDiscrete):
+        return int(np.sum(space.high - space.low + 1))
+    return space.shape[0]
+
+# replicate every agent of the world `scale` times (copies follow their original,
+# so that agents of the same role stay next to each other), then reset the world
+def scale_world(scenario, world, scale):
+    if scale > 1:
+        world.agents = [agent if k == 0 else copy.deepcopy(agent) for agent in world.agents for k in range(scale)]
+        for i, agent in enumerate(world.agents):
+            agent.name = 'agent %d' % i
+        scenario.reset_world(world)
+    return world
+
+def make_scaled_env(scenario_name, scale=1, vectorized=False):
+    scenario = scenarios.load(scenario_name + ".py").Scenario()
+    world = scale_world(scenario, scenario.make_world(), scale)
+    if vectorized:
+        world = VectorizedWorld(world)
+    return MultiAgentEnv(world, scenario.reset_world, scenario.reward, scenario.observation,
+                         observations_callback=scenario.observations_all, rewards_callback=scenario.rewards_all)
+
+# environment steps per second with random actions; a single environment is
+# reset every max_episode_len steps, a batch resets its finished episodes in place
+def env_throughput(scenario_name, scale=1, num_envs=1, vectorized=False, num_steps=200, max_episode_len=25, seed=0):
+    np.random.seed(seed)
+    if num_envs > 1:
+        env = BatchMultiAgentEnv([make_scaled_env(scenario_name, scale, vectorized=True) for _ in range(num_envs)],
+                                 max_episode_len)
+        action_shape = (num_envs,)
+    else:
+        env = make_scaled_env(scenario_name, scale, vectorized)
+        action_shape = ()
+    # actions are drawn before timing
+    actions = [np.random.rand(num_steps, *(action_shape + (action_dim(space),))) for space in env.action_space]
+    env.reset()
+    t_start = time.time()
+    for t in range(num_steps):
+        env.step([action[t] for action in actions])
+        if num_envs == 1 and (t + 1) % max_episode_len == 0:
+            env.reset()
+    elapsed = time.time() - t_start
+    world = env.env_batch[0].world if num_envs > 1 else env.world
+    return {
+        'scenario': scenario_name,
+        'scale': scale,
+        'num_agents': env.n,
+        'num_entities': len(world.entities),
+        'num_envs': num_envs,
+        'vectorized': bool(vectorized or num_envs > 1),
+        'num_steps': num_steps,
+        'seconds': elapsed,
+        'steps_per_sec': num_steps * num_envs / elapsed,
+        'agent_steps_per_sec': num_steps * num_envs * env.n / elapsed,
+    }
+
+# benchmark every combination; failures (e.g. scenarios that do not support
+# replicated agents) are recorded instead of aborting the run
+def run_env_suite(scenario_list, scales=(1,), num_envs_list=(1,), vectorized=False, num_steps=200, seed=0, verbose=True):
+    results = []
+    for scenario_name in scenario_list:
+        for scale in scales:
+            for num_envs in num_envs_list:
+                try:
+                    result = env_throughput(scenario_name, scale, num_envs, vectorized, num_steps, seed=seed)
+                except Exception as e:
+                    result = {'scenario': scenario_name, 'scale': scale, 'num_envs': num_envs,
+                              'error': '{}: {}'.format(type(e).__name__, e)}
+                if verbose:
+                    if 'error' in result:
+                        print('{scenario} x{scale} envs={num_envs}: {error}'.format(**result))
+                    else:
+                        print('{scenario} x{scale} (n={num_agents}) envs={num_envs}: {steps_per_sec:.0f} steps/s'.format(**result))
+                results.append(result)
+    return results
+
+def metadata(args=None):
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'args': vars(args) if args is not None else None,
+    }
+
+def write_json(results, path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as fp:
+        json.dump(results, fp, indent=2, sort_keys=True)
+
+def parse_args():
+    parser = argparse.ArgumentParser("Throughput benchmark of the multiagent particle environments")
+    parser.add_argument("--scenarios", type=str, nargs="+", default=None, help="scenario names (default: all)")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 4], help="agent replication factors")
+    parser.add_argument("--num-envs", type=int, nargs="+", default=[1, 4, 16, 64],
+                        help="batch sizes (1: a single MultiAgentEnv); steps/s should grow with the batch size")
+    parser.add_argument("--vectorized", action="store_true", default=False, help="use VectorizedWorld for single environments")
+    parser.add_argument("--num-steps", type=int, default=200, help="timed steps per configuration")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--output", type=str, default="env_benchmark.json", help="JSON file the results are written to")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    results = run_env_suite(args.scenarios or scenario_names(), args.scales, args.num_envs, args.vectorized,
+                            args.num_steps, args.seed)
+    write_json({'meta': metadata(args), 'env': results}, args.output)
@@ -1,7 +1,10 @@
+import itertools
 import numpy as np
 
 # physical/external base state of all entites
 class EntityState(object):
+    __slots__ = ('p_pos', 'p_vel')
+
     def __init__(self):
         # physical position
         self.p_pos = None
@@ -10,13 +13,51 @@ class EntityState(object):
 
 # state of agents (including communication and internal/mental state)
 class AgentState(EntityState):
+    __slots__ = ('c',)
+
     def __init__(self):
         super(AgentState, self).__init__()
         # communication utterance
         self.c = None
 
+# physical state of an entity stored as a row of the world-level arrays of a VectorizedWorld
+# (assignments copy into the shared arrays, so scenarios can keep setting p_pos / p_vel)
+class ArrayEntityState(object):
+    __slots__ = ('_p_pos', '_p_vel')
+
+    def __init__(self, p_pos, p_vel):
+        self._p_pos = p_pos
+        self._p_vel = p_vel
+
+    @property
+    def p_pos(self):
+        return self._p_pos
+
+    @p_pos.setter
+    def p_pos(self, value):
+        self._p_pos[...] = value
+
+    @property
+    def p_vel(self):
+        return self._p_vel
+
+    @p_vel.setter
+    def p_vel(self, value):
+        self._p_vel[...] = value
+
+# array-backed state of agents (communication state is kept per agent)
+class ArrayAgentState(ArrayEntityState):
+    __slots__ = ('c',)
+
+    def __init__(self, p_pos, p_vel):
+        super(ArrayAgentState, self).__init__(p_pos, p_vel)
+        # communication utterance
+        self.c = None
+
 # action of the agent
 class Action(object):
+    __slots__ = ('u', 'c')
+
     def __init__(self):
         # physical action
         self.u = None
@@ -24,7 +65,12 @@ class Action(object):
         self.c = None
 
 # properties and state of physical world entity
+# (all attributes are slots, including those that only the scenarios set, which stay unset until then;
+# a scenario with an attribute of its own declares it in a subclass)
 class Entity(object):
+    __slots__ = ('name', 'size', 'movable', 'collide', 'density', 'color', 'max_speed', 'accel', 'state',
+                 'initial_mass')
+
     def __init__(self):
         # name 
         self.name = ''
@@ -52,11 +98,18 @@ class Entity(object):
 
 # properties of landmark entities
 class Landmark(Entity):
+     # set by scenarios: boundary (simple_tag, simple_world_comm), index (simple_push)
+     __slots__ = ('boundary', 'index')
+
      def __init__(self):
         super(Landmark, self).__init__()
 
 # properties of agent entities
 class Agent(Entity):
+    __slots__ = ('silent', 'blind', 'u_noise', 'c_noise', 'u_range', 'action', 'action_callback',
+                 # set by scenarios
+                 'adversary', 'leader', 'speaker', 'key', 'goal_a', 'goal_b')
+
     def __init__(self):
         super(Agent, self).__init__()
         # agents are movable by default
@@ -78,9 +131,28 @@ class Agent(Entity):
         # script behavior to execute
         self.action_callback = None
 
+# list of agents or landmarks of a world, counting its modifications
+# (so that the world can cache the lists derived from it, see World.entity_lists)
+class EntityList(list):
+    version = 0
+
+def _counting_modifier(method):
+    def modify(self, *args, **kwargs):
+        self.version += 1
+        return method(self, *args, **kwargs)
+    modify.__name__ = method.__name__
+    return modify
+
+for _name in ['__setitem__', '__delitem__', '__iadd__', '__imul__', 'append', 'extend', 'insert', 'pop',
+              'remove', 'clear', 'sort', 'reverse']:
+    setattr(EntityList, _name, _counting_modifier(getattr(list, _name)))
+
 # multi-agent world
 class World(object):
     def __init__(self):
+        # lists derived from agents / landmarks, rebuilt when those change (see entities)
+        self._entity_lists = None
+        self._entity_lists_key = None
         # list of agents and entities (can change at execution-time!)
         self.agents = []
         self.landmarks = []
@@ -97,21 +169,97 @@ class World(object):
         # contact response parameters
         self.contact_force = 1e+2
         self.contact_margin = 1e-3
+        # broadphase collision detection: only entity pairs closer than
+        # size_a + size_b + contact_cutoff * contact_margin are evaluated exactly
+        self.broadphase = False
+        self.contact_cutoff = 20
+        # random stream of the noise and of the scenario's reset_world: the global numpy
+        # stream, or a np.random.Generator of this world once seeded (see seed)
+        self.np_random = np.random
+        # per-step data derived from the current positions (built on demand, see invalidate)
+        self._neighbours = None
+        self._distances = None
+
+    @property
+    def agents(self):
+        return self._agents
+
+    @agents.setter
+    def agents(self, agents):
+        self._agents = EntityList(agents)
+        self._entity_lists_key = None
 
-    # return all entities in the world
+    @property
+    def landmarks(self):
+        return self._landmarks
+
+    @landmarks.setter
+    def landmarks(self, landmarks):
+        self._landmarks = EntityList(landmarks)
+        self._entity_lists_key = None
+
+    # (entities, policy agents, scripted agents), cached until agents or landmarks are modified.
+    # call reset_entity_lists after changing an agent's action_callback
+    def entity_lists(self):
+        key = (self._agents.version, self._landmarks.version)
+        if self._entity_lists_key != key:
+            self._entity_lists = (self._agents + self._landmarks,
+                                  [agent for agent in self._agents if agent.action_callback is None],
+                                  [agent for agent in self._agents if agent.action_callback is not None])
+            self._entity_lists_key = key
+        return self._entity_lists
+
+    def reset_entity_lists(self):
+        self._entity_lists_key = None
+
+    # give the world its own random stream; seed can be anything np.random.default_rng
+    # accepts, e.g. a np.random.SeedSequence spawned for one of many parallel worlds
+    def seed(self, seed=None):
+        self.np_random = np.random.default_rng(seed)
+
+    # return all entities in the world (shared list, do not modify)
     @property
     def entities(self):
-        return self.agents + self.landmarks
+        return self.entity_lists()[0]
 
-    # return all agents controllable by external policies
+    # return all agents controllable by external policies (shared list, do not modify)
     @property
     def policy_agents(self):
-        return [agent for agent in self.agents if agent.action_callback is None]
+        return self.entity_lists()[1]
 
-    # return all agents controlled by world scripts
+    # return all agents controlled by world scripts (shared list, do not modify)
     @property
     def scripted_agents(self):
-        return [agent for agent in self.agents if agent.action_callback is not None]
+        return self.entity_lists()[2]
+
+    # positions and velocities of all entities as (N, dim_p) arrays
+    def state_arrays(self):
+        entities = self.entities
+        p_pos = np.array([entity.state.p_pos for entity in entities], dtype=float).reshape(len(entities), self.dim_p)
+        p_vel = np.array([entity.state.p_vel for entity in entities], dtype=float).reshape(len(entities), self.dim_p)
+        return p_pos, p_vel
+
+    # neighbour structure of the current entity positions (see EntityNeighbours)
+    def neighbours(self):
+        if self._neighbours is None:
+            self._neighbours = EntityNeighbours(self.entities, self.contact_cutoff * self.contact_margin)
+        return self._neighbours
+
+    # pairwise distances of the current entity positions (see EntityDistances)
+    def distances(self):
+        if self._distances is None:
+            self._distances = EntityDistances(self.entities)
+        return self._distances
+
+    # entity properties changed (e.g. by reset_world); World reads them from the entities directly
+    def refresh_properties(self):
+        pass
+
+    # forget derived per-step data. called after integration and on reset; call it
+    # as well after moving entities by hand between steps
+    def invalidate(self):
+        self._neighbours = None
+        self._distances = None
 
     # update state of the world
     def step(self):
@@ -126,32 +274,48 @@ class World(object):
         p_force = self.apply_environment_force(p_force)
         # integrate physical state
         self.integrate_state(p_force)
+        self.invalidate()
         # update agent state
         for agent in self.agents:
             self.update_agent_state(agent)
 
     # gather agent action forces
     def apply_action_force(self, p_force):
+        noise = self.motor_noise()
         # set applied forces
         for i,agent in enumerate(self.agents):
             if agent.movable:
-                noise = np.random.randn(*agent.action.u.shape) * agent.u_noise if agent.u_noise else 0.0
-                p_force[i] = agent.action.u + noise                
+                p_force[i] = agent.action.u if noise is None else agent.action.u + noise[i]
         return p_force
 
+    # physical motor noise of all agents as a (len(agents), dim_p) array, drawn at once
+    # for the movable agents that have u_noise (None if there are none)
+    def motor_noise(self):
+        noisy = [i for i, agent in enumerate(self.agents) if agent.movable and agent.u_noise]
+        if not noisy:
+            return None
+        noise = np.zeros((len(self.agents), self.dim_p))
+        scale = np.array([self.agents[i].u_noise for i in noisy], dtype=float)
+        noise[noisy] = self.np_random.standard_normal((len(noisy), self.dim_p)) * scale[:, None]
+        return noise
+
     # gather physical forces acting on entities
     def apply_environment_force(self, p_force):
-        # simple (but inefficient) collision response
-        for a,entity_a in enumerate(self.entities):
-            for b,entity_b in enumerate(self.entities):
-                if(b <= a): continue
-                [f_a, f_b] = self.get_collision_force(entity_a, entity_b)
-                if(f_a is not None):
-                    if(p_force[a] is None): p_force[a] = 0.0
-                    p_force[a] = f_a + p_force[a] 
-                if(f_b is not None):
-                    if(p_force[b] is None): p_force[b] = 0.0
-                    p_force[b] = f_b + p_force[b]        
+        entities = self.entities
+        if self.broadphase:
+            # only the pairs close enough to be in contact
+            pairs = zip(*self.neighbours().pairs())
+        else:
+            # simple (but inefficient) collision response
+            pairs = ((a, b) for a in range(len(entities)) for b in range(a + 1, len(entities)))
+        for a, b in pairs:
+            [f_a, f_b] = self.get_collision_force(entities[a], entities[b])
+            if(f_a is not None):
+                if(p_force[a] is None): p_force[a] = 0.0
+                p_force[a] = f_a + p_force[a]
+            if(f_b is not None):
+                if(p_force[b] is None): p_force[b] = 0.0
+                p_force[b] = f_b + p_force[b]
         return p_force
 
     # integrate physical state
@@ -173,7 +337,7 @@ class World(object):
         if agent.silent:
             agent.state.c = np.zeros(self.dim_c)
         else:
-            noise = np.random.randn(*agent.action.c.shape) * agent.c_noise if agent.c_noise else 0.0
+            noise = self.np_random.standard_normal(agent.action.c.shape) * agent.c_noise if agent.c_noise else 0.0
             agent.state.c = agent.action.c + noise      
 
     # get collision forces for any contact between two entities
@@ -182,9 +346,15 @@ class World(object):
             return [None, None] # not a collider
         if (entity_a is entity_b):
             return [None, None] # don't collide against itself
-        # compute actual distance between entities
-        delta_pos = entity_a.state.p_pos - entity_b.state.p_pos
-        dist = np.sqrt(np.sum(np.square(delta_pos)))
+        if self.broadphase:
+            # compute actual distance between entities (only few pairs are tested)
+            delta_pos = entity_a.state.p_pos - entity_b.state.p_pos
+            dist = np.sqrt(np.sum(np.square(delta_pos)))
+        else:
+            # actual distance between entities, shared with the other callbacks of this step
+            distances = self.distances()
+            delta_pos = distances.delta_pos(entity_a, entity_b)
+            dist = distances.distance(entity_a, entity_b)
         # minimum allowable distance
         dist_min = entity_a.size + entity_b.size
         # softmax penetration
@@ -193,4 +363,367 @@ class World(object):
         force = self.contact_force * delta_pos / dist * penetration
         force_a = +force if entity_a.movable else None
         force_b = -force if entity_b.movable else None
-        return [force_a, force_b]
\ No newline at end of file
+        return [force_a, force_b]
+
+# pairwise contact forces for stacked entity arrays
+# p_pos: (..., N, dim_p), size / collide: (..., N); returns the (..., N, dim_p) total force on each entity
+# (pairwise delta_pos / dist of p_pos can be passed in when already known)
+def collision_forces(p_pos, size, collide, contact_force, contact_margin, delta_pos=None, dist=None):
+    # compute actual distance between all pairs of entities
+    if delta_pos is None:
+        delta_pos = p_pos[..., :, None, :] - p_pos[..., None, :, :]
+        dist = np.sqrt(np.sum(np.square(delta_pos), axis=-1))
+    # minimum allowable distance
+    dist_min = size[..., :, None] + size[..., None, :]
+    # softmax penetration
+    k = contact_margin
+    penetration = np.logaddexp(0, -(dist - dist_min)/k)*k
+    # only colliders interact, and never with themselves
+    pairs = collide[..., :, None] & collide[..., None, :]
+    pairs &= ~np.eye(p_pos.shape[-2], dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = np.where(pairs, contact_force * penetration / dist, 0.0)
+    return np.sum(scale[..., None] * delta_pos, axis=-2)
+
+# integrate stacked entity arrays in place
+# p_pos / p_vel / p_force: (..., N, dim_p), mass / movable / max_speed: (..., N) (max_speed is inf when unbounded)
+def integrate_arrays(p_pos, p_vel, p_force, mass, movable, max_speed, dt, damping):
+    p_vel_new = p_vel * (1 - damping) + (p_force / mass[..., None]) * dt
+    speed = np.sqrt(np.sum(np.square(p_vel_new), axis=-1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = np.where(speed > max_speed, max_speed / speed, 1.0)
+    p_vel_new *= scale[..., None]
+    movable = movable[..., None]
+    p_vel[...] = np.where(movable, p_vel_new, p_vel)
+    p_pos += np.where(movable, p_vel * dt, 0.0)
+
+# broadphase: pairs (i < j) of points closer than radius[i] + radius[j], found with a uniform grid
+# p_pos: (N, dim_p), radius: (N,); returns two index arrays sorted by (i, j)
+def neighbour_pairs(p_pos, radius):
+    n, dim_p = p_pos.shape
+    if n < 2:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    # cells at least as wide as the largest interaction range, so only adjacent cells can interact
+    cell_size = max(2.0 * np.max(radius), 1e-8)
+    cell = np.floor(p_pos / cell_size).astype(np.int64)
+    # linear cell keys over the occupied box, padded by one cell on each side
+    cell -= cell.min(axis=0) - 1
+    extent = cell.max(axis=0) + 2
+    strides = np.cumprod(np.concatenate([[1], extent[:-1]]))
+    key = cell.dot(strides)
+    order = np.argsort(key, kind='stable')
+    sorted_key = key[order]
+    pair_i, pair_j = [], []
+    for offset in itertools.product([-1, 0, 1], repeat=dim_p):
+        target = key + np.dot(offset, strides)
+        start = np.searchsorted(sorted_key, target, side='left')
+        count = np.searchsorted(sorted_key, target, side='right') - start
+        # all (entity, candidate) combinations of this offset
+        i = np.repeat(np.arange(n), count)
+        first = np.cumsum(count) - count
+        j = order[np.arange(len(i)) - np.repeat(first, count) + np.repeat(start, count)]
+        keep = i < j
+        pair_i.append(i[keep])
+        pair_j.append(j[keep])
+    i = np.concatenate(pair_i)
+    j = np.concatenate(pair_j)
+    # exact test of the candidates
+    dist = np.sqrt(np.sum(np.square(p_pos[i] - p_pos[j]), axis=-1))
+    keep = dist < radius[i] + radius[j]
+    i, j = i[keep], j[keep]
+    order = np.lexsort((j, i))
+    return i[order], j[order]
+
+# contact forces of the given entity pairs (e.g. from neighbour_pairs)
+# p_pos: (N, dim_p), size: (N,); returns the (N, dim_p) total force on each entity
+def pair_collision_forces(p_pos, size, i, j, contact_force, contact_margin):
+    # compute actual distance between entities
+    delta_pos = p_pos[i] - p_pos[j]
+    dist = np.sqrt(np.sum(np.square(delta_pos), axis=-1))
+    # minimum allowable distance
+    dist_min = size[i] + size[j]
+    # softmax penetration
+    k = contact_margin
+    penetration = np.logaddexp(0, -(dist - dist_min)/k)*k
+    force = (contact_force * penetration / dist)[:, None] * delta_pos
+    p_force = np.zeros_like(p_pos)
+    np.add.at(p_force, i, force)
+    np.add.at(p_force, j, -force)
+    return p_force
+
+# pairwise geometry of a set of entities: position differences, distances and overlaps of all pairs.
+# computed once per step and shared by physics, reward and observation callbacks.
+# positions (and sizes) may have a leading batch axis, for the worlds of a BatchWorld
+class EntityDistances(object):
+    def __init__(self, entities, p_pos=None, size=None):
+        self.entities = entities
+        self.index = dict((id(entity), k) for k, entity in enumerate(entities))
+        if p_pos is None:
+            p_pos = np.array([entity.state.p_pos for entity in entities], dtype=float).reshape(len(entities), -1)
+        # positions, shape ([B,] N, dim_p)
+        self.p_pos = np.array(p_pos)
+        # delta[i, j] = p_pos[i] - p_pos[j], shape ([B,] N, N, dim_p)
+        self.delta = self.p_pos[..., :, None, :] - self.p_pos[..., None, :, :]
+        # dist[i, j] = |p_pos[i] - p_pos[j]|, shape ([B,] N, N)
+        self.dist = np.sqrt(np.sum(np.square(self.delta), axis=-1))
+        # collision[i, j]: entities closer than the sum of their sizes (every entity overlaps itself)
+        self.size = np.array([entity.size for entity in entities], dtype=float) if size is None else size
+        self.collision = self.dist < self.size[..., :, None] + self.size[..., None, :]
+
+    # p_pos of entity_a minus p_pos of entity_b
+    def delta_pos(self, entity_a, entity_b):
+        return self.delta[..., self.index[id(entity_a)], self.index[id(entity_b)], :]
+
+    def distance(self, entity_a, entity_b):
+        return self.dist[..., self.index[id(entity_a)], self.index[id(entity_b)]]
+
+    # same test as the scenarios' is_collision
+    def is_collision(self, entity_a, entity_b):
+        return self.collision[..., self.index[id(entity_a)], self.index[id(entity_b)]]
+
+# neighbour structure of a set of entities: all pairs closer than size_a + size_b + margin.
+# built once from the current positions and shared by physics and scenario callbacks.
+class EntityNeighbours(object):
+    def __init__(self, entities, margin=0.0, p_pos=None):
+        self.entities = entities
+        self.margin = margin
+        self.index = dict((id(entity), k) for k, entity in enumerate(entities))
+        if p_pos is None:
+            p_pos = np.array([entity.state.p_pos for entity in entities], dtype=float).reshape(len(entities), -1)
+        self.p_pos = p_pos
+        self.size = np.array([entity.size for entity in entities], dtype=float)
+        self.i, self.j = neighbour_pairs(p_pos, self.size + 0.5 * margin)
+        self.dist = np.sqrt(np.sum(np.square(p_pos[self.i] - p_pos[self.j]), axis=-1))
+        self._dist = dict(zip(zip(self.i.tolist(), self.j.tolist()), self.dist.tolist()))
+
+    # index arrays (i < j) of the neighbouring entity pairs
+    def pairs(self):
+        return self.i, self.j
+
+    # distance between two entities, or inf if they are not neighbours
+    def distance(self, entity_a, entity_b):
+        a, b = self.index[id(entity_a)], self.index[id(entity_b)]
+        if a > b:
+            a, b = b, a
+        return self._dist.get((a, b), np.inf)
+
+    # whether two entities are closer than dist (exact, also beyond the neighbour range)
+    def within(self, entity_a, entity_b, dist):
+        if dist <= entity_a.size + entity_b.size + self.margin:
+            return self.distance(entity_a, entity_b) < dist
+        return np.sqrt(np.sum(np.square(entity_a.state.p_pos - entity_b.state.p_pos))) < dist
+
+    # whether two entities overlap (same test as the scenarios' is_collision)
+    def overlapping(self, entity_a, entity_b):
+        return self.within(entity_a, entity_b, entity_a.size + entity_b.size)
+
+    # entities neighbouring the given one
+    def neighbours_of(self, entity):
+        k = self.index[id(entity)]
+        return [self.entities[j] for j in self.j[self.i == k]] + [self.entities[i] for i in self.i[self.j == k]]
+
+# multi-agent world that keeps the physical state of all entities in contiguous (N, dim_p) arrays
+# and runs collision response and integration as batched array operations.
+# entity states are replaced by views into these arrays, so scenario callbacks work unchanged.
+class VectorizedWorld(World):
+    def __init__(self, world=None):
+        super(VectorizedWorld, self).__init__()
+        # adopt the entities and settings of an already built world
+        if world is not None:
+            self.__dict__.update(world.__dict__)
+        # entities the arrays below were laid out for
+        self._bound_entities = []
+        # physical state, shape (N, dim_p)
+        self.p_pos = None
+        self.p_vel = None
+        # entity properties, shape (N,)
+        self.entity_mass = None
+        self.entity_size = None
+        self.entity_movable = None
+        self.entity_collide = None
+        self.entity_max_speed = None
+        self.bind()
+
+    # lay out entity states in the world arrays (again, if the set of entities changed)
+    def bind(self, p_pos=None, p_vel=None):
+        entities = self.entities
+        bound = self._bound_entities
+        # the cached entity list is only rebuilt when agents or landmarks were modified,
+        # so this is a single identity check per step
+        if p_pos is None and entities is bound:
+            return
+        if p_pos is None and len(entities) == len(bound) and all(a is b for a, b in zip(entities, bound)):
+            self._bound_entities = entities
+            self.refresh_properties()
+            return
+        self.invalidate()
+        shape = (len(entities), self.dim_p)
+        # state arrays may be provided by the caller (e.g. slices of a larger batch)
+        self.p_pos = np.zeros(shape) if p_pos is None else p_pos
+        self.p_vel = np.zeros(shape) if p_vel is None else p_vel
+        for i, entity in enumerate(entities):
+            state = entity.state
+            if state.p_pos is not None:
+                self.p_pos[i] = state.p_pos
+            if state.p_vel is not None:
+                self.p_vel[i] = state.p_vel
+            if isinstance(state, ArrayEntityState):
+                state._p_pos = self.p_pos[i]
+                state._p_vel = self.p_vel[i]
+            elif isinstance(state, AgentState):
+                entity.state = ArrayAgentState(self.p_pos[i], self.p_vel[i])
+                entity.state.c = state.c
+            else:
+                entity.state = ArrayEntityState(self.p_pos[i], self.p_vel[i])
+        self._bound_entities = entities
+        self.refresh_properties()
+
+    # copy entity properties into the world arrays. done when the entities change and on
+    # environment reset; call it as well after changing e.g. an entity's size by hand
+    def refresh_properties(self):
+        entities = self._bound_entities
+        self.entity_mass = np.array([entity.mass for entity in entities], dtype=float)
+        self.entity_size = np.array([entity.size for entity in entities], dtype=float)
+        self.entity_movable = np.array([entity.movable for entity in entities], dtype=bool)
+        self.entity_collide = np.array([entity.collide for entity in entities], dtype=bool)
+        self.entity_max_speed = np.array([np.inf if entity.max_speed is None else entity.max_speed
+                                          for entity in entities], dtype=float)
+
+    # update state of the world
+    def step(self):
+        self.bind()
+        # set actions for scripted agents
+        for agent in self.scripted_agents:
+            agent.action = agent.action_callback(agent, self)
+        # gather forces applied to entities
+        p_force = np.zeros_like(self.p_pos)
+        # apply agent physical controls
+        p_force = self.apply_action_force(p_force)
+        # apply environment forces
+        p_force = self.apply_environment_force(p_force)
+        # integrate physical state
+        self.integrate_state(p_force)
+        self.invalidate()
+        # update agent state
+        for agent in self.agents:
+            self.update_agent_state(agent)
+
+    # positions and velocities of all entities (the world arrays themselves, do not modify)
+    def state_arrays(self):
+        self.bind()
+        return self.p_pos, self.p_vel
+
+    # pairwise distances of the current entity positions (see EntityDistances)
+    def distances(self):
+        if self._distances is None:
+            self.bind()
+            self._distances = EntityDistances(self.entities, self.p_pos)
+        return self._distances
+
+    # neighbour structure of the current entity positions (see EntityNeighbours)
+    def neighbours(self):
+        if self._neighbours is None:
+            self.bind()
+            self._neighbours = EntityNeighbours(self.entities, self.contact_cutoff * self.contact_margin, self.p_pos)
+        return self._neighbours
+
+    # gather physical forces acting on entities
+    def apply_environment_force(self, p_force):
+        if self.broadphase:
+            i, j = self.contact_pairs()
+            p_force += pair_collision_forces(self.p_pos, self.entity_size, i, j,
+                                             self.contact_force, self.contact_margin)
+            return p_force
+        distances = self.distances()
+        p_force += collision_forces(self.p_pos, self.entity_size, self.entity_collide,
+                                    self.contact_force, self.contact_margin, distances.delta, distances.dist)
+        return p_force
+
+    # neighbouring pairs of colliding entities
+    def contact_pairs(self):
+        i, j = self.neighbours().pairs()
+        keep = self.entity_collide[i] & self.entity_collide[j]
+        return i[keep], j[keep]
+
+    # integrate physical state
+    def integrate_state(self, p_force):
+        integrate_arrays(self.p_pos, self.p_vel, p_force, self.entity_mass, self.entity_movable,
+                         self.entity_max_speed, self.dt, self.damping)
+
+# batch of B worlds of the same scenario whose physical state is stored as (B, N, dim_p) arrays,
+# so that all of them are advanced with a single vectorized physics update.
+# the batch also serves as a world for the scenarios' batched callbacks (observations_all / rewards_all):
+# state_arrays and distances cover all worlds with a leading batch axis, while the entity lists and
+# settings are those of the first world (see __getattr__).
+# (assumes no entities are created/destroyed at runtime)
+class BatchWorld(object):
+    def __init__(self, worlds):
+        self.worlds = [world if isinstance(world, VectorizedWorld) else VectorizedWorld(world) for world in worlds]
+        world = self.worlds[0]
+        shape = (len(self.worlds), len(world.entities), world.dim_p)
+        self.p_pos = np.zeros(shape)
+        self.p_vel = np.zeros(shape)
+        for b, world in enumerate(self.worlds):
+            world.bind(self.p_pos[b], self.p_vel[b])
+        # pairwise geometry of all worlds (built on demand, see invalidate)
+        self._distances = None
+
+    # entity lists and settings (agents, landmarks, dim_p, ...) of the first world
+    def __getattr__(self, name):
+        if name == 'worlds':
+            raise AttributeError(name)
+        return getattr(self.worlds[0], name)
+
+    # positions and velocities of all worlds, shape (B, N, dim_p) (the batch arrays themselves, do not modify)
+    def state_arrays(self):
+        return self.p_pos, self.p_vel
+
+    # pairwise distances of the current entity positions of all worlds (see EntityDistances)
+    def distances(self):
+        if self._distances is None:
+            self._distances = EntityDistances(self.worlds[0].entities, self.p_pos,
+                                              np.stack([w.entity_size for w in self.worlds]))
+        return self._distances
+
+    # forget derived per-step data, also of the worlds. call it after resetting any of the worlds
+    def invalidate(self):
+        self._distances = None
+        for w in self.worlds:
+            w.invalidate()
+
+    # update state of all worlds
+    def step(self):
+        world = self.worlds[0]
+        p_force = np.zeros_like(self.p_pos)
+        for b, w in enumerate(self.worlds):
+            w.bind()
+            # set actions for scripted agents
+            for agent in w.scripted_agents:
+                agent.action = agent.action_callback(agent, w)
+            # apply agent physical controls
+            w.apply_action_force(p_force[b])
+        # apply environment forces
+        if world.broadphase:
+            # contact pairs of all worlds, as indices into the flattened (B * N, dim_p) arrays
+            num_entities = self.p_pos.shape[1]
+            pairs = [w.contact_pairs() for w in self.worlds]
+            i = np.concatenate([i + b * num_entities for b, (i, _) in enumerate(pairs)])
+            j = np.concatenate([j + b * num_entities for b, (_, j) in enumerate(pairs)])
+            p_force += pair_collision_forces(self.p_pos.reshape(-1, world.dim_p),
+                                             np.concatenate([w.entity_size for w in self.worlds]), i, j,
+                                             world.contact_force, world.contact_margin).reshape(p_force.shape)
+        else:
+            p_force += collision_forces(self.p_pos, np.stack([w.entity_size for w in self.worlds]),
+                                        np.stack([w.entity_collide for w in self.worlds]),
+                                        world.contact_force, world.contact_margin)
+        # integrate physical state
+        integrate_arrays(self.p_pos, self.p_vel, p_force,
+                         np.stack([w.entity_mass for w in self.worlds]),
+                         np.stack([w.entity_movable for w in self.worlds]),
+                         np.stack([w.entity_max_speed for w in self.worlds]),
+                         world.dt, world.damping)
+        self.invalidate()
+        # update agent state
+        for w in self.worlds:
+            for agent in w.agents:
+                w.update_agent_state(agent)
@@ -3,6 +3,7 @@ from gym import spaces
 from gym.envs.registration import EnvSpec
 import numpy as np
 from multiagent.multi_discrete import MultiDiscrete
+from multiagent.core import BatchWorld
 
 # environment for all agents in the multiagent world
 # currently code assumes that no agents will be created/destroyed at runtime!
@@ -13,7 +14,8 @@ class MultiAgentEnv(gym.Env):
 
     def __init__(self, world, reset_callback=None, reward_callback=None,
                  observation_callback=None, info_callback=None,
-                 done_callback=None, shared_viewer=True):
+                 done_callback=None, shared_viewer=True,
+                 observations_callback=None, rewards_callback=None):
 
         self.world = world
         self.agents = self.world.policy_agents
@@ -25,6 +27,9 @@ class MultiAgentEnv(gym.Env):
         self.observation_callback = observation_callback
         self.info_callback = info_callback
         self.done_callback = done_callback
+        # optional batched callbacks computing all agents' observations / rewards at once
+        self.observations_callback = observations_callback
+        self.rewards_callback = rewards_callback
         # environment parameters
         self.discrete_action_space = True
         # if true, action is a number 0...N, otherwise action is a one-hot N-dimensional vector
@@ -33,6 +38,8 @@ class MultiAgentEnv(gym.Env):
         self.force_discrete_action = world.discrete_action if hasattr(world, 'discrete_action') else False
         # if true, every agent has the same reward
         self.shared_reward = world.collaborative if hasattr(world, 'collaborative') else False
+        # batched action decoding (built on first use, see _set_actions)
+        self._action_decoder = None
         self.time = 0
 
         # configure spaces
@@ -84,14 +91,15 @@ class MultiAgentEnv(gym.Env):
         info_n = {'n': []}
         self.agents = self.world.policy_agents
         # set action for each agent
-        for i, agent in enumerate(self.agents):
-            self._set_action(action_n[i], agent, self.action_space[i])
+        self._set_actions(action_n)
         # advance world state
         self.world.step()
         # record observation for each agent
-        for agent in self.agents:
-            obs_n.append(self._get_obs(agent))
-            reward_n.append(self._get_reward(agent))
+        obs_all = self._get_obs_all()
+        reward_all = self._get_reward_all()
+        for i, agent in enumerate(self.agents):
+            obs_n.append(self._get_obs(agent) if obs_all is None else obs_all[i])
+            reward_n.append(self._get_reward(agent) if reward_all is None else reward_all[i])
             done_n.append(self._get_done(agent))
 
             info_n['n'].append(self._get_info(agent))
@@ -103,18 +111,32 @@ class MultiAgentEnv(gym.Env):
 
         return obs_n, reward_n, done_n, info_n
 
+    # seed the random stream of the world (noise and reset_world), see World.seed
+    def seed(self, seed=None):
+        self.world.seed(seed)
+        return [seed]
+
     def reset(self):
-        # reset world
-        self.reset_callback(self.world)
-        # reset renderer
-        self._reset_render()
+        self._reset_world()
         # record observations for each agent
+        obs_n = self._get_obs_all()
+        if obs_n is not None:
+            return list(obs_n)
         obs_n = []
-        self.agents = self.world.policy_agents
         for agent in self.agents:
             obs_n.append(self._get_obs(agent))
         return obs_n
 
+    # reset the world and the renderer (everything but the observations of reset)
+    def _reset_world(self):
+        # reset world
+        self.reset_callback(self.world)
+        self.world.refresh_properties()
+        self.world.invalidate()
+        # reset renderer
+        self._reset_render()
+        self.agents = self.world.policy_agents
+
     # get info used for benchmarking
     def _get_info(self, agent):
         if self.info_callback is None:
@@ -127,6 +149,18 @@ class MultiAgentEnv(gym.Env):
             return np.zeros(0)
         return self.observation_callback(agent, self.world)
 
+    # get observations for all agents at once (None if the scenario has no batched callback)
+    def _get_obs_all(self):
+        if self.observations_callback is None:
+            return None
+        return self.observations_callback(self.world)
+
+    # get rewards for all agents at once (None if the scenario has no batched callback)
+    def _get_reward_all(self):
+        if self.rewards_callback is None:
+            return None
+        return self.rewards_callback(self.world)
+
     # get dones for a particular agent
     # unused right now -- agents are allowed to go beyond the viewing screen
     def _get_done(self, agent):
@@ -140,8 +174,24 @@ class MultiAgentEnv(gym.Env):
             return 0.0
         return self.reward_callback(agent, self.world)
 
+    # set env actions for all policy agents at once (see ActionDecoder); action_n is a
+    # (n, act_dim) array or one flat action per agent. falls back to _set_action for
+    # discrete action input
+    def _set_actions(self, action_n):
+        if self.discrete_action_input:
+            for i, agent in enumerate(self.agents):
+                self._set_action(action_n[i], agent, self.action_space[i])
+            return
+        decoder = self._action_decoder
+        if decoder is None or not decoder.matches(self):
+            decoder = self._action_decoder = ActionDecoder(self)
+        decoder.decode(action_n)
+
     # set env action for a particular agent
     def _set_action(self, action, agent, action_space, time=None):
+        if self._action_decoder is not None:
+            # the agent's action no longer is a view of the decoder buffers
+            self._action_decoder.bound = False
         agent.action.u = np.zeros(self.world.dim_p)
         agent.action.c = np.zeros(self.world.dim_c)
         # process action
@@ -283,20 +333,93 @@ class MultiAgentEnv(gym.Env):
         return dx
 
 
+# decodes the flat actions of all policy agents of a MultiAgentEnv at once, as _set_action does
+# for one agent (one-hot discrete, force_discrete_action and continuous action spaces).
+# forces and communication vectors are written into preallocated (n, dim_p) / (n, dim_c)
+# buffers, whose rows are the agents' Action.u / Action.c. the given actions are not modified.
+class ActionDecoder(object):
+    def __init__(self, env):
+        world = env.world
+        self.agents = list(env.agents)
+        self.discrete_action_space = env.discrete_action_space
+        self.force_discrete_action = env.force_discrete_action
+        n = len(self.agents)
+        # layout of the flat actions: physical action first (if movable), then communication (if not silent)
+        u_dim = world.dim_p * 2 + 1 if self.discrete_action_space else world.dim_p
+        self.movable = np.flatnonzero([agent.movable for agent in self.agents])
+        self.speaking = np.flatnonzero([not agent.silent for agent in self.agents])
+        self.u_index = np.arange(u_dim)[None, :]
+        c_start = np.array([u_dim if agent.movable else 0 for agent in self.agents], dtype=int)
+        self.c_index = c_start[self.speaking, None] + np.arange(world.dim_c)[None, :]
+        self.act_dim = c_start + np.array([0 if agent.silent else world.dim_c for agent in self.agents], dtype=int)
+        self.sensitivity = np.array([5.0 if agent.accel is None else agent.accel for agent in self.agents])[self.movable, None]
+        # action buffers
+        self.u = np.zeros((n, world.dim_p))
+        self.c = np.zeros((n, world.dim_c))
+        self.bound = False
+
+    # whether the decoder was built for the current agents and action settings of env
+    def matches(self, env):
+        return (self.agents == env.agents and self.discrete_action_space == env.discrete_action_space
+                and self.force_discrete_action == env.force_discrete_action)
+
+    # make the agents' actions views of the buffers
+    def bind(self):
+        for i, agent in enumerate(self.agents):
+            agent.action.u = self.u[i]
+            agent.action.c = self.c[i]
+        self.bound = True
+
+    # stack per-agent actions into one (n, max act_dim) array
+    def stack(self, action_n):
+        if isinstance(action_n, np.ndarray) and action_n.ndim == 2:
+            return action_n
+        action = np.zeros((len(self.agents), np.max(self.act_dim)))
+        for i, (act, dim) in enumerate(zip(action_n, self.act_dim)):
+            action[i, :dim] = act
+        return action
+
+    def decode(self, action_n):
+        if not self.bound:
+            self.bind()
+        action = self.stack(action_n)
+        # physical action
+        u = action[self.movable[:, None], self.u_index]
+        if self.force_discrete_action:
+            u = (self.u_index == np.argmax(u, axis=1)[:, None]).astype(float)
+        if self.discrete_action_space:
+            u = u[:, 1::2] - u[:, 2::2]
+        self.u[:] = 0.0
+        self.u[self.movable] = u * self.sensitivity
+        # communication action
+        self.c[:] = 0.0
+        self.c[self.speaking] = action[self.speaking[:, None], self.c_index]
+
+
 # vectorized wrapper for a batch of multi-agent environments
-# assumes all environments have the same observation and action space
+# assumes all environments are built from the same scenario (same agents, observation and action spaces).
+# the worlds are stepped together as one (B, N, dim_p) array by a BatchWorld, observations are
+# returned per agent as (B, obs_dim) arrays and finished episodes are reset in place.
 class BatchMultiAgentEnv(gym.Env):
     metadata = {
         'runtime.vectorized': True,
         'render.modes' : ['human', 'rgb_array']
     }
 
-    def __init__(self, env_batch):
+    def __init__(self, env_batch, max_episode_len=None):
         self.env_batch = env_batch
-
+        self.num_envs = len(env_batch)
+        # episodes are also finished (and reset) after this many steps
+        self.max_episode_len = max_episode_len
+        self.world = BatchWorld([env.world for env in env_batch])
+        for env, world in zip(self.env_batch, self.world.worlds):
+            env.world = world
+        self.episode_step = np.zeros(self.num_envs, dtype=np.int64)
+
+    # number of agents in each environment
     @property
     def n(self):
-        return np.sum([env.n for env in self.env_batch])
+        return self.env_batch[0].n
 
     @property
     def action_space(self):
@@ -306,30 +429,83 @@ class BatchMultiAgentEnv(gym.Env):
     def observation_space(self):
         return self.env_batch[0].observation_space
 
-    def step(self, action_n, time):
-        obs_n = []
-        reward_n = []
-        done_n = []
+    # action_n holds one (B, action_dim) array per agent.
+    # returns obs_n as one (B, obs_dim) array per agent, and (B, n) reward / done arrays.
+    # info_n['terminal'] flags the environments that finished an episode in this step and were reset:
+    # for those obs_n already holds the first observation of the next episode, while
+    # info_n['terminal_obs_n'] holds the observations each environment actually ended the step in.
+    def step(self, action_n):
+        for b, env in enumerate(self.env_batch):
+            env.agents = env.world.policy_agents
+            env._set_actions([action[b] for action in action_n])
+        # advance all worlds at once
+        self.world.step()
+        self.episode_step += 1
+        obs_n = self._get_obs()
+        reward_n = self._get_reward()
+        done_n = np.zeros((self.num_envs, self.n), dtype=bool)
         info_n = {'n': []}
-        i = 0
-        for env in self.env_batch:
-            obs, reward, done, _ = env.step(action_n[i:(i+env.n)], time)
-            i += env.n
-            obs_n += obs
-            # reward = [r / len(self.env_batch) for r in reward]
-            reward_n += reward
-            done_n += done
+        for b, env in enumerate(self.env_batch):
+            if env.done_callback is not None:
+                done_n[b] = [env._get_done(agent) for agent in env.agents]
+            info_n['n'].append([env._get_info(agent) for agent in env.agents])
+        terminal = np.all(done_n, axis=1)
+        if self.max_episode_len is not None:
+            terminal |= self.episode_step >= self.max_episode_len
+        info_n['terminal'] = terminal
+        info_n['terminal_obs_n'] = [obs.copy() for obs in obs_n]
+        # reset finished episodes in place
+        if np.any(terminal):
+            for i, obs in enumerate(self._reset(np.flatnonzero(terminal))):
+                obs_n[i][terminal] = obs[terminal]
         return obs_n, reward_n, done_n, info_n
 
+    # give every environment of the batch an independent random stream spawned from seed
+    def seed(self, seed=None):
+        for env, env_seed in zip(self.env_batch, np.random.SeedSequence(seed).spawn(self.num_envs)):
+            env.seed(env_seed)
+        return [seed]
+
     def reset(self):
-        obs_n = []
-        for env in self.env_batch:
-            obs_n += env.reset()
+        self.episode_step[:] = 0
+        return self._reset(range(self.num_envs))
+
+    # reset the given environments and return the observations of the whole batch
+    def _reset(self, indices):
+        for b in indices:
+            self.env_batch[b]._reset_world()
+            self.episode_step[b] = 0
+        self.world.invalidate()
+        return self._get_obs()
+
+    # observations of all environments, one (B, obs_dim) array per agent. a scenario's batched
+    # observation callback is called once for the whole batch (see BatchWorld)
+    def _get_obs(self):
+        env = self.env_batch[0]
+        if env.observations_callback is not None:
+            return [np.array(obs, dtype=float) for obs in env.observations_callback(self.world)]
+        obs_n = [np.zeros((self.num_envs,) + space.shape) for space in self.observation_space]
+        for b, env in enumerate(self.env_batch):
+            for i, agent in enumerate(env.agents):
+                obs_n[i][b] = env._get_obs(agent)
         return obs_n
 
+    # (B, n) rewards of all environments, with the batched reward callback if the scenario has one
+    def _get_reward(self):
+        env = self.env_batch[0]
+        if env.rewards_callback is not None:
+            reward_n = np.stack(env.rewards_callback(self.world), axis=1).astype(float)
+        else:
+            reward_n = np.array([[env._get_reward(agent) for agent in env.agents] for env in self.env_batch],
+                                dtype=float).reshape(self.num_envs, self.n)
+        # all agents get total reward in cooperative case
+        if env.shared_reward:
+            reward_n[:] = np.sum(reward_n, axis=1, keepdims=True)
+        return reward_n
+
     # render environment
-    def render(self, mode='human', close=True):
+    def render(self, mode='human'):
         results_n = []
         for env in self.env_batch:
-            results_n += env.render(mode, close)
+            results_n += env.render(mode)
         return results_n
@@ -1,4 +1,5 @@
 import numpy as np
+from multiagent.core import BatchWorld
 
 # defines scenario upon which the world is built
 class BaseScenario(object):
@@ -8,3 +9,73 @@ class BaseScenario(object):
     # create initial conditions of the world
     def reset_world(self, world):
         raise NotImplementedError()
+    # optional batched callbacks: observations_all(world) / rewards_all(world) return the
+    # observation / reward of every policy agent at once, replacing the per-agent callbacks.
+    # they are also called with a BatchWorld, for all worlds of a batch at once: they then return
+    # per agent a (B, obs_dim) observation / (B,) reward array. they are written over arrays with a
+    # leading batch axis (see batch_state_arrays, batch_distances, world_values and agent_entries)
+    observations_all = None
+    rewards_all = None
+
+# worlds of a batch, or the single world
+def _worlds(world):
+    return world.worlds if isinstance(world, BatchWorld) else [world]
+
+# positions and velocities of a world or of a batch of worlds: shape (B, N, dim_p), B = 1 for a single world
+def batch_state_arrays(world):
+    p_pos, p_vel = world.state_arrays()
+    if isinstance(world, BatchWorld):
+        return p_pos, p_vel
+    return p_pos[None], p_vel[None]
+
+# pairwise geometry of a world or of a batch of worlds (see EntityDistances):
+# delta (B, N, N, dim_p), dist (B, N, N) and collision (B, N, N), B = 1 for a single world
+def batch_distances(world):
+    distances = world.distances()
+    if isinstance(world, BatchWorld):
+        return distances.delta, distances.dist, distances.collision
+    return distances.delta[None], distances.dist[None], distances.collision[None]
+
+# fn(w) of every world w of a batch (properties that differ between worlds, e.g. colors or goals): shape (B, ...)
+def world_values(world, fn):
+    return np.stack([np.asarray(fn(w)) for w in _worlds(world)])
+
+# results of a batched callback, per agent: values is a (B, n, ...) array or a list of n (B, ...) arrays.
+# a batch of worlds gets the (B, ...) arrays, a single world the values of its only batch entry
+def agent_entries(world, values):
+    if isinstance(values, np.ndarray):
+        values = list(np.swapaxes(values, 0, 1))
+    if isinstance(world, BatchWorld):
+        return values
+    return [value[0] for value in values]
+
+# entries m[:, i, j], j != i, of a (B, n, n, ...) array: shape (B, n, n - 1, ...)
+def off_diagonal(m):
+    n = m.shape[1]
+    return m[:, ~np.eye(n, dtype=bool)].reshape((m.shape[0], n, n - 1) + m.shape[3:])
+
+# rows of x (B, n, ...) as seen by each of n agents, without its own row: shape (B, n, n - 1, ...)
+def others(x):
+    n = x.shape[1]
+    return off_diagonal(np.broadcast_to(x[:, None], (x.shape[0], n) + x.shape[1:]))
+
+# penalty for leaving the screen, per coordinate
+def bound_penalty(x):
+    x = np.abs(x)
+    # exp(2 * x - 2) is above 10 (clipped) beyond 2 * x - 2 = 3
+    return np.where(x < 0.9, 0.0, np.where(x < 1.0, (x - 0.9) * 10, np.minimum(np.exp(np.minimum(2 * x - 2, 3)), 10)))
+
+# distances between agents and entities: shape (B, n_agents, n_entities)
+def pair_distances(world, agents, entities):
+    return _block(world, batch_distances(world)[1], agents, entities)
+
+# is_collision between agents and entities: shape (B, n_agents, n_entities)
+def pair_collisions(world, agents, entities):
+    return _block(world, batch_distances(world)[2], agents, entities)
+
+# (agents, entities) block of a (B, N, N) array
+def _block(world, m, agents, entities):
+    index = world.distances().index
+    rows = [index[id(agent)] for agent in agents]
+    cols = [index[id(entity)] for entity in entities]
+    return m[:, rows][:, :, cols]
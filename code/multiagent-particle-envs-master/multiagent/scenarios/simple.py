@@ -1,6 +1,6 @@
 import numpy as np
 from multiagent.core import World, Agent, Landmark
-from multiagent.scenario import BaseScenario
+from multiagent.scenario import BaseScenario, batch_state_arrays, agent_entries
 
 class Scenario(BaseScenario):
     def make_world(self):
@@ -31,11 +31,11 @@ class Scenario(BaseScenario):
         world.landmarks[0].color = np.array([0.75,0.25,0.25])
         # set random initial states
         for agent in world.agents:
-            agent.state.p_pos = np.random.uniform(-1,+1, world.dim_p)
+            agent.state.p_pos = world.np_random.uniform(-1,+1, world.dim_p)
             agent.state.p_vel = np.zeros(world.dim_p)
             agent.state.c = np.zeros(world.dim_c)
         for i, landmark in enumerate(world.landmarks):
-            landmark.state.p_pos = np.random.uniform(-1,+1, world.dim_p)
+            landmark.state.p_pos = world.np_random.uniform(-1,+1, world.dim_p)
             landmark.state.p_vel = np.zeros(world.dim_p)
 
     def reward(self, agent, world):
@@ -48,3 +48,15 @@ class Scenario(BaseScenario):
         for entity in world.landmarks:
             entity_pos.append(entity.state.p_pos - agent.state.p_pos)
         return np.concatenate([agent.state.p_vel] + entity_pos)
+
+    # batched versions of reward / observation for all agents (of one world or of a BatchWorld)
+    def rewards_all(self, world):
+        p_pos, _ = batch_state_arrays(world)
+        n = len(world.agents)
+        return agent_entries(world, -np.sum(np.square(p_pos[:, :n] - p_pos[:, n:n + 1]), axis=2))
+
+    def observations_all(self, world):
+        p_pos, p_vel = batch_state_arrays(world)
+        n = len(world.agents)
+        entity_pos = p_pos[:, None, n:] - p_pos[:, :n, None]
+        return agent_entries(world, np.concatenate([p_vel[:, :n], entity_pos.reshape(len(p_pos), n, -1)], axis=2))
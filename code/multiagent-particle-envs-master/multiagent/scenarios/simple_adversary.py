@@ -1,6 +1,6 @@
 import numpy as np
 from multiagent.core import World, Agent, Landmark
-from multiagent.scenario import BaseScenario
+from multiagent.scenario import BaseScenario, off_diagonal, batch_distances, world_values, agent_entries
 
 
 class Scenario(BaseScenario):
@@ -41,17 +41,17 @@ class Scenario(BaseScenario):
         for i, landmark in enumerate(world.landmarks):
             landmark.color = np.array([0.15, 0.15, 0.15])
         # set goal landmark
-        goal = np.random.choice(world.landmarks)
+        goal = world.np_random.choice(world.landmarks)
         goal.color = np.array([0.15, 0.65, 0.15])
         for agent in world.agents:
             agent.goal_a = goal
         # set random initial states
         for agent in world.agents:
-            agent.state.p_pos = np.random.uniform(-1, +1, world.dim_p)
+            agent.state.p_pos = world.np_random.uniform(-1, +1, world.dim_p)
             agent.state.p_vel = np.zeros(world.dim_p)
             agent.state.c = np.zeros(world.dim_c)
         for i, landmark in enumerate(world.landmarks):
-            landmark.state.p_pos = np.random.uniform(-1, +1, world.dim_p)
+            landmark.state.p_pos = world.np_random.uniform(-1, +1, world.dim_p)
             landmark.state.p_vel = np.zeros(world.dim_p)
 
     def benchmark_data(self, agent, world):
@@ -73,6 +73,12 @@ class Scenario(BaseScenario):
     def adversaries(self, world):
         return [agent for agent in world.agents if agent.adversary]
 
+    # whether the agent is close to its goal landmark
+    def at_goal(self, agent, world):
+        if world.broadphase:
+            return world.neighbours().within(agent, agent.goal_a, 2 * agent.goal_a.size)
+        return world.distances().distance(agent, agent.goal_a) < 2 * agent.goal_a.size
+
     def reward(self, agent, world):
         # Agents are rewarded based on minimum agent distance to each landmark
         return self.adversary_reward(agent, world) if agent.adversary else self.agent_reward(agent, world)
@@ -85,25 +91,24 @@ class Scenario(BaseScenario):
         # Calculate negative reward for adversary
         adversary_agents = self.adversaries(world)
         if shaped_adv_reward:  # distance-based adversary reward
-            adv_rew = sum([np.sqrt(np.sum(np.square(a.state.p_pos - a.goal_a.state.p_pos))) for a in adversary_agents])
+            adv_rew = sum([world.distances().distance(a, a.goal_a) for a in adversary_agents])
         else:  # proximity-based adversary reward (binary)
             adv_rew = 0
             for a in adversary_agents:
-                if np.sqrt(np.sum(np.square(a.state.p_pos - a.goal_a.state.p_pos))) < 2 * a.goal_a.size:
+                if self.at_goal(a, world):
                     adv_rew -= 5
 
         # Calculate positive reward for agents
         good_agents = self.good_agents(world)
         if shaped_reward:  # distance-based agent reward
             pos_rew = -min(
-                [np.sqrt(np.sum(np.square(a.state.p_pos - a.goal_a.state.p_pos))) for a in good_agents])
+                [world.distances().distance(a, a.goal_a) for a in good_agents])
         else:  # proximity-based agent reward (binary)
             pos_rew = 0
-            if min([np.sqrt(np.sum(np.square(a.state.p_pos - a.goal_a.state.p_pos))) for a in good_agents]) \
-                    < 2 * agent.goal_a.size:
+            if any([self.at_goal(a, world) for a in good_agents]):
                 pos_rew += 5
             pos_rew -= min(
-                [np.sqrt(np.sum(np.square(a.state.p_pos - a.goal_a.state.p_pos))) for a in good_agents])
+                [world.distances().distance(a, a.goal_a) for a in good_agents])
         return pos_rew + adv_rew
 
     def adversary_reward(self, agent, world):
@@ -113,7 +118,7 @@ class Scenario(BaseScenario):
             return -np.sum(np.square(agent.state.p_pos - agent.goal_a.state.p_pos))
         else:  # proximity-based reward (binary)
             adv_rew = 0
-            if np.sqrt(np.sum(np.square(agent.state.p_pos - agent.goal_a.state.p_pos))) < 2 * agent.goal_a.size:
+            if self.at_goal(agent, world):
                 adv_rew += 5
             return adv_rew
 
@@ -137,3 +142,34 @@ class Scenario(BaseScenario):
             return np.concatenate([agent.goal_a.state.p_pos - agent.state.p_pos] + entity_pos + other_pos)
         else:
             return np.concatenate(entity_pos + other_pos)
+
+    # batched versions of reward / observation for all agents (of one world or of a BatchWorld),
+    # shaped rewards as in reward
+    def rewards_all(self, world):
+        delta, dist, _ = batch_distances(world)
+        batch, n = len(dist), len(world.agents)
+        adversary = np.array([agent.adversary for agent in world.agents])
+        goal = world_values(world, lambda w: [w.entities.index(agent.goal_a) for agent in w.agents])
+        rows, agents = np.arange(batch)[:, None], np.arange(n)[None, :]
+        goal_dist = dist[rows, agents, goal]
+        # good agents: closeness of the nearest good agent to the goal, distance of the adversaries from it
+        agent_rew = -np.min(goal_dist[:, ~adversary], axis=1) + np.sum(goal_dist[:, adversary], axis=1)
+        adversary_rew = -np.sum(np.square(delta[rows, agents, goal]), axis=2)
+        return agent_entries(world, np.where(adversary, adversary_rew, agent_rew[:, None]))
+
+    def observations_all(self, world):
+        delta, _, _ = batch_distances(world)
+        batch, n = len(delta), len(world.agents)
+        # positions relative to each agent: relative[b, i, k] = p_pos[b, k] - p_pos[b, i]
+        relative = delta[:, :, :n].transpose(0, 2, 1, 3)
+        entity_pos = relative[:, :, n:].reshape(batch, n, -1)
+        other_pos = off_diagonal(relative[:, :, :n]).reshape(batch, n, -1)
+        goal = world_values(world, lambda w: [w.entities.index(agent.goal_a) for agent in w.agents])
+        goal_pos = relative[np.arange(batch)[:, None], np.arange(n)[None, :], goal]
+        obs_n = []
+        for i, agent in enumerate(world.agents):
+            parts = [entity_pos[:, i], other_pos[:, i]]
+            if not agent.adversary:
+                parts.insert(0, goal_pos[:, i])
+            obs_n.append(np.concatenate(parts, axis=1))
+        return agent_entries(world, obs_n)
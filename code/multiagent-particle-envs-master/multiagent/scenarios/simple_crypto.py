@@ -58,20 +58,20 @@ class Scenario(BaseScenario):
         for color, landmark in zip(color_list, world.landmarks):
             landmark.color = color
         # set goal landmark
-        goal = np.random.choice(world.landmarks)
+        goal = world.np_random.choice(world.landmarks)
         world.agents[1].color = goal.color
-        world.agents[2].key = np.random.choice(world.landmarks).color
+        world.agents[2].key = world.np_random.choice(world.landmarks).color
 
         for agent in world.agents:
             agent.goal_a = goal
 
         # set random initial states
         for agent in world.agents:
-            agent.state.p_pos = np.random.uniform(-1, +1, world.dim_p)
+            agent.state.p_pos = world.np_random.uniform(-1, +1, world.dim_p)
             agent.state.p_vel = np.zeros(world.dim_p)
             agent.state.c = np.zeros(world.dim_c)
         for i, landmark in enumerate(world.landmarks):
-            landmark.state.p_pos = np.random.uniform(-1, +1, world.dim_p)
+            landmark.state.p_pos = world.np_random.uniform(-1, +1, world.dim_p)
             landmark.state.p_vel = np.zeros(world.dim_p)
 
 
@@ -1,6 +1,7 @@
 import numpy as np
 from multiagent.core import World, Agent, Landmark
-from multiagent.scenario import BaseScenario
+from multiagent.scenario import (BaseScenario, off_diagonal, batch_state_arrays, batch_distances,
+                                world_values, agent_entries)
 
 class Scenario(BaseScenario):
     def make_world(self):
@@ -37,7 +38,7 @@ class Scenario(BaseScenario):
             landmark.color[i + 1] += 0.8
             landmark.index = i
         # set goal landmark
-        goal = np.random.choice(world.landmarks)
+        goal = world.np_random.choice(world.landmarks)
         for i, agent in enumerate(world.agents):
             agent.goal_a = goal
             agent.color = np.array([0.25, 0.25, 0.25])
@@ -48,11 +49,11 @@ class Scenario(BaseScenario):
                 agent.color[j + 1] += 0.5
         # set random initial states
         for agent in world.agents:
-            agent.state.p_pos = np.random.uniform(-1, +1, world.dim_p)
+            agent.state.p_pos = world.np_random.uniform(-1, +1, world.dim_p)
             agent.state.p_vel = np.zeros(world.dim_p)
             agent.state.c = np.zeros(world.dim_c)
         for i, landmark in enumerate(world.landmarks):
-            landmark.state.p_pos = np.random.uniform(-1, +1, world.dim_p)
+            landmark.state.p_pos = world.np_random.uniform(-1, +1, world.dim_p)
             landmark.state.p_vel = np.zeros(world.dim_p)
 
     def reward(self, agent, world):
@@ -61,15 +62,15 @@ class Scenario(BaseScenario):
 
     def agent_reward(self, agent, world):
         # the distance to the goal
-        return -np.sqrt(np.sum(np.square(agent.state.p_pos - agent.goal_a.state.p_pos)))
+        return -world.distances().distance(agent, agent.goal_a)
 
     def adversary_reward(self, agent, world):
         # keep the nearest good agents away from the goal
-        agent_dist = [np.sqrt(np.sum(np.square(a.state.p_pos - a.goal_a.state.p_pos))) for a in world.agents if not a.adversary]
+        agent_dist = [world.distances().distance(a, a.goal_a) for a in world.agents if not a.adversary]
         pos_rew = min(agent_dist)
         #nearest_agent = world.good_agents[np.argmin(agent_dist)]
         #neg_rew = np.sqrt(np.sum(np.square(nearest_agent.state.p_pos - agent.state.p_pos)))
-        neg_rew = np.sqrt(np.sum(np.square(agent.goal_a.state.p_pos - agent.state.p_pos)))
+        neg_rew = world.distances().distance(agent.goal_a, agent)
         #neg_rew = sum([np.sqrt(np.sum(np.square(a.state.p_pos - agent.state.p_pos))) for a in world.good_agents])
         return pos_rew - neg_rew
                
@@ -94,3 +95,36 @@ class Scenario(BaseScenario):
         else:
             #other_pos = list(reversed(other_pos)) if random.uniform(0,1) > 0.5 else other_pos  # randomize position of other agents in adversary network
             return np.concatenate([agent.state.p_vel] + entity_pos + other_pos)
+
+    # batched versions of reward / observation for all agents (of one world or of a BatchWorld)
+    def rewards_all(self, world):
+        _, dist, _ = batch_distances(world)
+        batch, n = len(dist), len(world.agents)
+        adversary = np.array([agent.adversary for agent in world.agents])
+        goal = world_values(world, lambda w: [w.entities.index(agent.goal_a) for agent in w.agents])
+        goal_dist = dist[np.arange(batch)[:, None], np.arange(n)[None, :], goal]
+        # adversaries keep the nearest good agent away from the goal
+        adversary_rew = np.min(goal_dist[:, ~adversary], axis=1)[:, None] - goal_dist
+        return agent_entries(world, np.where(adversary, adversary_rew, -goal_dist))
+
+    def observations_all(self, world):
+        _, p_vel = batch_state_arrays(world)
+        delta, _, _ = batch_distances(world)
+        batch, n = len(delta), len(world.agents)
+        # positions relative to each agent: relative[b, i, k] = p_pos[b, k] - p_pos[b, i]
+        relative = delta[:, :, :n].transpose(0, 2, 1, 3)
+        entity_pos = relative[:, :, n:].reshape(batch, n, -1)
+        other_pos = off_diagonal(relative[:, :, :n]).reshape(batch, n, -1)
+        goal = world_values(world, lambda w: [w.entities.index(agent.goal_a) for agent in w.agents])
+        goal_pos = relative[np.arange(batch)[:, None], np.arange(n)[None, :], goal]
+        # colors are set per world on reset
+        entity_color = world_values(world, lambda w: np.concatenate([entity.color for entity in w.landmarks]))
+        agent_color = world_values(world, lambda w: [agent.color for agent in w.agents])
+        obs_n = []
+        for i, agent in enumerate(world.agents):
+            if not agent.adversary:
+                obs_n.append(np.concatenate([p_vel[:, i], goal_pos[:, i], agent_color[:, i], entity_pos[:, i],
+                                             entity_color, other_pos[:, i]], axis=1))
+            else:
+                obs_n.append(np.concatenate([p_vel[:, i], entity_pos[:, i], other_pos[:, i]], axis=1))
+        return agent_entries(world, obs_n)
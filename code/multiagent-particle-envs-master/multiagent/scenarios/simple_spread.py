@@ -1,6 +1,7 @@
 import numpy as np
 from multiagent.core import World, Agent, Landmark
-from multiagent.scenario import BaseScenario
+from multiagent.scenario import (BaseScenario, off_diagonal, others, batch_state_arrays, batch_distances,
+                                world_values, agent_entries)
 
 
 class Scenario(BaseScenario):
@@ -37,11 +38,11 @@ class Scenario(BaseScenario):
             landmark.color = np.array([0.25, 0.25, 0.25])
         # set random initial states
         for agent in world.agents:
-            agent.state.p_pos = np.random.uniform(-1, +1, world.dim_p)
+            agent.state.p_pos = world.np_random.uniform(-1, +1, world.dim_p)
             agent.state.p_vel = np.zeros(world.dim_p)
             agent.state.c = np.zeros(world.dim_c)
         for i, landmark in enumerate(world.landmarks):
-            landmark.state.p_pos = np.random.uniform(-1, +1, world.dim_p)
+            landmark.state.p_pos = world.np_random.uniform(-1, +1, world.dim_p)
             landmark.state.p_vel = np.zeros(world.dim_p)
 
     def benchmark_data(self, agent, world):
@@ -50,20 +51,22 @@ class Scenario(BaseScenario):
         occupied_landmarks = 0
         min_dists = 0
         for l in world.landmarks:
-            dists = [np.sqrt(np.sum(np.square(a.state.p_pos - l.state.p_pos))) for a in world.agents]
+            dists = [world.distances().distance(a, l) for a in world.agents]
             min_dists += min(dists)
             rew -= min(dists)
             if min(dists) < 0.1:
                 occupied_landmarks += 1
         if agent.collide:
             for a in world.agents:
-                if self.is_collision(a, agent):
+                if self.is_collision(a, agent, world):
                     rew -= 1
                     collisions += 1
         return (rew, collisions, min_dists, occupied_landmarks)
 
 
-    def is_collision(self, agent1, agent2):
+    def is_collision(self, agent1, agent2, world=None):
+        if world is not None:
+            return world.distances().is_collision(agent1, agent2)
         delta_pos = agent1.state.p_pos - agent2.state.p_pos
         dist = np.sqrt(np.sum(np.square(delta_pos)))
         dist_min = agent1.size + agent2.size
@@ -73,11 +76,11 @@ class Scenario(BaseScenario):
         # Agents are rewarded based on minimum agent distance to each landmark, penalized for collisions
         rew = 0
         for l in world.landmarks:
-            dists = [np.sqrt(np.sum(np.square(a.state.p_pos - l.state.p_pos))) for a in world.agents]
+            dists = [world.distances().distance(a, l) for a in world.agents]
             rew -= min(dists)
         if agent.collide:
             for a in world.agents:
-                if self.is_collision(a, agent):
+                if self.is_collision(a, agent, world):
                     rew -= 1
         return rew
 
@@ -98,3 +101,27 @@ class Scenario(BaseScenario):
             comm.append(other.state.c)
             other_pos.append(other.state.p_pos - agent.state.p_pos)
         return np.concatenate([agent.state.p_vel] + [agent.state.p_pos] + entity_pos + other_pos + comm)
+
+    # batched versions of reward / observation for all agents (of one world or of a BatchWorld)
+    def rewards_all(self, world):
+        _, dist, collision = batch_distances(world)
+        n = len(world.agents)
+        # minimum agent distance to each landmark (shared by all agents)
+        rew = -np.sum(np.min(dist[:, :n, n:], axis=1), axis=1)
+        # collisions (every colliding agent also counts itself, as in reward)
+        collide = np.array([agent.collide for agent in world.agents])
+        collisions = np.sum(collision[:, :n, :n], axis=2)
+        return agent_entries(world, rew[:, None] - np.where(collide, collisions, 0))
+
+    def observations_all(self, world):
+        p_pos, p_vel = batch_state_arrays(world)
+        delta, _, _ = batch_distances(world)
+        batch, n = len(p_pos), len(world.agents)
+        # positions relative to each agent: relative[b, i, k] = p_pos[b, k] - p_pos[b, i]
+        relative = delta[:, :, :n].transpose(0, 2, 1, 3)
+        entity_pos = relative[:, :, n:]
+        other_pos = off_diagonal(relative[:, :, :n])
+        comm = others(world_values(world, lambda w: [agent.state.c for agent in w.agents]))
+        return agent_entries(world, np.concatenate([p_vel[:, :n], p_pos[:, :n], entity_pos.reshape(batch, n, -1),
+                                                    other_pos.reshape(batch, n, -1), comm.reshape(batch, n, -1)],
+                                                   axis=2))
@@ -1,6 +1,7 @@
 import numpy as np
 from multiagent.core import World, Agent, Landmark
-from multiagent.scenario import BaseScenario
+from multiagent.scenario import (BaseScenario, off_diagonal, others, bound_penalty, batch_state_arrays,
+                                batch_distances, agent_entries)
 
 
 class Scenario(BaseScenario):
@@ -45,12 +46,12 @@ class Scenario(BaseScenario):
             landmark.color = np.array([0.25, 0.25, 0.25])
         # set random initial states
         for agent in world.agents:
-            agent.state.p_pos = np.random.uniform(-1, +1, world.dim_p)
+            agent.state.p_pos = world.np_random.uniform(-1, +1, world.dim_p)
             agent.state.p_vel = np.zeros(world.dim_p)
             agent.state.c = np.zeros(world.dim_c)
         for i, landmark in enumerate(world.landmarks):
             if not landmark.boundary:
-                landmark.state.p_pos = np.random.uniform(-0.9, +0.9, world.dim_p)
+                landmark.state.p_pos = world.np_random.uniform(-0.9, +0.9, world.dim_p)
                 landmark.state.p_vel = np.zeros(world.dim_p)
 
 
@@ -59,14 +60,18 @@ class Scenario(BaseScenario):
         if agent.adversary:
             collisions = 0
             for a in self.good_agents(world):
-                if self.is_collision(a, agent):
+                if self.is_collision(a, agent, world):
                     collisions += 1
             return collisions
         else:
             return 0
 
 
-    def is_collision(self, agent1, agent2):
+    def is_collision(self, agent1, agent2, world=None):
+        if world is not None:
+            if world.broadphase:
+                return world.neighbours().overlapping(agent1, agent2)
+            return world.distances().is_collision(agent1, agent2)
         delta_pos = agent1.state.p_pos - agent2.state.p_pos
         dist = np.sqrt(np.sum(np.square(delta_pos)))
         dist_min = agent1.size + agent2.size
@@ -80,6 +85,12 @@ class Scenario(BaseScenario):
     def adversaries(self, world):
         return [agent for agent in world.agents if agent.adversary]
 
+    # return the adversaries that may touch the given agent
+    def nearby_adversaries(self, agent, world):
+        if world.broadphase:
+            return [other for other in world.neighbours().neighbours_of(agent) if getattr(other, 'adversary', False)]
+        return self.adversaries(world)
+
 
     def reward(self, agent, world):
         # Agents are rewarded based on minimum agent distance to each landmark
@@ -93,10 +104,10 @@ class Scenario(BaseScenario):
         adversaries = self.adversaries(world)
         if shape:  # reward can optionally be shaped (increased reward for increased distance from adversary)
             for adv in adversaries:
-                rew += 0.1 * np.sqrt(np.sum(np.square(agent.state.p_pos - adv.state.p_pos)))
+                rew += 0.1 * world.distances().distance(agent, adv)
         if agent.collide:
-            for a in adversaries:
-                if self.is_collision(a, agent):
+            for a in self.nearby_adversaries(agent, world):
+                if self.is_collision(a, agent, world):
                     rew -= 10
 
         # agents are penalized for exiting the screen, so that they can be caught by the adversaries
@@ -120,11 +131,11 @@ class Scenario(BaseScenario):
         adversaries = self.adversaries(world)
         if shape:  # reward can optionally be shaped (decreased reward for increased distance from agents)
             for adv in adversaries:
-                rew -= 0.1 * min([np.sqrt(np.sum(np.square(a.state.p_pos - adv.state.p_pos))) for a in agents])
+                rew -= 0.1 * min([world.distances().distance(a, adv) for a in agents])
         if agent.collide:
             for ag in agents:
-                for adv in adversaries:
-                    if self.is_collision(ag, adv):
+                for adv in self.nearby_adversaries(ag, world):
+                    if self.is_collision(ag, adv, world):
                         rew += 10
         return rew
 
@@ -145,3 +156,43 @@ class Scenario(BaseScenario):
             if not other.adversary:
                 other_vel.append(other.state.p_vel)
         return np.concatenate([agent.state.p_vel] + [agent.state.p_pos] + entity_pos + other_pos + other_vel)
+
+    # batched versions of reward / observation for all agents (of one world or of a BatchWorld)
+    def rewards_all(self, world):
+        p_pos, _ = batch_state_arrays(world)
+        n = len(world.agents)
+        agent_pos = p_pos[:, :n]
+        adversary = np.array([agent.adversary for agent in world.agents])
+        collide = np.array([agent.collide for agent in world.agents])
+        # collisions of good agents (rows) with adversaries (columns)
+        collision = batch_distances(world)[2][:, :n, :n] & ~adversary[:, None] & adversary[None, :]
+        # agents are penalized if caught by adversaries and for exiting the screen
+        agent_rew = np.where(collide, -10.0 * np.sum(collision, axis=2), 0.0)
+        bound = bound_penalty(agent_pos)
+        for p in range(world.dim_p):
+            agent_rew -= bound[:, :, p]
+        # adversaries are rewarded for all collisions with agents
+        adversary_rew = np.where(collide, 10.0 * np.sum(collision, axis=(1, 2))[:, None], 0.0)
+        return agent_entries(world, np.where(adversary, adversary_rew, agent_rew))
+
+    def observations_all(self, world):
+        p_pos, p_vel = batch_state_arrays(world)
+        batch, n = len(p_pos), len(world.agents)
+        agent_pos, agent_vel = p_pos[:, :n], p_vel[:, :n]
+        landmarks = n + np.flatnonzero([not entity.boundary for entity in world.landmarks])
+        # positions relative to each agent: relative[b, i, k] = p_pos[b, k] - p_pos[b, i]
+        relative = batch_distances(world)[0][:, :, :n].transpose(0, 2, 1, 3)
+        entity_pos = relative[:, :, landmarks].reshape(batch, n, -1)
+        other_pos = off_diagonal(relative[:, :, :n]).reshape(batch, n, -1)
+        other_vel = others(agent_vel)
+        adversary = np.array([agent.adversary for agent in world.agents])
+        other_good = others(~adversary[None])[0]
+        obs_n = [None] * n
+        # agents of the same kind see the velocities of the same number of good agents
+        for rows in [np.flatnonzero(adversary), np.flatnonzero(~adversary)]:
+            vel = other_vel[:, rows][:, other_good[rows]].reshape(batch, len(rows), -1)
+            obs = np.concatenate([agent_vel[:, rows], agent_pos[:, rows], entity_pos[:, rows], other_pos[:, rows], vel],
+                                 axis=2)
+            for k, i in enumerate(rows):
+                obs_n[i] = obs[:, k]
+        return agent_entries(world, obs_n)
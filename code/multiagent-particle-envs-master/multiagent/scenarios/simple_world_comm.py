@@ -1,6 +1,8 @@
 import numpy as np
 from multiagent.core import World, Agent, Landmark
-from multiagent.scenario import BaseScenario
+from multiagent.scenario import (BaseScenario, off_diagonal, others, bound_penalty, pair_distances,
+                                pair_collisions, batch_state_arrays, batch_distances, world_values,
+                                agent_entries)
 
 
 class Scenario(BaseScenario):
@@ -99,31 +101,35 @@ class Scenario(BaseScenario):
             landmark.color = np.array([0.6, 0.9, 0.6])
         # set random initial states
         for agent in world.agents:
-            agent.state.p_pos = np.random.uniform(-1, +1, world.dim_p)
+            agent.state.p_pos = world.np_random.uniform(-1, +1, world.dim_p)
             agent.state.p_vel = np.zeros(world.dim_p)
             agent.state.c = np.zeros(world.dim_c)
         for i, landmark in enumerate(world.landmarks):
-            landmark.state.p_pos = np.random.uniform(-0.9, +0.9, world.dim_p)
+            landmark.state.p_pos = world.np_random.uniform(-0.9, +0.9, world.dim_p)
             landmark.state.p_vel = np.zeros(world.dim_p)
         for i, landmark in enumerate(world.food):
-            landmark.state.p_pos = np.random.uniform(-0.9, +0.9, world.dim_p)
+            landmark.state.p_pos = world.np_random.uniform(-0.9, +0.9, world.dim_p)
             landmark.state.p_vel = np.zeros(world.dim_p)
         for i, landmark in enumerate(world.forests):
-            landmark.state.p_pos = np.random.uniform(-0.9, +0.9, world.dim_p)
+            landmark.state.p_pos = world.np_random.uniform(-0.9, +0.9, world.dim_p)
             landmark.state.p_vel = np.zeros(world.dim_p)
 
     def benchmark_data(self, agent, world):
         if agent.adversary:
             collisions = 0
             for a in self.good_agents(world):
-                if self.is_collision(a, agent):
+                if self.is_collision(a, agent, world):
                     collisions += 1
             return collisions
         else:
             return 0
 
 
-    def is_collision(self, agent1, agent2):
+    def is_collision(self, agent1, agent2, world=None):
+        if world is not None:
+            if world.broadphase:
+                return world.neighbours().overlapping(agent1, agent2)
+            return world.distances().is_collision(agent1, agent2)
         delta_pos = agent1.state.p_pos - agent2.state.p_pos
         dist = np.sqrt(np.sum(np.square(delta_pos)))
         dist_min = agent1.size + agent2.size
@@ -138,6 +144,12 @@ class Scenario(BaseScenario):
     def adversaries(self, world):
         return [agent for agent in world.agents if agent.adversary]
 
+    # return the adversaries that may touch the given agent
+    def nearby_adversaries(self, agent, world):
+        if world.broadphase:
+            return [other for other in world.neighbours().neighbours_of(agent) if getattr(other, 'adversary', False)]
+        return self.adversaries(world)
+
 
     def reward(self, agent, world):
         # Agents are rewarded based on minimum agent distance to each landmark
@@ -159,10 +171,10 @@ class Scenario(BaseScenario):
         adversaries = self.adversaries(world)
         if shape:
             for adv in adversaries:
-                rew += 0.1 * np.sqrt(np.sum(np.square(agent.state.p_pos - adv.state.p_pos)))
+                rew += 0.1 * world.distances().distance(agent, adv)
         if agent.collide:
-            for a in adversaries:
-                if self.is_collision(a, agent):
+            for a in self.nearby_adversaries(agent, world):
+                if self.is_collision(a, agent, world):
                     rew -= 5
         def bound(x):
             if x < 0.9:
@@ -176,9 +188,9 @@ class Scenario(BaseScenario):
             rew -= 2 * bound(x)
 
         for food in world.food:
-            if self.is_collision(agent, food):
+            if self.is_collision(agent, food, world):
                 rew += 2
-        rew += 0.05 * min([np.sqrt(np.sum(np.square(food.state.p_pos - agent.state.p_pos))) for food in world.food])
+        rew += 0.05 * min([world.distances().distance(food, agent) for food in world.food])
 
         return rew
 
@@ -189,11 +201,11 @@ class Scenario(BaseScenario):
         agents = self.good_agents(world)
         adversaries = self.adversaries(world)
         if shape:
-            rew -= 0.1 * min([np.sqrt(np.sum(np.square(a.state.p_pos - agent.state.p_pos))) for a in agents])
+            rew -= 0.1 * min([world.distances().distance(a, agent) for a in agents])
         if agent.collide:
             for ag in agents:
-                for adv in adversaries:
-                    if self.is_collision(ag, adv):
+                for adv in self.nearby_adversaries(ag, world):
+                    if self.is_collision(ag, adv, world):
                         rew += 5
         return rew
 
@@ -231,10 +243,10 @@ class Scenario(BaseScenario):
         in_forest = [np.array([-1]), np.array([-1])]
         inf1 = False
         inf2 = False
-        if self.is_collision(agent, world.forests[0]):
+        if self.is_collision(agent, world.forests[0], world):
             in_forest[0] = np.array([1])
             inf1= True
-        if self.is_collision(agent, world.forests[1]):
+        if self.is_collision(agent, world.forests[1], world):
             in_forest[1] = np.array([1])
             inf2 = True
 
@@ -249,8 +261,8 @@ class Scenario(BaseScenario):
         for other in world.agents:
             if other is agent: continue
             comm.append(other.state.c)
-            oth_f1 = self.is_collision(other, world.forests[0])
-            oth_f2 = self.is_collision(other, world.forests[1])
+            oth_f1 = self.is_collision(other, world.forests[0], world)
+            oth_f2 = self.is_collision(other, world.forests[1], world)
             if (inf1 and oth_f1) or (inf2 and oth_f2) or (not inf1 and not oth_f1 and not inf2 and not oth_f2) or agent.leader:  #without forest vis
                 other_pos.append(other.state.p_pos - agent.state.p_pos)
                 if not other.adversary:
@@ -264,14 +276,14 @@ class Scenario(BaseScenario):
         prey_forest = []
         ga = self.good_agents(world)
         for a in ga:
-            if any([self.is_collision(a, f) for f in world.forests]):
+            if any([self.is_collision(a, f, world) for f in world.forests]):
                 prey_forest.append(np.array([1]))
             else:
                 prey_forest.append(np.array([-1]))
         # to tell leader when pred are in forest
         prey_forest_lead = []
         for f in world.forests:
-            if any([self.is_collision(a, f) for a in ga]):
+            if any([self.is_collision(a, f, world) for a in ga]):
                 prey_forest_lead.append(np.array([1]))
             else:
                 prey_forest_lead.append(np.array([-1]))
@@ -286,4 +298,64 @@ class Scenario(BaseScenario):
         else:
             return np.concatenate([agent.state.p_vel] + [agent.state.p_pos] + entity_pos + other_pos + in_forest + other_vel)
 
-
+    # batched versions of reward / observation for all agents (of one world or of a BatchWorld)
+    def rewards_all(self, world):
+        p_pos, _ = batch_state_arrays(world)
+        n = len(world.agents)
+        agent_pos = p_pos[:, :n]
+        adversary = np.array([agent.adversary for agent in world.agents])
+        collide = np.array([agent.collide for agent in world.agents])
+        _, dist, collision = batch_distances(world)
+        dist = dist[:, :n, :n]
+        # collisions of good agents (rows) with adversaries (columns)
+        collision = collision[:, :n, :n] & ~adversary[:, None] & adversary[None, :]
+        # agents are penalized if caught and for exiting the screen, rewarded for reaching food
+        agent_rew = np.where(collide, -5.0 * np.sum(collision, axis=2), 0.0)
+        bound = bound_penalty(agent_pos)
+        for p in range(world.dim_p):
+            agent_rew -= 2 * bound[:, :, p]
+        agent_rew += 2 * np.sum(pair_collisions(world, world.agents, world.food), axis=2)
+        agent_rew += 0.05 * np.min(pair_distances(world, world.agents, world.food), axis=2)
+        # adversaries are rewarded for closeness to the nearest agent and for all collisions with agents
+        adversary_rew = -0.1 * np.min(dist[:, :, ~adversary], axis=2)
+        adversary_rew += np.where(collide, 5.0 * np.sum(collision, axis=(1, 2))[:, None], 0.0)
+        return agent_entries(world, np.where(adversary, adversary_rew, agent_rew))
+
+    def observations_all(self, world):
+        p_pos, p_vel = batch_state_arrays(world)
+        batch, n = len(p_pos), len(world.agents)
+        agent_pos, agent_vel = p_pos[:, :n], p_vel[:, :n]
+        landmarks = n + np.flatnonzero([not entity.boundary for entity in world.landmarks])
+        # positions relative to each agent: relative[b, i, k] = p_pos[b, k] - p_pos[b, i]
+        relative = batch_distances(world)[0][:, :, :n].transpose(0, 2, 1, 3)
+        entity_pos = relative[:, :, landmarks].reshape(batch, n, -1)
+        adversary = np.array([agent.adversary for agent in world.agents])
+        leader = np.array([agent.leader for agent in world.agents])
+        # forests each agent is in
+        in_forest = pair_collisions(world, world.agents, world.forests)
+        # other agents are visible when both are in the same forest or both outside any forest (always for the leader)
+        outside = ~np.any(in_forest, axis=2)
+        visible = np.any(in_forest[:, :, None, :] & in_forest[:, None, :, :], axis=-1)
+        visible |= outside[:, :, None] & outside[:, None, :]
+        visible |= leader[:, None]
+        other_visible = off_diagonal(visible)
+        other_pos = np.where(other_visible[..., None], off_diagonal(relative[:, :, :n]), 0.0).reshape(batch, n, -1)
+        other_vel = np.where(other_visible[..., None], others(agent_vel), 0.0)
+        other_good = others(~adversary[None])[0]
+        in_forest = np.where(in_forest, 1.0, -1.0)
+        comm = np.broadcast_to(world_values(world, lambda w: w.agents[0].state.c)[:, None], (batch, n, world.dim_c))
+        obs_n = [None] * n
+        # agents of the same kind get the same observation layout
+        for is_adversary, is_leader in set(zip(adversary, leader)):
+            rows = np.flatnonzero((adversary == is_adversary) & (leader == is_leader))
+            vel = other_vel[:, rows][:, other_good[rows]].reshape(batch, len(rows), -1)
+            if is_adversary or is_leader:
+                parts = [agent_vel[:, rows], agent_pos[:, rows], entity_pos[:, rows], other_pos[:, rows], vel,
+                         in_forest[:, rows], comm[:, rows]]
+            else:
+                parts = [agent_vel[:, rows], agent_pos[:, rows], entity_pos[:, rows], other_pos[:, rows],
+                         in_forest[:, rows], vel]
+            obs = np.concatenate(parts, axis=2)
+            for k, i in enumerate(rows):
+                obs_n[i] = obs[:, k]
+        return agent_entries(world, obs_n)